@@ -0,0 +1,304 @@
+import os
+import math
+import time
+import uuid
+import heapq
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot start generating before its deadline"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits how many LLM generations run at once in this process.
+
+    Up to max_in_flight requests run concurrently. Further requests wait in a
+    bounded priority queue, so interactive chat turns start before background
+    work. A request is rejected immediately when the queue is full or its
+    estimated wait exceeds its deadline, and after the deadline otherwise, so
+    callers can answer with a fast 503 instead of piling onto a saturated
+    Ollama instance.
+    """
+
+    def __init__(self, max_in_flight: int = None, max_queue: int = None, queue_timeout: float = None):
+        self.max_in_flight = max_in_flight or int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "2"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("OLLAMA_MAX_QUEUE", "16"))
+        self.queue_timeout = queue_timeout or float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "10"))
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        # Exponentially weighted average of generation time, used to estimate waits
+        self._avg_service_time = 5.0
+        self._admitted = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _estimated_wait(self, position: int) -> float:
+        """Estimate how long a request at this queue position will wait"""
+        return self._avg_service_time * (position + 1) / self.max_in_flight
+
+    def _retry_after(self) -> int:
+        """Suggest how many seconds a rejected client should wait"""
+        return max(1, min(60, math.ceil(self._estimated_wait(len(self._waiters)))))
+
+    def _reject(self, reason: str):
+        self._rejected += 1
+        logger.warning(f"LLM request rejected: {reason} (in_flight={self._in_flight}, queued={len(self._waiters)})")
+        raise AdmissionRejected(reason, self._retry_after())
+
+    def acquire(self, priority: int = PRIORITY_DEFAULT, timeout: Optional[float] = None) -> Optional[str]:
+        """Wait for a generation slot or raise AdmissionRejected; returns the token to release it with"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                self._record_admission(0.0)
+                return None
+
+            if len(self._waiters) >= self.max_queue:
+                self._reject("queue is full")
+            ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+            if self._estimated_wait(ahead) > timeout:
+                self._reject("estimated wait exceeds deadline")
+
+            # [priority, sequence, granted]; the sequence keeps FIFO order within a priority
+            entry = [priority, next(self._sequence), False]
+            heapq.heappush(self._waiters, entry)
+            deadline = start + timeout
+
+            while not entry[2]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._reject("deadline expired while queued")
+                self._cond.wait(remaining)
+
+            self._record_admission(time.monotonic() - start)
+            return None
+
+    def _record_service_time(self, service_time: Optional[float]):
+        if service_time is not None:
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+
+    def release(self, service_time: Optional[float] = None, token: Optional[str] = None):
+        """Free a slot, handing it straight to the highest-priority waiter"""
+        with self._cond:
+            self._record_service_time(service_time)
+            if self._waiters:
+                # The slot is transferred, so the in-flight count is unchanged
+                entry = heapq.heappop(self._waiters)
+                entry[2] = True
+                self._cond.notify_all()
+            else:
+                self._in_flight -= 1
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_DEFAULT, timeout: Optional[float] = None):
+        """Hold a generation slot for the duration of the block"""
+        token = self.acquire(priority, timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start, token)
+
+    def _record_admission(self, wait: float):
+        self._admitted += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return queue depth, wait time and reject counts"""
+        with self._cond:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "avg_wait_seconds": round(self._total_wait / self._admitted, 3) if self._admitted else 0.0,
+                "max_wait_seconds": round(self._max_wait, 3),
+                "avg_generation_seconds": round(self._avg_service_time, 3),
+            }
+
+
+class SharedAdmissionController(AdmissionController):
+    """
+    Limits how many LLM generations run at once across every web and Celery process.
+
+    Slots and the wait queue live in Redis. Each request takes a ticket in a
+    sorted set ordered by priority and then arrival. It may start once the slot
+    holders plus the tickets ahead of it are fewer than max_in_flight, and then
+    it moves its ticket to the holders set in one transaction. Counting only the
+    tickets ahead keeps the limit exact without a lock. Holders and waiters
+    carry expiry times, so a crashed process cannot keep its slot or its place.
+
+    While Redis is unreachable, requests are limited by the in-process
+    controller instead, and Redis is retried after retry_interval seconds.
+    """
+
+    KEY_PREFIX = "llm-admission:"
+    HOLDERS_KEY = "llm-admission:holders"
+    QUEUE_KEY = "llm-admission:queue"
+    DEADLINES_KEY = "llm-admission:deadlines"
+    SEQUENCE_KEY = "llm-admission:sequence"
+    # Tickets are ordered by priority first, then by arrival
+    PRIORITY_STRIDE = 10 ** 12
+
+    def __init__(self, client=None, max_in_flight: int = None, max_queue: int = None, queue_timeout: float = None):
+        super().__init__(max_in_flight, max_queue, queue_timeout)
+        self.url = os.getenv("OLLAMA_ADMISSION_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+        # Upper bound on a generation; the slot is reclaimed after this if its holder dies
+        self.lease = float(os.getenv("OLLAMA_ADMISSION_LEASE", "600"))
+        self.poll_interval = float(os.getenv("OLLAMA_ADMISSION_POLL_MS", "50")) / 1000
+        self.retry_interval = 30
+        self._client = client
+        self._disabled_until = 0.0
+
+    @property
+    def client(self):
+        if self._client is None and REDIS_AVAILABLE:
+            self._client = redis.Redis.from_url(self.url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        return self._client
+
+    def _usable(self) -> bool:
+        return self.client is not None and time.monotonic() >= self._disabled_until
+
+    def _fail(self, action: str, error: Exception):
+        logger.error(f"Shared LLM admission {action} failed, limiting per process for {self.retry_interval}s: "
+                     f"{str(error)}")
+        self._disabled_until = time.monotonic() + self.retry_interval
+
+    def _purge(self, now: float):
+        """Drop slots whose lease ran out and tickets whose waiter is past its deadline"""
+        abandoned = self.client.zrangebyscore(self.DEADLINES_KEY, 0, now)
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.HOLDERS_KEY, 0, now)
+        if abandoned:
+            pipe.zrem(self.QUEUE_KEY, *abandoned)
+            pipe.zrem(self.DEADLINES_KEY, *abandoned)
+        pipe.execute()
+
+    def _leave_queue(self, token: str):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.QUEUE_KEY, token)
+        pipe.zrem(self.DEADLINES_KEY, token)
+        pipe.execute()
+
+    def _shared_reject(self, reason: str, ahead: int, token: Optional[str] = None):
+        if token is not None:
+            self._leave_queue(token)
+        self._rejected += 1
+        logger.warning(f"LLM request rejected: {reason} (queued ahead={ahead})")
+        raise AdmissionRejected(reason, max(1, min(60, math.ceil(self._estimated_wait(ahead)))))
+
+    def acquire(self, priority: int = PRIORITY_DEFAULT, timeout: Optional[float] = None) -> Optional[str]:
+        if not self._usable():
+            return super().acquire(priority, timeout)
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = time.time() + timeout
+        token = uuid.uuid4().hex
+        try:
+            self._purge(time.time())
+            queued = self.client.zcard(self.QUEUE_KEY)
+            if queued >= self.max_queue and self.client.zcard(self.HOLDERS_KEY) >= self.max_in_flight:
+                self._shared_reject("queue is full", queued)
+            ticket = priority * self.PRIORITY_STRIDE + self.client.incr(self.SEQUENCE_KEY)
+            pipe = self.client.pipeline()
+            pipe.zadd(self.QUEUE_KEY, {token: ticket})
+            pipe.zadd(self.DEADLINES_KEY, {token: deadline})
+            pipe.execute()
+
+            first = True
+            while True:
+                # One transaction, so a ticket moving from the queue to the holders is counted exactly once
+                pipe = self.client.pipeline()
+                pipe.zcard(self.HOLDERS_KEY)
+                pipe.zrank(self.QUEUE_KEY, token)
+                holders, ahead = pipe.execute()
+                if ahead is None:
+                    # Purged by another process, so this request outlived its deadline
+                    self._shared_reject("deadline expired while queued", 0)
+                if holders + ahead < self.max_in_flight:
+                    pipe = self.client.pipeline()
+                    pipe.zadd(self.HOLDERS_KEY, {token: time.time() + self.lease})
+                    pipe.zrem(self.QUEUE_KEY, token)
+                    pipe.zrem(self.DEADLINES_KEY, token)
+                    pipe.execute()
+                    self._record_admission(time.monotonic() - start)
+                    return token
+                if first and self._estimated_wait(ahead) > timeout:
+                    self._shared_reject("estimated wait exceeds deadline", ahead, token)
+                first = False
+                if time.time() + self.poll_interval > deadline:
+                    self._shared_reject("deadline expired while queued", ahead, token)
+                time.sleep(self.poll_interval)
+                self._purge(time.time())
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            self._fail("acquire", e)
+            remaining = timeout - (time.monotonic() - start)
+            return super().acquire(priority, max(0.0, remaining))
+
+    def release(self, service_time: Optional[float] = None, token: Optional[str] = None):
+        if token is None:
+            # Admitted by the in-process controller while Redis was unreachable
+            return super().release(service_time)
+        with self._cond:
+            self._record_service_time(service_time)
+        try:
+            self.client.zrem(self.HOLDERS_KEY, token)
+        except Exception as e:
+            # The slot is reclaimed when its lease runs out
+            self._fail("release", e)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return queue depth, wait time and reject counts; in-flight and queue depth are global"""
+        metrics = super().metrics()
+        metrics["shared"] = False
+        if self._usable():
+            try:
+                self._purge(time.time())
+                pipe = self.client.pipeline()
+                pipe.zcard(self.HOLDERS_KEY)
+                pipe.zcard(self.QUEUE_KEY)
+                in_flight, queued = pipe.execute()
+                metrics.update(shared=True, in_flight=in_flight, queue_depth=queued)
+            except Exception as e:
+                self._fail("metrics", e)
+        return metrics
+
+
+# Create a singleton instance shared by all LLM calls, in web and Celery processes alike
+ollama_admission = SharedAdmissionController()
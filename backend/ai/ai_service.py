@@ -1,15 +1,28 @@
 import os
+import json
 import requests
 import logging
 import time
 import re
-from typing import Optional, Dict, Any, Tuple, List
+from typing import Optional, Dict, Any, Tuple, List, Iterator
 from django.conf import settings
 
+from .http_client import ollama_http_client
+from .backends import ollama_router
+from .health import OllamaHealthMonitor
+from .circuit_breaker import CircuitBreaker
+from .admission import ollama_admission, AdmissionRejected, PRIORITY_DEFAULT
+from .prompting import ChatPromptBuilder, estimate_tokens, truncate_to_tokens
+from .summarizer import ConversationSummarizer
+from .response_cache import semantic_response_cache
+from .prompt_cache import prompt_response_cache
+from .context_assembler import context_assembler
+from .query_router import query_router, RouteDecision, ROUTE_OFF_TOPIC
+
 # Import content embedding service for RAG
 try:
-    from content.embeddings import content_embedding_service
-    CONTENT_RAG_AVAILABLE = True
+    from content.embeddings import content_embedding_service, EMBEDDING_MODEL_AVAILABLE
+    CONTENT_RAG_AVAILABLE = EMBEDDING_MODEL_AVAILABLE
 except ImportError:
     CONTENT_RAG_AVAILABLE = False
 
@@ -18,141 +31,346 @@ logger = logging.getLogger(__name__)
 
 class OllamaService:
     def __init__(self):
-        self.base_url = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
+        self.router = ollama_router
+        self.base_url = self.router.primary_url
         self.model_name = os.getenv("OLLAMA_MODEL", "llama3")
         self.connection_timeout = int(os.getenv("OLLAMA_TIMEOUT", "5"))
+        self.pull_timeout = int(os.getenv("OLLAMA_PULL_TIMEOUT", "30"))
+        self.http = ollama_http_client
+        self.circuit_breaker = CircuitBreaker("ollama")
+        self.admission = ollama_admission
+        self.prompt_builder = ChatPromptBuilder()
+        self.semantic_cache = semantic_response_cache
+        self.prompt_cache = prompt_response_cache
+        self.query_router = query_router
+        self.context_assembler = context_assembler
         self.max_retries = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
         self.use_rag = os.getenv("USE_CONTENT_RAG", "True").lower() == "true"
         
-    def _get_relevant_university_content(self, query: str) -> Optional[str]:
-        """Retrieve relevant university content using RAG"""
+    def _get_relevant_university_content(self, query: str, university_id: Optional[int] = None,
+                                         route: Optional[RouteDecision] = None) -> Optional[str]:
+        """
+        Retrieve relevant university content using RAG, scoped to the student's university if known
+
+        route is the query's decision if the caller has already routed it.
+        """
         if not self.use_rag or not CONTENT_RAG_AVAILABLE:
             return None
             
         try:
-            # Check if query is related to university content
-            university_keywords = [
-                "university", "campus", "lecture", "course", "professor", 
-                "student", "class", "study", "academic", "faculty", "event", 
-                "news", "deadline", "program", "department", "school", "college",
-                "northampton", "graduation", "semester", "exam", "research",
-                "what's happening", "upcoming", "this week", "announcement"
-            ]
-            
-            # Simple keyword check - could be replaced with a more sophisticated classifier
-            if not any(keyword in query.lower() for keyword in university_keywords):
+            # Only queries about the university need retrieval
+            if not (route or self.route_query(query)).use_retrieval:
                 return None
                 
-            # Get relevant content
+            # Fetch more results than fit, so the assembler can skip weak and redundant ones
             logger.info(f"Searching for university content related to: {query}")
-            results = content_embedding_service.retrieve_relevant_content(query, k=3)
+            results = content_embedding_service.retrieve_relevant_content(
+                query, k=self.context_assembler.candidates, university_id=university_id, include_embeddings=True
+            )
             
             if not results:
                 logger.info("No relevant university content found")
                 return None
-                
-            # Format the content as context for the AI
-            context_parts = ["Here is some relevant information about the university:"]
             
-            for idx, item in enumerate(results):
-                if item['content_type'] == 'news':
-                    context_parts.append(f"NEWS: {item['title']}. {item['summary']}")
-                elif item['content_type'] == 'event':
-                    date_info = f"Date: {item['published_date']}" if item['published_date'] else ""
-                    context_parts.append(f"EVENT: {item['title']}. {date_info}. {item['summary']}")
-                else:
-                    context_parts.append(f"{item['title']}. {item['summary']}")
-                    
-                # Add source information
-                if item['source_name'] and item['university_name']:
-                    context_parts.append(f"Source: {item['source_name']} at {item['university_name']}")
-                
-                # Add URL if available
-                if item['url']:
-                    context_parts.append(f"More information: {item['url']}")
-                    
-                # Add separator between items
-                if idx < len(results) - 1:
-                    context_parts.append("---")
-            
-            context = "\n".join(context_parts)
-            logger.info(f"Added university content context using RAG")
-            return context
+            context = self.context_assembler.assemble(results)
+            if not context.items:
+                logger.info("No university content passed the relevance cutoff")
+                return None
+            return context.text
         
         except Exception as e:
             logger.error(f"Error retrieving university content: {str(e)}")
             return None
         
-    def generate_response(self, prompt: str, max_length: int = 512) -> str:
-        """Generate a response using Ollama API with RAG enhancement for university content."""
-        # Try to get relevant university content
-        university_context = self._get_relevant_university_content(prompt)
-        
+    def _build_prompt(self, prompt: str, university_context: Optional[str], max_length: int = 0) -> str:
+        """Enrich the prompt with relevant university content when available"""
         # Add university context to prompt if available
-        enriched_prompt = prompt
         if university_context:
-            enriched_prompt = f"{university_context}\n\nUser query: {prompt}\n\nPlease answer the query using the provided university information when relevant:"
-            
+            template = "{}\n\nUser query: {}\n\nPlease answer the query using the provided university information when relevant:"
+            # Cut the context so the prompt and the reply fit the context window
+            budget = self.prompt_builder.token_budget - max_length - estimate_tokens(template.format("", prompt))
+            if budget <= 0:
+                return prompt
+            return template.format(truncate_to_tokens(university_context, budget), prompt)
+        return prompt
+    
+    def _build_request(
+        self,
+        prompt: str,
+        max_length: int,
+        stream: bool,
+        context: Optional[List[Dict[str, str]]] = None,
+        course=None,
+        summary: Optional[str] = None,
+        use_rag: bool = True,
+        university_id: Optional[int] = None,
+        route: Optional[RouteDecision] = None,
+        retrieval_query: Optional[str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Build the Ollama endpoint path and request body for a query.
+        
+        Conversational queries (with history or a course) go to /api/chat as a
+        token-budgeted message list; one-off queries go to /api/generate. The
+        prompt plus max_length reply tokens fit OLLAMA_CONTEXT_TOKENS, which is
+        sent as num_ctx.
+        RAG retrieval is limited to university_id's content when it is given.
+        When prompt wraps the student's question in a template, retrieval_query
+        is the question itself; route is its decision if the caller has already
+        routed it, so it is not classified again.
+        """
+        payload = {
+            "model": self.model_name,
+            "stream": stream,
+            "options": {
+                "num_predict": max_length,
+                # Without num_ctx Ollama uses its default window and silently drops the start of the prompt
+                "num_ctx": self.prompt_builder.token_budget,
+                "temperature": 0.7,
+                "top_p": 0.9
+            }
+        }
+        
+        rag_context = None
+        if use_rag:
+            rag_context = self._get_relevant_university_content(retrieval_query or prompt, university_id, route)
+        
+        if context is None and course is None and not summary:
+            payload["prompt"] = self._build_prompt(prompt, rag_context, max_length)
+            return "/api/generate", payload
+        
+        payload["messages"] = self.prompt_builder.build(
+            prompt,
+            history=context,
+            rag_context=rag_context,
+            course_name=course.title if course else None,
+            summary=summary,
+            reserve_tokens=max_length
+        )
+        return "/api/chat", payload
+    
+    @staticmethod
+    def _response_text(result: Dict[str, Any]) -> str:
+        """Return the generated text from an /api/generate or /api/chat response object"""
+        if "message" in result:
+            return result["message"].get("content", "")
+        return result.get("response", "")
+    
+    @staticmethod
+    def _log_prompt(payload: Dict[str, Any]) -> str:
+        """Return a short preview of the prompt for logging"""
+        text = payload["messages"][-1]["content"] if "messages" in payload else payload["prompt"]
+        return text[:100] + "..." if len(text) > 100 else text
+        
+    def generate_response(
+        self,
+        prompt: str,
+        max_length: int = 512,
+        context: Optional[List[Dict[str, str]]] = None,
+        course=None,
+        summary: Optional[str] = None,
+        priority: int = PRIORITY_DEFAULT,
+        use_rag: bool = True,
+        university_id: Optional[int] = None,
+        route: Optional[RouteDecision] = None,
+        retrieval_query: Optional[str] = None
+    ) -> str:
+        """
+        Generate a response using Ollama API with RAG enhancement for university content.
+        
+        context is the prior conversation as a list of {"role", "content"} dicts, oldest
+        first; it is trimmed to the configured token budget, dropping the oldest turns.
+        summary is the running summary of turns older than context, if any.
+        university_id scopes retrieved university content to the student's university.
+        route and retrieval_query are passed by callers that have already routed the
+        student's question or wrap it in a template (see _build_request).
+        Identical requests (same model, enriched prompt and sampling options) are
+        answered from the prompt cache without calling Ollama.
+        Raises AdmissionRejected when no generation slot frees up before the queue deadline.
+        """
+        path, payload = self._build_request(
+            prompt, max_length, stream=False, context=context, course=course, summary=summary, use_rag=use_rag,
+            university_id=university_id, route=route, retrieval_query=retrieval_query
+        )
+        
+        cached = self.prompt_cache.get(payload)
+        if cached is not None:
+            return cached
+        
+        # Fail fast while the circuit is open instead of tying up this worker
+        if not self.circuit_breaker.allow_request():
+            logger.warning("Ollama circuit is open, returning fallback message")
+            return self.get_fallback_message()
+        
+        # Wait for a generation slot so Ollama is not overloaded with parallel requests
+        with self.admission.slot(priority):
+            response = self._generate(path, payload)
+        
+        if self.is_usable_response(response):
+            self.prompt_cache.set(payload, response)
+        return response
+    
+    def _generate(self, path: str, payload: Dict[str, Any]) -> str:
+        """Send a non-streamed generation request, retrying on connection errors"""
         for attempt in range(self.max_retries + 1):
             try:
-                url = f"{self.base_url}/api/generate"
-                payload = {
-                    "model": self.model_name,
-                    "prompt": enriched_prompt,
-                    "max_tokens": max_length,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "stream": False
-                }
-                
-                log_prompt = enriched_prompt[:100] + "..." if len(enriched_prompt) > 100 else enriched_prompt
-                logger.info(f"Sending request to Ollama API: model={self.model_name}, length={max_length}, prompt={log_prompt}")
-                response = requests.post(url, json=payload, timeout=self.connection_timeout)
-                response.raise_for_status()
+                logger.info(f"Sending request to Ollama API: model={self.model_name}, endpoint={path}, "
+                            f"length={payload['options']['num_predict']}, prompt={self._log_prompt(payload)}")
+                with self.router.open("post", path, model=self.model_name, json=payload) as response:
+                    response.raise_for_status()
+                    result = response.json()
                 
-                result = response.json()
+                self.circuit_breaker.record_success()
                 logger.info(f"Successfully generated response from Ollama")
-                return result.get("response", "No response generated")
+                return self._response_text(result) or "No response generated"
                 
             except requests.exceptions.ConnectionError as e:
                 logger.error(f"Connection error to Ollama API: {str(e)}")
-                if attempt < self.max_retries:
+                # Stop retrying as soon as another worker opens the circuit
+                if attempt < self.max_retries and self.circuit_breaker.state == CircuitBreaker.CLOSED:
                     wait_time = 1 * (attempt + 1)  # Exponential backoff
                     logger.info(f"Retrying in {wait_time} seconds (attempt {attempt+1}/{self.max_retries})")
                     time.sleep(wait_time)
                     continue
+                # A request counts as one failure, however many attempts it made
+                self.circuit_breaker.record_failure()
                 return f"Error: Cannot connect to the AI service. Please ensure Ollama is running."
                 
             except requests.exceptions.Timeout as e:
                 logger.error(f"Timeout error to Ollama API: {str(e)}")
+                self.circuit_breaker.record_failure()
                 return f"Error: The AI service timed out. Please try again with a shorter query."
                 
             except requests.exceptions.HTTPError as e:
                 error_msg = f"HTTP error from Ollama API: {str(e)}"
                 logger.error(error_msg)
+                # Server errors count against the circuit; client errors mean Ollama is up
+                if e.response.status_code >= 500:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
                 # Check if the error is because model doesn't exist
-                if response.status_code == 404:
-                    if attempt < self.max_retries:
-                        logger.info(f"Model {self.model_name} not found. Attempting to pull...")
-                        success = self.pull_model()
-                        if success:
-                            logger.info(f"Successfully pulled model {self.model_name}. Retrying...")
-                            continue
+                if e.response.status_code == 404:
+                    # Pull in the background rather than blocking this request
+                    logger.info(f"Model {self.model_name} not found. Scheduling a pull...")
+                    ollama_health_monitor.request_model_pull()
                     return f"Error: The requested AI model '{self.model_name}' is not available."
-                return f"Error: The AI service encountered a problem (HTTP {response.status_code})."
+                return f"Error: The AI service encountered a problem (HTTP {e.response.status_code})."
                 
             except Exception as e:
                 logger.error(f"Unexpected error generating response: {str(e)}")
                 return f"Error: An unexpected error occurred when generating a response."
                 
+    def generate_response_stream(
+        self,
+        prompt: str,
+        max_length: int = 512,
+        context: Optional[List[Dict[str, str]]] = None,
+        course=None,
+        summary: Optional[str] = None,
+        priority: int = PRIORITY_DEFAULT,
+        university_id: Optional[int] = None,
+        route: Optional[RouteDecision] = None
+    ) -> Iterator[str]:
+        """
+        Generate a response using Ollama API, yielding text fragments as they arrive.
+        
+        Ollama streams newline-delimited JSON objects, each carrying the next piece of
+        the completion ("response" for /api/generate, "message" for /api/chat) and a
+        final object with "done": true. Failures are reported like generate_response:
+        a single "Error: ..." fragment. AdmissionRejected is raised on the first
+        iteration when the service is saturated. A prompt cache hit is yielded as a
+        single fragment. route is the prompt's decision if the caller has already
+        routed it.
+        """
+        path, payload = self._build_request(
+            prompt, max_length, stream=True, context=context, course=course, summary=summary,
+            university_id=university_id, route=route
+        )
+        
+        cached = self.prompt_cache.get(payload)
+        if cached is not None:
+            yield cached
+            return
+        
+        # Fail fast while the circuit is open instead of tying up this worker
+        if not self.circuit_breaker.allow_request():
+            logger.warning("Ollama circuit is open, returning fallback message")
+            yield self.get_fallback_message()
+            return
+        logger.info(f"Streaming request to Ollama API: model={self.model_name}, endpoint={path}, "
+                    f"length={max_length}, prompt={self._log_prompt(payload)}")
+        
+        tokens_sent = 0
+        fragments = []
+        try:
+            with self.admission.slot(priority), \
+                    self.router.open("post", path, model=self.model_name, json=payload, stream=True) as response:
+                if response.status_code == 404:
+                    self.circuit_breaker.record_success()
+                    ollama_health_monitor.request_model_pull()
+                    yield f"Error: The requested AI model '{self.model_name}' is not available."
+                    return
+                response.raise_for_status()
+                self.circuit_breaker.record_success()
+                
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        logger.error(f"Ollama stream error: {chunk['error']}")
+                        if tokens_sent == 0:
+                            yield f"Error: The AI service encountered a problem ({chunk['error']})."
+                        return
+                    token = self._response_text(chunk)
+                    if token:
+                        tokens_sent += 1
+                        fragments.append(token)
+                        yield token
+                    if chunk.get("done"):
+                        # Only complete streams are cached
+                        if fragments:
+                            self.prompt_cache.set(payload, "".join(fragments))
+                        break
+            
+            logger.info(f"Successfully streamed {tokens_sent} chunks from Ollama")
+        
+        except requests.exceptions.ConnectionError as e:
+            logger.error(f"Connection error to Ollama API: {str(e)}")
+            self.circuit_breaker.record_failure()
+            if tokens_sent == 0:
+                yield "Error: Cannot connect to the AI service. Please ensure Ollama is running."
+        
+        except requests.exceptions.Timeout as e:
+            logger.error(f"Timeout error to Ollama API: {str(e)}")
+            self.circuit_breaker.record_failure()
+            if tokens_sent == 0:
+                yield "Error: The AI service timed out. Please try again with a shorter query."
+        
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"HTTP error from Ollama API: {str(e)}")
+            if e.response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            yield f"Error: The AI service encountered a problem (HTTP {e.response.status_code})."
+        
+        except AdmissionRejected:
+            raise
+        
+        except Exception as e:
+            logger.error(f"Unexpected error streaming response: {str(e)}")
+            if tokens_sent == 0:
+                yield "Error: An unexpected error occurred when generating a response."
+                
     def is_model_available(self) -> bool:
         """Check if the Ollama service and model are available."""
         try:
-            url = f"{self.base_url}/api/tags"
-            response = requests.get(url, timeout=self.connection_timeout)
-            response.raise_for_status()
+            with self.router.open("get", "/api/tags", model=self.model_name) as response:
+                response.raise_for_status()
+                models = response.json().get("models", [])
             
-            models = response.json().get("models", [])
             is_available = any(self.model_name in model.get("name") for model in models)
             
             if is_available:
@@ -165,56 +383,73 @@ class OllamaService:
             logger.error(f"Error checking model availability: {str(e)}")
             return False
     
-    def get_service_status(self) -> Tuple[bool, str]:
-        """Get the status of the Ollama service and model."""
+    def probe_status(self) -> Dict[str, Any]:
+        """Check every Ollama backend and summarise service and model availability."""
+        status = {"service_available": False, "model_available": False}
         try:
-            # Check if Ollama service is running
-            healthcheck_url = f"{self.base_url}/api/tags"
-            response = requests.get(healthcheck_url, timeout=self.connection_timeout)
-            
-            if response.status_code != 200:
-                return False, f"Ollama service responded with status code {response.status_code}"
+            backends = self.router.check_health(self.model_name)
+            status["backends"] = backends
+            reachable = [backend for backend in backends if backend["reachable"]]
+            status["service_available"] = bool(reachable)
+            status["model_available"] = any(backend["model_available"] for backend in reachable)
             
-            # Check if the model is available
-            models = response.json().get("models", [])
-            model_available = any(self.model_name in model.get("name") for model in models)
-            
-            if not model_available:
-                return False, f"Model '{self.model_name}' is not available"
-            
-            return True, "Ollama service and model are available"
-        except requests.exceptions.ConnectionError:
-            return False, "Cannot connect to Ollama service"
-        except requests.exceptions.Timeout:
-            return False, "Connection to Ollama service timed out"
+            if not reachable:
+                # Report the error from the first backend, as a single-host setup always did
+                error = backends[0].get("error", "") if backends else ""
+                if "timed out" in error.lower():
+                    status["message"] = "Connection to Ollama service timed out"
+                elif "status code" in error:
+                    status["message"] = f"Ollama service {error[0].lower()}{error[1:]}"
+                else:
+                    status["message"] = "Cannot connect to Ollama service"
+            elif not status["model_available"]:
+                status["message"] = f"Model '{self.model_name}' is not available"
+            else:
+                status["message"] = "Ollama service and model are available"
+                if len(reachable) < len(backends):
+                    status["message"] += f" ({len(reachable)} of {len(backends)} backends reachable)"
         except Exception as e:
-            return False, f"Error checking Ollama service: {str(e)}"
+            status["message"] = f"Error checking Ollama service: {str(e)}"
+        return status
+    
+    def get_service_status(self) -> Tuple[bool, str]:
+        """Get the status of the Ollama service and model."""
+        status = self.probe_status()
+        return status["model_available"], status["message"]
     
     def pull_model(self) -> bool:
-        """Pull the model if not already available."""
-        try:
-            logger.info(f"Attempting to pull model {self.model_name}")
-            url = f"{self.base_url}/api/pull"
-            payload = {"name": self.model_name}
-            
-            response = requests.post(url, json=payload, timeout=30)  # Longer timeout for model pulling
-            response.raise_for_status()
-            
-            logger.info(f"Successfully pulled model {self.model_name}")
-            return True
-        except requests.RequestException as e:
-            logger.error(f"Error pulling model {self.model_name}: {str(e)}")
-            return False
+        """Pull the model onto every backend that serves it."""
+        payload = {"name": self.model_name}
+        pulled = True
+        for backend in self.router.backends_for(self.model_name):
+            try:
+                logger.info(f"Attempting to pull model {self.model_name} on {backend.url}")
+                url = f"{backend.url}/api/pull"
+                
+                response = self.http.post(url, json=payload, read_timeout=self.pull_timeout)  # Longer timeout for model pulling
+                response.raise_for_status()
+                
+                logger.info(f"Successfully pulled model {self.model_name} on {backend.url}")
+            except requests.RequestException as e:
+                logger.error(f"Error pulling model {self.model_name} on {backend.url}: {str(e)}")
+                pulled = False
+        return pulled
+
+    def route_query(self, query: str) -> RouteDecision:
+        """Classify a query as university-content, course-help, off-topic or smalltalk."""
+        return self.query_router.route(query)
 
     def is_off_topic(self, query: str) -> bool:
         """Check if the query is off-topic."""
-        off_topic_keywords = [
-            "hack", "crack", "illegal", "pirate", "warez",
-            "drug", "weapon", "exploit", "vulnerability", 
-            "porn", "gambling", "betting", "steal", "torrent",
-            "password", "credit card", "bank account"
-        ]
-        return any(keyword in query.lower() for keyword in off_topic_keywords)
+        return self.route_query(query).route == ROUTE_OFF_TOPIC
+
+    def canned_response(self, query: str) -> Optional[str]:
+        """Return a fixed reply for off-topic queries and small talk, which do not need the LLM."""
+        return self.route_query(query).canned_reply
+
+    def is_usable_response(self, response: str) -> bool:
+        """Check that a response is a real answer rather than an error or fallback message."""
+        return bool(response) and not response.startswith("Error") and response != self.get_fallback_message()
 
     def get_fallback_message(self) -> str:
         """Return a fallback message when the AI service is unavailable."""
@@ -223,4 +458,9 @@ class OllamaService:
             "I'm currently experiencing technical difficulties. Please try again in a few moments.",
             "I'm unable to provide a response at this moment. Please try asking a different question."
         ]
-        return fallback_messages[0] 
\ No newline at end of file
+        return fallback_messages[0]
+
+# Create a singleton instance shared by all views in this process
+ollama_service = OllamaService()
+ollama_health_monitor = OllamaHealthMonitor(ollama_service)
+ollama_summarizer = ConversationSummarizer(ollama_service)
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator
+
+import requests
+
+from .http_client import ollama_http_client
+
+logger = logging.getLogger(__name__)
+
+# Gateway errors mean the request never reached a working Ollama, so another node may serve it
+RETRYABLE_STATUS_CODES = (502, 503, 504)
+
+
+class OllamaBackend:
+    """A single Ollama inference host"""
+
+    def __init__(self, url: str, weight: float = 1.0, models: Optional[List[str]] = None):
+        self.url = url.rstrip("/")
+        self.weight = max(float(weight), 0.01)
+        # An empty list means the backend serves every model
+        self.models = models or []
+        self.outstanding = 0
+        self.down_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def serves(self, model: Optional[str]) -> bool:
+        return not model or not self.models or any(model in name for name in self.models)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "models": self.models,
+            "outstanding": self.outstanding,
+            "healthy": self.healthy,
+        }
+
+
+class OllamaRouter:
+    """
+    Routes Ollama requests across one or more inference hosts.
+
+    Backends are configured with OLLAMA_BACKENDS, a JSON list such as
+    [{"url": "http://gpu1:11434", "weight": 2, "models": ["llama3"]}], and default to
+    the single OLLAMA_API_URL. Each request goes to the healthy backend serving the
+    model with the fewest outstanding requests relative to its weight. A backend that
+    refuses connections is taken out of rotation for OLLAMA_BACKEND_COOLDOWN seconds,
+    and the request is retried on another node. When every backend serving the model
+    is cooling down, the one that failed longest ago is tried anyway; failing fast
+    is left to the circuit breaker.
+    """
+
+    def __init__(self, backends: Optional[List[OllamaBackend]] = None, http=None):
+        self.backends = backends or self._load_backends()
+        self.http = http or ollama_http_client
+        self.cooldown = float(os.getenv("OLLAMA_BACKEND_COOLDOWN", "30"))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_backends() -> List[OllamaBackend]:
+        """Read backend definitions from the environment"""
+        config = os.getenv("OLLAMA_BACKENDS")
+        if config:
+            try:
+                return [
+                    OllamaBackend(item["url"], item.get("weight", 1), item.get("models"))
+                    for item in json.loads(config)
+                ]
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"Invalid OLLAMA_BACKENDS setting, using OLLAMA_API_URL: {str(e)}")
+        return [OllamaBackend(os.getenv("OLLAMA_API_URL", "http://localhost:11434"))]
+
+    @property
+    def primary_url(self) -> str:
+        return self.backends[0].url
+
+    def backends_for(self, model: Optional[str]) -> List[OllamaBackend]:
+        """Return every configured backend that serves the model"""
+        return [backend for backend in self.backends if backend.serves(model)]
+
+    def _pick(self, model: Optional[str], exclude: List[OllamaBackend]) -> Optional[OllamaBackend]:
+        """Choose the least loaded healthy backend and reserve a slot on it"""
+        with self._lock:
+            eligible = [backend for backend in self.backends_for(model) if backend not in exclude]
+            if not eligible:
+                return None
+            candidates = [backend for backend in eligible if backend.healthy]
+            if candidates:
+                backend = min(candidates, key=lambda b: (b.outstanding + 1) / b.weight)
+            else:
+                backend = min(eligible, key=lambda b: b.down_until)
+            backend.outstanding += 1
+            return backend
+
+    def _finish(self, backend: OllamaBackend):
+        with self._lock:
+            backend.outstanding -= 1
+
+    def mark_down(self, backend: OllamaBackend):
+        """Take a backend out of rotation for the cooldown period"""
+        logger.warning(f"Ollama backend {backend.url} marked unhealthy for {self.cooldown}s")
+        backend.down_until = time.monotonic() + self.cooldown
+
+    def mark_up(self, backend: OllamaBackend):
+        backend.down_until = 0.0
+
+    @contextmanager
+    def open(self, method: str, path: str, model: Optional[str] = None, **kwargs) -> Iterator[requests.Response]:
+        """
+        Send a request to the best backend and yield its response.
+
+        The backend's outstanding count covers the whole block, so streamed
+        responses keep counting against it until they are fully read. Connection
+        failures and gateway errors are retried once on each remaining backend.
+        """
+        tried = []
+        last_error = None
+        while True:
+            backend = self._pick(model, tried)
+            if backend is None:
+                if last_error is not None:
+                    raise last_error
+                raise requests.exceptions.ConnectionError(f"No healthy Ollama backend serves model '{model}'")
+            tried.append(backend)
+
+            try:
+                response = getattr(self.http, method)(f"{backend.url}{path}", **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self._finish(backend)
+                self.mark_down(backend)
+                last_error = e
+                continue
+            except Exception:
+                self._finish(backend)
+                raise
+
+            if response.status_code in RETRYABLE_STATUS_CODES and len(tried) < len(self.backends_for(model)):
+                logger.warning(f"Ollama backend {backend.url} returned {response.status_code}, trying another node")
+                response.close()
+                self._finish(backend)
+                continue
+
+            self.mark_up(backend)
+            try:
+                with response:
+                    yield response
+            finally:
+                self._finish(backend)
+            return
+
+    def check_health(self, model: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Probe /api/tags on every backend and update which ones are in rotation"""
+        results = []
+        for backend in self.backends:
+            result = backend.to_dict()
+            try:
+                response = self.http.get(f"{backend.url}/api/tags")
+                result["reachable"] = response.status_code == 200
+                if result["reachable"]:
+                    names = [item.get("name", "") for item in response.json().get("models", [])]
+                    result["model_available"] = bool(model) and any(model in name for name in names)
+                    self.mark_up(backend)
+                else:
+                    result["model_available"] = False
+                    result["error"] = f"Responded with status code {response.status_code}"
+            except requests.RequestException as e:
+                self.mark_down(backend)
+                result["reachable"] = False
+                result["model_available"] = False
+                result["error"] = str(e)
+            result["healthy"] = backend.healthy
+            results.append(result)
+        return results
+
+
+# Create a singleton instance shared by all Ollama calls in this process
+ollama_router = OllamaRouter()
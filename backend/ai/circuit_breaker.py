@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared across worker processes through the Django cache.
+
+    closed:    requests flow normally; consecutive failures are counted.
+    open:      after failure_threshold failures requests are rejected at once
+               until recovery_timeout seconds have passed.
+    half-open: after the recovery timeout a single worker is let through as a
+               probe; success closes the circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold: int = None, recovery_timeout: int = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("OLLAMA_CIRCUIT_FAILURE_THRESHOLD", "3"))
+        self.recovery_timeout = recovery_timeout or int(os.getenv("OLLAMA_CIRCUIT_RECOVERY_TIMEOUT", "30"))
+        self.failures_key = f"circuit:{name}:failures"
+        self.opened_at_key = f"circuit:{name}:opened_at"
+        self.probe_key = f"circuit:{name}:probe"
+
+    @property
+    def state(self) -> str:
+        """Return the current state of the circuit"""
+        try:
+            opened_at = cache.get(self.opened_at_key)
+        except Exception as e:
+            logger.error(f"Error reading circuit {self.name} state: {str(e)}")
+            return self.CLOSED
+        if opened_at is None:
+            return self.CLOSED
+        if time.time() - opened_at < self.recovery_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def is_open(self) -> bool:
+        """Return True while requests should be rejected without a probe"""
+        return self.state == self.OPEN
+
+    def allow_request(self) -> bool:
+        """
+        Return whether a request may be sent to the backend.
+
+        In the half-open state only the first caller to claim the probe slot is
+        allowed through; everyone else keeps failing fast until it reports back.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+        try:
+            # The probe slot expires so a crashed probe cannot wedge the circuit
+            return cache.add(self.probe_key, True, timeout=self.recovery_timeout)
+        except Exception as e:
+            logger.error(f"Error claiming circuit {self.name} probe: {str(e)}")
+            return True
+
+    def record_success(self):
+        """Close the circuit after a successful call"""
+        try:
+            if cache.get(self.opened_at_key) is not None:
+                logger.info(f"Circuit {self.name} closed")
+            cache.delete_many([self.failures_key, self.opened_at_key, self.probe_key])
+        except Exception as e:
+            logger.error(f"Error closing circuit {self.name}: {str(e)}")
+
+    def record_failure(self):
+        """Count a failed call and open the circuit once the threshold is reached"""
+        try:
+            if self.state == self.HALF_OPEN:
+                # The probe failed, so start a new open period
+                self._open()
+                return
+            cache.add(self.failures_key, 0, timeout=self.recovery_timeout * 2)
+            failures = cache.incr(self.failures_key)
+            if failures >= self.failure_threshold:
+                self._open()
+        except Exception as e:
+            logger.error(f"Error recording failure on circuit {self.name}: {str(e)}")
+
+    def _open(self):
+        """Open the circuit and release any probe slot"""
+        logger.warning(f"Circuit {self.name} opened for {self.recovery_timeout}s")
+        cache.set(self.opened_at_key, time.time(), timeout=None)
+        cache.delete_many([self.failures_key, self.probe_key])
@@ -0,0 +1,169 @@
+import os
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .prompting import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_HEADER = "Here is some relevant information about the university:"
+CONTEXT_SEPARATOR = "---"
+
+
+class AssembledContext:
+    """RAG context text and what went into it"""
+
+    __slots__ = ("text", "items", "tokens", "below_threshold", "redundant", "over_budget")
+
+    def __init__(self, text: str, items: List[Dict[str, Any]], below_threshold: int = 0, redundant: int = 0,
+                 over_budget: int = 0):
+        self.text = text
+        self.items = items
+        self.tokens = estimate_tokens(text)
+        self.below_threshold = below_threshold
+        self.redundant = redundant
+        self.over_budget = over_budget
+
+    @property
+    def chars(self) -> int:
+        return len(self.text)
+
+
+class ContextAssembler:
+    """
+    Builds the university context for a prompt from retrieval results.
+
+    Results below `min_score` cosine similarity are dropped, unless BM25 found
+    them: exact-token hits (module codes, dates, names) often have a low cosine
+    score. The rest are picked with Maximal Marginal Relevance: each step takes
+    the result with the best trade-off between relevance and similarity to those
+    already picked, so the same event scraped from a list page and a detail page
+    is not sent twice. Relevance is the hybrid (RRF) rank when retrieval fused
+    vector and BM25 results, and the cosine score otherwise.
+    Results that are near-duplicates of a picked one are discarded outright.
+    Picked results are added while they fit in the token budget.
+    """
+
+    def __init__(self, min_score: float = None, mmr_lambda: float = None, max_items: int = None,
+                 max_tokens: int = None, candidates: int = None, duplicate_similarity: float = None):
+        self.min_score = min_score if min_score is not None else float(os.getenv("RAG_MIN_SCORE", "0.3"))
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+        self.max_items = max_items or int(os.getenv("RAG_MAX_ITEMS", "3"))
+        self.max_tokens = max_tokens or int(os.getenv("RAG_CONTEXT_TOKENS", "600"))
+        # Results fetched from retrieval for the assembler to choose from
+        self.candidates = candidates or int(os.getenv("RAG_CANDIDATES", "8"))
+        self.duplicate_similarity = duplicate_similarity or float(os.getenv("RAG_DUPLICATE_SIMILARITY", "0.95"))
+        self._lock = threading.Lock()
+        self.contexts = 0
+        self.total_tokens = 0
+        self.total_items = 0
+
+    @staticmethod
+    def format_item(item: Dict[str, Any]) -> str:
+        """Format one retrieval result for the prompt"""
+        # The matching passage is more specific than the generic summary
+        text = item.get('passage') or item['summary']
+        if item['content_type'] == 'news':
+            lines = [f"NEWS: {item['title']}. {text}"]
+        elif item['content_type'] == 'event':
+            date_info = f"Date: {item['published_date']}" if item['published_date'] else ""
+            lines = [f"EVENT: {item['title']}. {date_info}. {text}"]
+        else:
+            lines = [f"{item['title']}. {text}"]
+
+        # Add source information
+        if item['source_name'] and item['university_name']:
+            lines.append(f"Source: {item['source_name']} at {item['university_name']}")
+
+        # Add URL if available
+        if item['url']:
+            lines.append(f"More information: {item['url']}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _relevance(results: List[Dict[str, Any]]) -> np.ndarray:
+        """Relevance in [0, 1] for MMR: the RRF rank for hybrid results, else the cosine score"""
+        if all('rrf_score' in item for item in results):
+            order = np.argsort([-item['rrf_score'] for item in results], kind="stable")
+            relevance = np.empty(len(results), dtype=np.float32)
+            relevance[order] = np.linspace(1.0, 1.0 / len(results), len(results))
+            return relevance
+        return np.array([item['score'] for item in results], dtype=np.float32)
+
+    def _select(self, results: List[Dict[str, Any]]):
+        """Order results by MMR, dropping near-duplicates; returns (ordered results, redundant count)"""
+        if len(results) < 2 or any(item.get('embedding') is None for item in results):
+            return results, 0
+        vectors = np.stack([np.asarray(item['embedding'], dtype=np.float32) for item in results])
+        relevance = self._relevance(results)
+        similarity = vectors @ vectors.T
+
+        remaining = list(range(len(results)))
+        selected = []
+        redundant = 0
+        while remaining:
+            if selected:
+                max_similarity = similarity[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                max_similarity = np.zeros(len(remaining), dtype=np.float32)
+            duplicates = max_similarity >= self.duplicate_similarity
+            redundant += int(duplicates.sum())
+            mmr = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * max_similarity
+            mmr[duplicates] = -np.inf
+            best = int(np.argmax(mmr))
+            if np.isneginf(mmr[best]):
+                break
+            selected.append(remaining[best])
+            remaining = [row for i, row in enumerate(remaining) if i != best and not duplicates[i]]
+        return [results[i] for i in selected], redundant
+
+    def assemble(self, results: List[Dict[str, Any]]) -> AssembledContext:
+        """Build the context text from retrieval results ordered best first"""
+        relevant = [item for item in results if item['score'] >= self.min_score or item.get('lexical_match')]
+        below_threshold = len(results) - len(relevant)
+        ordered, redundant = self._select(relevant)
+
+        parts = []
+        items = []
+        over_budget = 0
+        tokens = estimate_tokens(CONTEXT_HEADER)
+        for item in ordered:
+            if len(items) >= self.max_items:
+                break
+            block = self.format_item(item)
+            cost = estimate_tokens(block) + (estimate_tokens(CONTEXT_SEPARATOR) if parts else 0)
+            # Skip results that do not fit; a shorter one further down may
+            if tokens + cost > self.max_tokens:
+                over_budget += 1
+                continue
+            if parts:
+                parts.append(CONTEXT_SEPARATOR)
+            parts.append(block)
+            items.append(item)
+            tokens += cost
+
+        text = "\n".join([CONTEXT_HEADER] + parts) if items else ""
+        context = AssembledContext(text, items, below_threshold, redundant, over_budget)
+        with self._lock:
+            self.contexts += 1
+            self.total_items += len(items)
+            self.total_tokens += context.tokens
+        logger.info(f"Assembled RAG context: {len(items)} of {len(results)} results, {context.chars} chars "
+                    f"(~{context.tokens} tokens); dropped {below_threshold} below score, {redundant} redundant, "
+                    f"{over_budget} over budget")
+        return context
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            return {
+                "contexts": self.contexts,
+                "avg_items": self.total_items / self.contexts if self.contexts else None,
+                "avg_tokens": self.total_tokens / self.contexts if self.contexts else None,
+            }
+
+
+# Shared instance used by the AI service in this process
+context_assembler = ContextAssembler()
@@ -0,0 +1,114 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaHealthMonitor:
+    """
+    Cached view of the Ollama service and model status.
+
+    Request handlers read the last known status from the cache instead of calling
+    Ollama's /api/tags on every request. The status is refreshed out of band by the
+    refresh_ollama_health Celery task, and a stale entry triggers a single background
+    refresh in the reading process so the cache stays warm without Celery beat.
+    """
+
+    CACHE_KEY = "ollama:health"
+    PULL_LOCK_KEY = "ollama:pull-scheduled"
+
+    def __init__(self, service):
+        self.service = service
+        # Seconds before a cached status is considered stale
+        self.ttl = int(os.getenv("OLLAMA_HEALTH_TTL", "30"))
+        # How long to wait before scheduling another model pull
+        self.pull_cooldown = int(os.getenv("OLLAMA_PULL_COOLDOWN", "300"))
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self) -> Dict[str, Any]:
+        """Probe Ollama and store the result in the cache"""
+        status = self.service.probe_status()
+        status["checked_at"] = time.time()
+        try:
+            # Keep stale entries around so readers always have a last known state
+            cache.set(self.CACHE_KEY, status, timeout=self.ttl * 10)
+        except Exception as e:
+            logger.error(f"Error caching Ollama health status: {str(e)}")
+        return status
+
+    def _refresh_in_background(self):
+        """Refresh the cached status in a daemon thread, at most one at a time"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing Ollama health status: {str(e)}")
+            finally:
+                self._refresh_lock.release()
+
+        threading.Thread(target=run, name="ollama-health-refresh", daemon=True).start()
+
+    def get_status(self, wait: bool = False) -> Dict[str, Any]:
+        """
+        Return the cached Ollama status.
+
+        If nothing is cached yet the status is unknown; with wait=True the caller
+        probes synchronously, otherwise a background refresh is started and an
+        optimistic status is returned so the request path never blocks.
+        """
+        try:
+            status = cache.get(self.CACHE_KEY)
+        except Exception as e:
+            logger.error(f"Error reading Ollama health status: {str(e)}")
+            status = None
+
+        if status is None:
+            if wait:
+                return self.refresh()
+            self._refresh_in_background()
+            return {
+                "service_available": True,
+                "model_available": True,
+                "message": "Ollama status has not been checked yet",
+                "checked_at": None,
+            }
+
+        if time.time() - status["checked_at"] > self.ttl:
+            self._refresh_in_background()
+        return status
+
+    def is_model_available(self) -> bool:
+        """Return whether the model was available at the last check"""
+        return self.get_status()["model_available"]
+
+    def request_model_pull(self) -> bool:
+        """
+        Schedule a model pull on a Celery worker.
+
+        Returns True if a pull was scheduled, False if one was scheduled recently
+        or the task could not be queued.
+        """
+        try:
+            if not cache.add(self.PULL_LOCK_KEY, True, timeout=self.pull_cooldown):
+                return False
+        except Exception as e:
+            logger.error(f"Error checking model pull lock: {str(e)}")
+            return False
+
+        try:
+            from .tasks import pull_ollama_model
+            pull_ollama_model.delay()
+            logger.info(f"Scheduled pull of model {self.service.model_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Error scheduling model pull: {str(e)}")
+            cache.delete(self.PULL_LOCK_KEY)
+            return False
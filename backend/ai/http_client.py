@@ -0,0 +1,85 @@
+import os
+import logging
+import threading
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaHTTPClient:
+    """
+    Process-wide HTTP client for talking to Ollama.
+
+    Wraps a single requests.Session so every call reuses pooled keep-alive
+    connections instead of opening a new TCP connection per request. The session
+    is created lazily and rebuilt after a fork, so pre-forking servers such as
+    Gunicorn never share sockets between worker processes.
+    """
+
+    def __init__(self):
+        self.pool_size = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+        default_timeout = os.getenv("OLLAMA_TIMEOUT", "5")
+        # Time allowed to establish the TCP connection
+        self.connect_timeout = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", default_timeout))
+        # Time allowed for a complete non-streamed response to start arriving
+        self.read_timeout = float(os.getenv("OLLAMA_READ_TIMEOUT", default_timeout))
+        # Time allowed for the first streamed chunk (and between chunks)
+        self.first_byte_timeout = float(os.getenv("OLLAMA_FIRST_BYTE_TIMEOUT", default_timeout))
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _create_session(self) -> requests.Session:
+        """Create a session with a connection pool sized for concurrent workers"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=0  # OllamaService handles its own retries
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        logger.info(f"Created Ollama HTTP session with pool size {self.pool_size}")
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        """Return the pooled session for the current process"""
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._create_session()
+                    self._pid = pid
+        return self._session
+
+    def timeout(self, stream: bool = False, read: Optional[float] = None) -> Tuple[float, float]:
+        """Return a (connect, read) timeout tuple for a request"""
+        if read is None:
+            read = self.first_byte_timeout if stream else self.read_timeout
+        return (self.connect_timeout, read)
+
+    def get(self, url: str, read_timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        """Send a GET request through the pooled session"""
+        kwargs.setdefault("timeout", self.timeout(read=read_timeout))
+        return self.session.get(url, **kwargs)
+
+    def post(self, url: str, stream: bool = False, read_timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        """Send a POST request through the pooled session"""
+        kwargs.setdefault("timeout", self.timeout(stream=stream, read=read_timeout))
+        return self.session.post(url, stream=stream, **kwargs)
+
+    def close(self):
+        """Close all pooled connections"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+                self._pid = None
+
+
+# Create a singleton instance
+ollama_http_client = OllamaHTTPClient()
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from typing import Optional, Dict, Any
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_text(text: str) -> str:
+    """Collapse whitespace so re-indented or padded prompts share a key"""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class PromptResponseCache:
+    """
+    Exact-match cache of LLM responses stored in Redis.
+
+    The key is a hash of the model, the normalised enriched prompt (or chat
+    messages) and the sampling options, so retries and double-submits of the same
+    request are answered without a second generation. Entries expire after a TTL,
+    and a sorted set of access times keeps the cache to a bounded number of
+    entries by evicting the least recently used. Redis errors are logged and
+    treated as misses so the cache can never take chat down.
+    """
+
+    KEY_PREFIX = "prompt-cache:"
+    INDEX_KEY = "prompt-cache:index"
+    HITS_KEY = "prompt-cache:hits"
+    MISSES_KEY = "prompt-cache:misses"
+
+    def __init__(self, client=None):
+        self.enabled = os.getenv("PROMPT_CACHE_ENABLED", "True").lower() == "true"
+        self.url = os.getenv("PROMPT_CACHE_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+        self.ttl = int(os.getenv("PROMPT_CACHE_TTL", "86400"))
+        self.max_entries = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "10000"))
+        # Back off after a Redis failure instead of paying a timeout on every request
+        self.retry_interval = 30
+        self._client = client
+        self._disabled_until = 0.0
+
+    @property
+    def client(self):
+        if self._client is None and REDIS_AVAILABLE:
+            self._client = redis.Redis.from_url(self.url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        return self._client
+
+    def _usable(self) -> bool:
+        return self.enabled and self.client is not None and time.monotonic() >= self._disabled_until
+
+    def _fail(self, action: str, error: Exception):
+        logger.error(f"Prompt cache {action} failed, bypassing cache for {self.retry_interval}s: {str(error)}")
+        self._disabled_until = time.monotonic() + self.retry_interval
+
+    def make_key(self, payload: Dict[str, Any]) -> str:
+        """Hash the parts of an Ollama request body that determine its output"""
+        material = {
+            "model": payload.get("model"),
+            "options": payload.get("options", {}),
+        }
+        if "messages" in payload:
+            material["messages"] = [
+                {"role": message["role"], "content": _normalize_text(message["content"])}
+                for message in payload["messages"]
+            ]
+        else:
+            material["prompt"] = _normalize_text(payload.get("prompt", ""))
+        digest = hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+        return self.KEY_PREFIX + digest
+
+    def get(self, payload: Dict[str, Any]) -> Optional[str]:
+        """Return the cached response for an identical request, if any"""
+        if not self._usable():
+            return None
+        key = self.make_key(payload)
+        try:
+            value = self.client.get(key)
+            pipe = self.client.pipeline()
+            if value is None:
+                pipe.incr(self.MISSES_KEY)
+            else:
+                pipe.incr(self.HITS_KEY)
+                pipe.zadd(self.INDEX_KEY, {key: time.time()})
+            pipe.execute()
+        except Exception as e:
+            self._fail("lookup", e)
+            return None
+        if value is None:
+            return None
+        logger.info("Prompt cache hit")
+        return value.decode("utf-8")
+
+    def set(self, payload: Dict[str, Any], response: str):
+        """Store a response and evict the least recently used entries beyond the limit"""
+        if not self._usable():
+            return
+        key = self.make_key(payload)
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(key, response.encode("utf-8"), ex=self.ttl)
+            pipe.zadd(self.INDEX_KEY, {key: time.time()})
+            pipe.execute()
+
+            overflow = self.client.zcard(self.INDEX_KEY) - self.max_entries
+            if overflow > 0:
+                evicted = self.client.zrange(self.INDEX_KEY, 0, overflow - 1)
+                pipe = self.client.pipeline()
+                pipe.delete(*evicted)
+                pipe.zrem(self.INDEX_KEY, *evicted)
+                pipe.execute()
+        except Exception as e:
+            self._fail("store", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the number of cached entries"""
+        if not self._usable():
+            return {"enabled": False}
+        try:
+            hits, misses = [int(value or 0) for value in self.client.mget(self.HITS_KEY, self.MISSES_KEY)]
+            entries = self.client.zcard(self.INDEX_KEY)
+            return {"enabled": True, "entries": entries, "hits": hits, "misses": misses}
+        except Exception as e:
+            self._fail("stats", e)
+            return {"enabled": False}
+
+
+# Create a singleton instance shared by all Ollama calls in this process
+prompt_response_cache = PromptResponseCache()
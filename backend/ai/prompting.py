@@ -0,0 +1,93 @@
+import os
+from typing import List, Dict, Optional
+
+# Rough characters-per-token ratio for English text with Llama-style tokenizers
+CHARS_PER_TOKEN = 4
+
+# Per-message overhead for role markers and separators in the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are VirtuAId, a friendly AI lecturer helping university students with their studies. "
+    "Give clear, accurate and educational answers."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text without running a tokenizer"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to roughly max_tokens, keeping the beginning"""
+    if max_tokens <= 0:
+        return ""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + "..."
+
+
+class ChatPromptBuilder:
+    """
+    Builds /api/chat message lists that fit within the model's context window.
+
+    `token_budget` is the context window (sent to Ollama as num_ctx). The
+    tokens reserved for the reply come off the top; the rest is split in
+    priority order: the system prompt and the current query are always kept,
+    the running conversation summary and then RAG context are truncated to what
+    remains, and recent history fills the rest from the newest turn backwards,
+    so the oldest turns are dropped first.
+    """
+
+    def __init__(self, token_budget: int = None, system_prompt: str = None):
+        self.token_budget = token_budget or int(os.getenv("OLLAMA_CONTEXT_TOKENS", "2048"))
+        self.system_prompt = system_prompt or os.getenv("OLLAMA_SYSTEM_PROMPT", DEFAULT_SYSTEM_PROMPT)
+
+    def build(
+        self,
+        query: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        rag_context: Optional[str] = None,
+        course_name: Optional[str] = None,
+        summary: Optional[str] = None,
+        reserve_tokens: int = 0,
+    ) -> List[Dict[str, str]]:
+        """Return the messages to send for this turn, oldest first, leaving reserve_tokens for the reply"""
+        system_prompt = self.system_prompt
+        if course_name:
+            system_prompt += f" The student is asking in the context of the course {course_name}."
+
+        remaining = self.token_budget - reserve_tokens
+        remaining -= estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        remaining -= estimate_tokens(query) + MESSAGE_OVERHEAD_TOKENS
+
+        if summary:
+            header = "\n\nSummary of the earlier conversation:\n"
+            summary_budget = remaining - estimate_tokens(header)
+            if summary_budget > 0:
+                summary = truncate_to_tokens(summary, summary_budget)
+                system_prompt += header + summary
+                remaining -= estimate_tokens(header) + estimate_tokens(summary)
+
+        if rag_context:
+            header = "\n\nUse the following university information when it is relevant to the question:\n"
+            rag_budget = remaining - estimate_tokens(header)
+            if rag_budget > 0:
+                rag_context = truncate_to_tokens(rag_context, rag_budget)
+                system_prompt += header + rag_context
+                remaining -= estimate_tokens(header) + estimate_tokens(rag_context)
+
+        # Walk history from the newest turn back, stopping when the budget runs out
+        kept = []
+        for message in reversed(history or []):
+            cost = estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if cost > remaining:
+                break
+            kept.append({"role": message["role"], "content": message["content"]})
+            remaining -= cost
+        kept.reverse()
+
+        return [{"role": "system", "content": system_prompt}] + kept + [{"role": "user", "content": query}]
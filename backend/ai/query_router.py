@@ -0,0 +1,265 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Import content embedding service for query embeddings
+try:
+    from content.embeddings import content_embedding_service, EMBEDDING_MODEL_AVAILABLE
+    SEMANTIC_ROUTING_AVAILABLE = EMBEDDING_MODEL_AVAILABLE
+except ImportError:
+    SEMANTIC_ROUTING_AVAILABLE = False
+
+ROUTE_UNIVERSITY_CONTENT = "university-content"
+ROUTE_COURSE_HELP = "course-help"
+ROUTE_OFF_TOPIC = "off-topic"
+ROUTE_SMALLTALK = "smalltalk"
+
+OFF_TOPIC_REPLY = ("I'm sorry, but I can't assist with that type of request. "
+                   "Please ask something related to your academic studies.")
+SMALLTALK_REPLIES = {
+    "greeting": "Hello! I'm your AI lecturer. Ask me anything about your course or your university.",
+    "thanks": "You're welcome! Let me know if there is anything else I can help you with.",
+    "farewell": "Goodbye, and good luck with your studies!",
+}
+SMALLTALK_REPLIES["smalltalk"] = SMALLTALK_REPLIES["greeting"]
+
+# Off-topic and university terms may appear anywhere in a query; small talk must be the whole message.
+# Terms that are common in course questions (drugs, weapons, passwords, exploits, ...) are left to the
+# centroid classifier, and a hit on these still has to be confirmed by it when the model is available.
+OFF_TOPIC_TERMS = [
+    r"hack(?:s|ed|ing|er|ers)?", "illegal", "pirat(?:e|ed|ing)", "warez", "porn", "gambling", "betting",
+    r"steal(?:s|ing)?", "torrents?",
+]
+UNIVERSITY_TERMS = [
+    "universit(?:y|ies)", "campus", "lectures?", "professors?", "students?", "faculty", "events?", "news",
+    "deadlines?", "programmes?", "programs?", "departments?", "schools?", "college", "northampton",
+    "graduation", "semesters?", "terms? dates?", "exams?", "research", "open days?", "library", "accommodation",
+    "enrol(?:l)?ment", "what'?s happening", "what'?s on", "upcoming", "this week", "announcements?",
+]
+SMALLTALK_PATTERNS = {
+    "greeting": r"(?:hi|hello|hey|hiya|good (?:morning|afternoon|evening)|how are you(?: doing)?)(?: there)?",
+    "thanks": r"(?:thanks?(?: you)?|thank you(?: (?:so|very) much)?|cheers|ty|great,? thanks?)",
+    "farewell": r"(?:bye|goodbye|see you(?: later)?|good ?night)",
+}
+
+# Example queries whose embeddings form each route's centroid
+ROUTE_EXAMPLES = {
+    ROUTE_UNIVERSITY_CONTENT: [
+        "When is the next open day?",
+        "What events are on at the university this week?",
+        "Where is the library and when does it open?",
+        "Any news from the students' union?",
+        "When are the term dates for next year?",
+        "How do I apply for accommodation on campus?",
+    ],
+    ROUTE_COURSE_HELP: [
+        "Can you explain recursion with an example?",
+        "How do I solve a quadratic equation?",
+        "What is the difference between a list and a tuple in Python?",
+        "Help me structure my essay introduction.",
+        "Explain supply and demand.",
+        "What does this error in my code mean?",
+    ],
+    ROUTE_OFF_TOPIC: [
+        "How do I break into someone's account?",
+        "Where can I download movies for free illegally?",
+        "Give me tips to win at online casinos.",
+        "How do I make a fake ID?",
+        "Where can I buy drugs on campus?",
+        "How do I get into someone else's account without their password?",
+    ],
+    ROUTE_SMALLTALK: [
+        "Hi there, how's it going?",
+        "Thanks, that was helpful!",
+        "Good morning!",
+        "See you later.",
+    ],
+}
+
+
+class RouteDecision:
+    """How a query should be handled, and why"""
+
+    __slots__ = ("route", "source", "similarity", "kind")
+
+    def __init__(self, route: str, source: str, similarity: Optional[float] = None, kind: Optional[str] = None):
+        self.route = route
+        # "pattern", "centroid" or "default"
+        self.source = source
+        self.similarity = similarity
+        # The matched small talk group, for picking a reply
+        self.kind = kind
+
+    @property
+    def use_retrieval(self) -> bool:
+        return self.route == ROUTE_UNIVERSITY_CONTENT
+
+    @property
+    def canned_reply(self) -> Optional[str]:
+        """The fixed reply for queries that do not need the LLM, or None"""
+        if self.route == ROUTE_OFF_TOPIC:
+            return OFF_TOPIC_REPLY
+        if self.route == ROUTE_SMALLTALK:
+            return SMALLTALK_REPLIES.get(self.kind or "smalltalk", SMALLTALK_REPLIES["smalltalk"])
+        return None
+
+    def __repr__(self):
+        return f"RouteDecision({self.route!r}, source={self.source!r}, similarity={self.similarity})"
+
+
+class QueryRouter:
+    """
+    Classifies each query into university-content, course-help, off-topic or smalltalk.
+
+    A single compiled regular expression finds off-topic terms, university terms
+    and whole-message small talk in one scan. Queries it does not decide are
+    matched against the centroids of example queries in embedding space, using
+    the same cached query embedding as retrieval and the semantic cache. Routes
+    that lead to a canned reply need a higher similarity than the others, and a
+    query close to no centroid is treated as course help.
+
+    An off-topic term alone does not refuse a query: it is refused only if its
+    nearest centroid is off-topic too, or if the model is unavailable.
+
+    Decisions are memoised per normalised query, so the views and the RAG step
+    classify a message only once.
+    """
+
+    def __init__(self, embedder: Callable[[str], np.ndarray] = None, examples: Dict[str, List[str]] = None):
+        self.enabled = os.getenv("QUERY_ROUTER_SEMANTIC", "True").lower() == "true"
+        self.min_similarity = float(os.getenv("QUERY_ROUTER_MIN_SIMILARITY", "0.45"))
+        self.canned_min_similarity = float(os.getenv("QUERY_ROUTER_CANNED_MIN_SIMILARITY", "0.6"))
+        self.max_decisions = int(os.getenv("QUERY_ROUTER_CACHE_SIZE", "1024"))
+        self.embedder = embedder
+        if embedder is None and SEMANTIC_ROUTING_AVAILABLE:
+            self.embedder = content_embedding_service.embed_query
+        self.examples = examples or ROUTE_EXAMPLES
+        self.pattern = self._compile()
+        self._routes = None
+        self._centroids = None
+        self._retry_at = 0.0
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {route: 0 for route in (ROUTE_UNIVERSITY_CONTENT, ROUTE_COURSE_HELP, ROUTE_OFF_TOPIC,
+                                              ROUTE_SMALLTALK)}
+
+    @staticmethod
+    def _compile() -> re.Pattern:
+        smalltalk = "|".join(f"(?P<{kind}>{pattern})" for kind, pattern in SMALLTALK_PATTERNS.items())
+        return re.compile(
+            rf"^\W*(?:{smalltalk})\W*$"
+            rf"|\b(?P<off_topic>{'|'.join(OFF_TOPIC_TERMS)})\b"
+            rf"|\b(?P<university>{'|'.join(UNIVERSITY_TERMS)})\b"
+        )
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _match(self, text: str, off_topic: bool = True) -> Optional[RouteDecision]:
+        """Route by pattern; off-topic terms win over university terms wherever they appear"""
+        university = False
+        for match in self.pattern.finditer(text):
+            group = match.lastgroup
+            if group == "off_topic":
+                if off_topic:
+                    return RouteDecision(ROUTE_OFF_TOPIC, "pattern")
+            elif group == "university":
+                university = True
+            elif group is not None:
+                return RouteDecision(ROUTE_SMALLTALK, "pattern", kind=group)
+        return RouteDecision(ROUTE_UNIVERSITY_CONTENT, "pattern") if university else None
+
+    def _load_centroids(self) -> bool:
+        if self._centroids is not None:
+            return True
+        if not self.enabled or self.embedder is None or time.monotonic() < self._retry_at:
+            return False
+        try:
+            routes, centroids = [], []
+            for route, examples in self.examples.items():
+                vectors = np.stack([self.embedder(example) for example in examples])
+                centroid = vectors.mean(axis=0)
+                routes.append(route)
+                centroids.append(centroid / (np.linalg.norm(centroid) or 1.0))
+            self._routes, self._centroids = routes, np.stack(centroids).astype(np.float32)
+            return True
+        except Exception as e:
+            logger.error(f"Error embedding query router examples: {str(e)}")
+            self._retry_at = time.monotonic() + 60
+            return False
+
+    def _nearest(self, text: str) -> Optional[Tuple[str, float]]:
+        """The route whose centroid is closest to the query embedding, and its similarity"""
+        if not self._load_centroids():
+            return None
+        try:
+            embedding = self.embedder(text)
+        except Exception as e:
+            logger.error(f"Error embedding query for routing: {str(e)}")
+            return None
+        similarities = self._centroids @ embedding
+        best = int(np.argmax(similarities))
+        return self._routes[best], float(similarities[best])
+
+    def _classify(self, text: str) -> Optional[RouteDecision]:
+        """Nearest-centroid route for the query embedding, or None if no centroid is close enough"""
+        nearest = self._nearest(text)
+        if nearest is None:
+            return None
+        route, similarity = nearest
+        canned = route in (ROUTE_OFF_TOPIC, ROUTE_SMALLTALK)
+        if similarity < (self.canned_min_similarity if canned else self.min_similarity):
+            return None
+        return RouteDecision(route, "centroid", similarity)
+
+    def route(self, query: str) -> RouteDecision:
+        """Classify a query, reusing the decision for a query seen recently"""
+        text = self.normalize(query)
+        with self._lock:
+            decision = self._decisions.get(text)
+            if decision is not None:
+                self._decisions.move_to_end(text)
+                self.counts[decision.route] += 1
+                return decision
+
+        decision = self._match(text)
+        if decision is not None and decision.route == ROUTE_OFF_TOPIC:
+            # Off-topic terms also turn up in real questions, so the classifier has to agree
+            nearest = self._nearest(text)
+            if nearest is not None:
+                if nearest[0] == ROUTE_OFF_TOPIC:
+                    decision.similarity = nearest[1]
+                else:
+                    decision = self._match(text, off_topic=False)
+        decision = decision or self._classify(text)
+        # Decisions made without the model (undecided, or refused on pattern alone) are not memoised
+        if self._centroids is not None:
+            cacheable = True
+        else:
+            cacheable = decision is not None and decision.route != ROUTE_OFF_TOPIC
+        decision = decision or RouteDecision(ROUTE_COURSE_HELP, "default")
+        with self._lock:
+            self.counts[decision.route] += 1
+            if cacheable and self.max_decisions > 0:
+                self._decisions[text] = decision
+                while len(self._decisions) > self.max_decisions:
+                    self._decisions.popitem(last=False)
+        logger.debug(f"Routed query to {decision.route} ({decision.source})")
+        return decision
+
+    def stats(self):
+        with self._lock:
+            return {"routes": dict(self.counts), "memoised": len(self._decisions)}
+
+
+# Shared instance used by the AI service in this process
+query_router = QueryRouter()
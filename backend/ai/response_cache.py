@@ -0,0 +1,155 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Import content embedding service for query embeddings
+try:
+    from content.embeddings import content_embedding_service, EMBEDDING_MODEL_AVAILABLE
+    from content.signals import get_content_version
+    SEMANTIC_CACHE_AVAILABLE = EMBEDDING_MODEL_AVAILABLE
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+
+
+class CacheEntry:
+    __slots__ = ("scope", "embedding", "response", "created_at", "content_version")
+
+    def __init__(self, scope, embedding, response, content_version):
+        self.scope = scope
+        self.embedding = embedding
+        self.response = response
+        self.created_at = time.time()
+        self.content_version = content_version
+
+
+class SemanticResponseCache:
+    """
+    Cache of LLM answers looked up by meaning rather than exact text.
+
+    Answers are stored with the normalised query embedding and scoped by
+    university, course and the answer's max_length. A new query is served from
+    the cache when its cosine similarity to a stored query in the same scope
+    reaches the threshold. Entries expire after a TTL, are dropped when scraped
+    content changes (the answers may quote it), and the least recently used entry
+    is evicted when the cache is full.
+    The cache lives in process memory, so each worker keeps its own copy.
+    """
+
+    def __init__(self, embedder=None, version_source=None):
+        self.enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "True").lower() == "true"
+        self.threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        self.ttl = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+        self.max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+        self.embedder = embedder
+        self.version_source = version_source
+        if embedder is None and SEMANTIC_CACHE_AVAILABLE:
+            self.embedder = content_embedding_service.embed_query
+            self.version_source = get_content_version
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _scope(university_id: Optional[int], course_id: Optional[int], max_length: int) -> Tuple[Any, Any, int]:
+        return (university_id, course_id, max_length)
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        if not self.enabled or self.embedder is None:
+            return None
+        try:
+            return self.embedder(query.strip().lower())
+        except Exception as e:
+            logger.error(f"Error embedding query for semantic cache: {str(e)}")
+            return None
+
+    def _current_version(self):
+        return self.version_source() if self.version_source else None
+
+    def _purge(self, version):
+        """Drop expired entries and entries built from older content"""
+        cutoff = time.time() - self.ttl
+        stale = [
+            key for key, entry in self._entries.items()
+            if entry.created_at < cutoff or entry.content_version != version
+        ]
+        for key in stale:
+            del self._entries[key]
+
+    def get(
+        self,
+        query: str,
+        university_id: Optional[int] = None,
+        course_id: Optional[int] = None,
+        max_length: int = 512,
+    ) -> Optional[str]:
+        """Return a cached answer for a semantically equivalent query, if any"""
+        embedding = self._embed(query)
+        if embedding is None:
+            return None
+
+        scope = self._scope(university_id, course_id, max_length)
+        version = self._current_version()
+        with self._lock:
+            self._purge(version)
+            keys = [key for key, entry in self._entries.items() if entry.scope == scope]
+            if not keys:
+                self.misses += 1
+                return None
+
+            matrix = np.stack([self._entries[key].embedding for key in keys])
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logger.info(f"Semantic cache hit (similarity={similarities[best]:.3f})")
+            return self._entries[key].response
+
+    def put(
+        self,
+        query: str,
+        response: str,
+        university_id: Optional[int] = None,
+        course_id: Optional[int] = None,
+        max_length: int = 512,
+    ):
+        """Store an answer for later semantically equivalent queries"""
+        embedding = self._embed(query)
+        if embedding is None:
+            return
+
+        entry = CacheEntry(self._scope(university_id, course_id, max_length), embedding, response, self._current_version())
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Create a singleton instance shared by all views in this process
+semantic_response_cache = SemanticResponseCache()
@@ -0,0 +1,91 @@
+import os
+import logging
+from typing import List, Dict
+
+from .admission import PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """You maintain a running summary of a tutoring conversation between a student and an AI lecturer.
+
+Current summary:
+{summary}
+
+New conversation turns:
+{turns}
+
+Write an updated summary in at most {max_words} words. Keep the topics covered, facts the student shared about themselves and their course, and any open questions. Reply with the summary only."""
+
+
+class ConversationSummarizer:
+    """
+    Folds older chat turns into a running summary stored on the ChatSession.
+
+    Once a session has more than `threshold` messages that are not covered by the
+    summary, everything except the newest `keep_recent` messages is summarised.
+    The prompt for each turn is then summary + recent turns, so prompt-eval cost
+    stays roughly constant as the session grows.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.threshold = int(os.getenv("CHAT_SUMMARY_THRESHOLD", "12"))
+        self.keep_recent = int(os.getenv("CHAT_SUMMARY_KEEP_MESSAGES", "6"))
+        self.max_words = int(os.getenv("CHAT_SUMMARY_MAX_WORDS", "150"))
+
+    def recent_messages(self, session):
+        """Return messages not yet covered by the session summary, oldest first"""
+        messages = session.messages.all()
+        if session.summarized_message_id is not None:
+            messages = messages.filter(id__gt=session.summarized_message_id)
+        return messages.order_by('timestamp', 'id')
+
+    def _format_turns(self, messages) -> str:
+        lines = []
+        for msg in messages:
+            speaker = "Student" if msg.is_user_message else "Lecturer"
+            lines.append(f"{speaker}: {msg.message}")
+        return "\n".join(lines)
+
+    def summarize(self, session) -> bool:
+        """
+        Update the session summary if enough unsummarised turns have built up.
+
+        Returns True if the summary was updated.
+        """
+        pending = list(self.recent_messages(session))
+        if len(pending) <= self.threshold:
+            return False
+
+        to_fold = pending[:-self.keep_recent] if self.keep_recent else pending
+        prompt = SUMMARY_PROMPT.format(
+            summary=session.summary or "(none yet)",
+            turns=self._format_turns(to_fold),
+            max_words=self.max_words
+        )
+
+        # Summaries are background work, so they queue behind interactive chat turns
+        summary = self.service.generate_response(
+            prompt,
+            max_length=self.max_words * 2,
+            priority=PRIORITY_BACKGROUND,
+            use_rag=False
+        )
+        if not summary or summary.startswith("Error") or summary == self.service.get_fallback_message():
+            logger.warning(f"Could not summarise chat session {session.id}: {summary}")
+            return False
+
+        session.summary = summary.strip()
+        session.summarized_message_id = to_fold[-1].id
+        # update_fields keeps last_updated untouched so session ordering is unchanged
+        session.save(update_fields=['_encrypted_summary', 'summarized_message_id'])
+        logger.info(f"Folded {len(to_fold)} messages into the summary of chat session {session.id}")
+        return True
+
+    @staticmethod
+    def history_for_prompt(messages) -> List[Dict[str, str]]:
+        """Convert ChatMessage objects to chat history dicts, oldest first"""
+        return [
+            {"role": "user" if msg.is_user_message else "assistant", "content": msg.message}
+            for msg in messages
+        ]
@@ -0,0 +1,40 @@
+import logging
+from celery import shared_task
+from core.models import ChatSession
+from .ai_service import ollama_service, ollama_health_monitor, ollama_summarizer
+
+logger = logging.getLogger(__name__)
+
+@shared_task
+def refresh_ollama_health():
+    """Task to refresh the cached Ollama service and model status"""
+    status = ollama_health_monitor.refresh()
+    return status["message"]
+
+@shared_task
+def pull_ollama_model():
+    """Task to pull the configured Ollama model outside the request path"""
+    try:
+        logger.info(f"Starting pull of model {ollama_service.model_name}")
+        pulled = ollama_service.pull_model()
+        ollama_health_monitor.refresh()
+        if pulled:
+            return f"Pulled model {ollama_service.model_name}"
+        return f"Failed to pull model {ollama_service.model_name}"
+    except Exception as e:
+        logger.error(f"Error pulling Ollama model: {str(e)}")
+        return f"Error pulling Ollama model: {str(e)}"
+
+@shared_task
+def update_session_summary(session_id):
+    """Task to fold older turns of a chat session into its running summary"""
+    try:
+        session = ChatSession.objects.get(id=session_id)
+        if ollama_summarizer.summarize(session):
+            return f"Updated summary for chat session {session_id}"
+        return f"No summary update needed for chat session {session_id}"
+    except ChatSession.DoesNotExist:
+        return f"Chat session {session_id} no longer exists"
+    except Exception as e:
+        logger.error(f"Error summarising chat session {session_id}: {str(e)}")
+        return f"Error summarising chat session {session_id}: {str(e)}"
@@ -0,0 +1,853 @@
+import collections
+import itertools
+import json
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from .admission import (
+    AdmissionController, AdmissionRejected, SharedAdmissionController, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+)
+from .ai_service import OllamaService
+from .backends import OllamaBackend, OllamaRouter
+from .circuit_breaker import CircuitBreaker
+from .context_assembler import ContextAssembler
+from .health import OllamaHealthMonitor
+from .http_client import OllamaHTTPClient
+from .prompt_cache import PromptResponseCache
+from .prompting import ChatPromptBuilder, estimate_tokens
+from .query_router import (
+    QueryRouter, ROUTE_COURSE_HELP, ROUTE_OFF_TOPIC, ROUTE_SMALLTALK, ROUTE_UNIVERSITY_CONTENT
+)
+from .response_cache import SemanticResponseCache
+from .summarizer import ConversationSummarizer
+
+
+class FakeStreamResponse:
+    """Minimal stand-in for a streamed requests.Response"""
+
+    def __init__(self, chunks, status_code=200):
+        self.lines = [json.dumps(chunk).encode() for chunk in chunks]
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of the Redis client used by the prompt cache and admission control"""
+
+    def __init__(self):
+        self.values = {}
+        self.sorted_sets = collections.defaultdict(dict)
+        self.lock = threading.RLock()
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, *keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def incr(self, key):
+        with self.lock:
+            self.values[key] = int(self.values.get(key, 0)) + 1
+            return self.values[key]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def _ordered(self, key):
+        members = self.sorted_sets[key]
+        return sorted(members, key=lambda member: (members[member], member))
+
+    def zadd(self, key, mapping):
+        with self.lock:
+            self.sorted_sets[key].update(mapping)
+
+    def zcard(self, key):
+        return len(self.sorted_sets[key])
+
+    def zrange(self, key, start, end):
+        with self.lock:
+            return self._ordered(key)[start:end + 1]
+
+    def zrank(self, key, member):
+        with self.lock:
+            ordered = self._ordered(key)
+            return ordered.index(member) if member in ordered else None
+
+    def zrangebyscore(self, key, low, high):
+        with self.lock:
+            return [member for member in self._ordered(key) if low <= self.sorted_sets[key][member] <= high]
+
+    def zremrangebyscore(self, key, low, high):
+        with self.lock:
+            self.zrem(key, *self.zrangebyscore(key, low, high))
+
+    def zrem(self, key, *members):
+        with self.lock:
+            for member in members:
+                self.sorted_sets[key].pop(member, None)
+
+
+class FakePipeline:
+    """Queues commands and runs them together, like a Redis MULTI/EXEC transaction"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client.lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class OllamaStreamingTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = OllamaService()
+        self.service.use_rag = False
+        self.service.router = OllamaRouter([OllamaBackend("http://ollama:11434")])
+        self.service.prompt_cache = PromptResponseCache(client=FakeRedis())
+
+    def test_stream_yields_tokens_until_done(self):
+        """Test that tokens are yielded in order and the stream stops at done"""
+        chunks = [
+            {"response": "Hello", "done": False},
+            {"response": " there", "done": False},
+            {"response": "", "done": True},
+            {"response": "ignored", "done": False},
+        ]
+        with mock.patch.object(self.service.http, "post", return_value=FakeStreamResponse(chunks)) as post:
+            tokens = list(self.service.generate_response_stream("Hi"))
+
+        self.assertEqual(tokens, ["Hello", " there"])
+        self.assertTrue(post.call_args.kwargs["stream"])
+        self.assertTrue(post.call_args.kwargs["json"]["stream"])
+
+    def test_stream_reports_connection_error(self):
+        """Test that a connection failure is reported as a single error fragment"""
+        with mock.patch.object(self.service.http, "post", side_effect=requests.exceptions.ConnectionError()):
+            tokens = list(self.service.generate_response_stream("Hi"))
+
+        self.assertEqual(len(tokens), 1)
+        self.assertTrue(tokens[0].startswith("Error"))
+
+
+class OllamaHTTPClientTest(SimpleTestCase):
+    def setUp(self):
+        self.client = OllamaHTTPClient()
+        self.client.connect_timeout = 1.0
+        self.client.read_timeout = 20.0
+        self.client.first_byte_timeout = 3.0
+
+    def test_session_is_reused(self):
+        """Test that repeated calls share one pooled session"""
+        self.assertIs(self.client.session, self.client.session)
+
+    def test_session_rebuilt_after_fork(self):
+        """Test that a new process gets its own session"""
+        session = self.client.session
+        with mock.patch("ai.http_client.os.getpid", return_value=-1):
+            self.assertIsNot(self.client.session, session)
+
+    def test_timeouts_per_phase(self):
+        """Test that streamed requests use the first-byte timeout"""
+        self.assertEqual(self.client.timeout(), (1.0, 20.0))
+        self.assertEqual(self.client.timeout(stream=True), (1.0, 3.0))
+        self.assertEqual(self.client.timeout(read=60), (1.0, 60))
+
+
+class OllamaHealthMonitorTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = mock.Mock(model_name="llama3")
+        self.service.probe_status.return_value = {
+            "service_available": True,
+            "model_available": True,
+            "message": "Ollama service and model are available",
+        }
+        self.monitor = OllamaHealthMonitor(self.service)
+
+    def test_cached_status_avoids_probe(self):
+        """Test that a fresh cached status is served without contacting Ollama"""
+        self.monitor.refresh()
+        self.service.probe_status.reset_mock()
+
+        self.assertTrue(self.monitor.is_model_available())
+        self.service.probe_status.assert_not_called()
+
+    def test_missing_status_does_not_block(self):
+        """Test that an empty cache returns an optimistic status and refreshes in the background"""
+        with mock.patch.object(self.monitor, "_refresh_in_background") as refresh:
+            status = self.monitor.get_status()
+
+        self.assertTrue(status["model_available"])
+        self.assertIsNone(status["checked_at"])
+        refresh.assert_called_once()
+
+    def test_stale_status_triggers_refresh(self):
+        """Test that a stale entry is served while a refresh is started"""
+        self.monitor.refresh()
+        with mock.patch("ai.health.time.time", return_value=10 ** 12):
+            with mock.patch.object(self.monitor, "_refresh_in_background") as refresh:
+                self.assertTrue(self.monitor.is_model_available())
+        refresh.assert_called_once()
+
+    def test_model_pull_is_scheduled_once(self):
+        """Test that repeated pull requests within the cooldown queue a single task"""
+        with mock.patch("ai.tasks.pull_ollama_model.delay") as delay:
+            self.assertTrue(self.monitor.request_model_pull())
+            self.assertFalse(self.monitor.request_model_pull())
+        delay.assert_called_once()
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=30)
+
+    def test_opens_after_threshold(self):
+        """Test that the circuit opens after consecutive failures"""
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_half_open_allows_single_probe(self):
+        """Test that only one probe is let through after the recovery timeout"""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        with mock.patch("ai.circuit_breaker.time.time", return_value=10 ** 12):
+            self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertTrue(self.breaker.allow_request())
+            self.assertFalse(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_failed_probe_reopens(self):
+        """Test that a failed probe starts a new open period"""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        with mock.patch("ai.circuit_breaker.time.time", return_value=10 ** 12):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_open_circuit_returns_fallback(self):
+        """Test that generate_response fails fast while the circuit is open"""
+        service = OllamaService()
+        service.use_rag = False
+        service.router = OllamaRouter([OllamaBackend("http://ollama:11434")])
+        service.circuit_breaker = self.breaker
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        with mock.patch.object(service.http, "post") as post:
+            response = service.generate_response("Hi")
+        post.assert_not_called()
+        self.assertEqual(response, service.get_fallback_message())
+
+
+    def test_retried_blip_leaves_circuit_closed(self):
+        """Test that failed attempts a request recovers from are not counted, and a failed request counts once"""
+        service = OllamaService()
+        service.router = OllamaRouter([OllamaBackend("http://ollama:11434")])
+        service.circuit_breaker = self.breaker
+        ok = mock.MagicMock(status_code=200)
+        ok.__enter__.return_value = ok
+        ok.json.return_value = {"response": "Hello."}
+        payload = {"options": {"num_predict": 16}, "prompt": "Hi"}
+
+        with mock.patch("ai.ai_service.time.sleep"), \
+                mock.patch.object(service.http, "post", side_effect=[requests.exceptions.ConnectionError(), ok]):
+            self.assertEqual(service._generate("/api/generate", payload), "Hello.")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        service.max_retries = 2
+        with mock.patch("ai.ai_service.time.sleep"), \
+                mock.patch.object(service.http, "post", side_effect=requests.exceptions.ConnectionError()) as post:
+            self.assertTrue(service._generate("/api/generate", payload).startswith("Error"))
+        self.assertEqual(post.call_count, 3)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(cache.get(self.breaker.failures_key), 1)
+
+
+class AdmissionControllerTest(SimpleTestCase):
+    def test_rejects_when_queue_is_full(self):
+        """Test that requests beyond the queue bound are rejected immediately"""
+        controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=5)
+        controller.acquire()
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire()
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(controller.metrics()["rejected"], 1)
+
+    def test_rejects_when_deadline_expires(self):
+        """Test that a queued request gives up at its deadline"""
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=5)
+        controller._avg_service_time = 0.01
+        controller.acquire()
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire(timeout=0.05)
+        self.assertEqual(controller.metrics()["queue_depth"], 0)
+
+    def test_interactive_requests_served_first(self):
+        """Test that a freed slot goes to the highest-priority waiter"""
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=5)
+        controller._avg_service_time = 0.01
+        controller.acquire()
+        order = []
+
+        def worker(priority, name):
+            with controller.slot(priority):
+                order.append(name)
+
+        threads = [threading.Thread(target=worker, args=(PRIORITY_BACKGROUND, "background"))]
+        threads[0].start()
+        while controller.metrics()["queue_depth"] < 1:
+            time.sleep(0.001)
+        threads.append(threading.Thread(target=worker, args=(PRIORITY_INTERACTIVE, "interactive")))
+        threads[1].start()
+        while controller.metrics()["queue_depth"] < 2:
+            time.sleep(0.001)
+
+        controller.release()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(order, ["interactive", "background"])
+        self.assertEqual(controller.metrics()["in_flight"], 0)
+
+
+class SharedAdmissionControllerTest(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+
+    def controller(self, **kwargs):
+        """A controller in another worker process, sharing the same Redis"""
+        kwargs.setdefault("max_in_flight", 1)
+        kwargs.setdefault("max_queue", 4)
+        kwargs.setdefault("queue_timeout", 5)
+        controller = SharedAdmissionController(client=self.redis, **kwargs)
+        controller.poll_interval = 0.001
+        controller._avg_service_time = 0.01
+        return controller
+
+    def test_limit_is_shared_between_processes(self):
+        """Test that a slot held in one process blocks another until released"""
+        web, celery = self.controller(), self.controller()
+        token = web.acquire()
+        with self.assertRaises(AdmissionRejected):
+            celery.acquire(timeout=0.05)
+        self.assertEqual(celery.metrics()["in_flight"], 1)
+        self.assertEqual(celery.metrics()["queue_depth"], 0)
+
+        web.release(token=token)
+        with celery.slot():
+            self.assertTrue(web.metrics()["shared"])
+        self.assertEqual(web.metrics()["in_flight"], 0)
+
+    def test_interactive_requests_served_first_across_processes(self):
+        """Test that a freed slot goes to the highest-priority waiter in any process"""
+        holder = self.controller()
+        token = holder.acquire()
+        order = []
+
+        def worker(priority, name):
+            with self.controller().slot(priority):
+                order.append(name)
+
+        threads = [threading.Thread(target=worker, args=(PRIORITY_BACKGROUND, "background"))]
+        threads[0].start()
+        while holder.metrics()["queue_depth"] < 1:
+            time.sleep(0.001)
+        threads.append(threading.Thread(target=worker, args=(PRIORITY_INTERACTIVE, "interactive")))
+        threads[1].start()
+        while holder.metrics()["queue_depth"] < 2:
+            time.sleep(0.001)
+
+        holder.release(token=token)
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(order, ["interactive", "background"])
+        self.assertEqual(holder.metrics()["in_flight"], 0)
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test that a slot held by a process that died is freed when its lease runs out"""
+        crashed = self.controller()
+        crashed.lease = -1
+        crashed.acquire()
+        self.assertIsNotNone(self.controller().acquire(timeout=0.05))
+
+    def test_falls_back_to_process_limit_without_redis(self):
+        """Test that a Redis failure limits requests per process instead of failing them"""
+        controller = self.controller()
+        controller._client = mock.Mock()
+        controller.client.zrangebyscore.side_effect = ConnectionError("down")
+        with controller.slot():
+            self.assertEqual(controller.metrics()["in_flight"], 1)
+            self.assertFalse(controller.metrics()["shared"])
+        self.assertEqual(controller.metrics()["in_flight"], 0)
+        self.assertEqual(controller.client.zrangebyscore.call_count, 1)
+
+
+class OllamaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.http = mock.Mock()
+        self.fast = OllamaBackend("http://fast:11434", weight=2, models=["llama3"])
+        self.slow = OllamaBackend("http://slow:11434", weight=1)
+        self.other = OllamaBackend("http://other:11434", models=["mistral"])
+        self.router = OllamaRouter([self.fast, self.slow, self.other], http=self.http)
+
+    def test_picks_least_loaded_backend_for_model(self):
+        """Test that backends are chosen by outstanding requests per weight"""
+        picks = [self.router._pick("llama3", []) for _ in range(3)]
+        self.assertEqual(picks, [self.fast, self.fast, self.slow])
+        self.assertNotIn(self.other, [self.router._pick("llama3", []) for _ in range(4)])
+
+    def test_fails_over_on_connection_error(self):
+        """Test that a refused connection marks the node down and retries elsewhere"""
+        ok = mock.MagicMock(status_code=200)
+        ok.__enter__.return_value = ok
+        self.http.post.side_effect = [requests.exceptions.ConnectionError(), ok]
+
+        with self.router.open("post", "/api/generate", model="llama3", json={}) as response:
+            self.assertIs(response, ok)
+
+        self.assertEqual(self.http.post.call_count, 2)
+        self.assertFalse(self.fast.healthy)
+        self.assertEqual(self.fast.outstanding + self.slow.outstanding, 0)
+
+    def test_raises_when_every_backend_fails(self):
+        """Test that the last connection error is raised once all nodes are tried"""
+        self.http.post.side_effect = requests.exceptions.ConnectionError()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            with self.router.open("post", "/api/generate", model="llama3", json={}):
+                pass
+        self.assertEqual(self.http.post.call_count, 2)
+
+    def test_single_backend_retried_after_blip(self):
+        """Test that the only backend is still tried while cooling down, so a retry can succeed"""
+        cache.clear()
+        backend = OllamaBackend("http://ollama:11434")
+        ok = mock.MagicMock(status_code=200)
+        ok.__enter__.return_value = ok
+        ok.json.return_value = {"response": "Recursion is a function calling itself."}
+        self.http.post.side_effect = [requests.exceptions.ConnectionError(), ok]
+        service = OllamaService()
+        service.router = OllamaRouter([backend], http=self.http)
+
+        with mock.patch("ai.ai_service.time.sleep"):
+            response = service._generate("/api/generate", {"options": {"num_predict": 16}, "prompt": "Recursion?"})
+
+        self.assertEqual(response, "Recursion is a function calling itself.")
+        self.assertEqual(self.http.post.call_count, 2)
+        self.assertTrue(backend.healthy)
+
+
+class ChatPromptBuilderTest(SimpleTestCase):
+    def setUp(self):
+        self.builder = ChatPromptBuilder(token_budget=100, system_prompt="You are a tutor.")
+
+    def test_estimate_tokens(self):
+        """Test the character-based token estimate"""
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("abcd"), 1)
+        self.assertEqual(estimate_tokens("abcde"), 2)
+
+    def test_messages_are_in_chat_order(self):
+        """Test that the system prompt comes first and the query last"""
+        history = [
+            {"role": "user", "content": "What is recursion?"},
+            {"role": "assistant", "content": "A function calling itself."},
+        ]
+        messages = self.builder.build("Give an example", history=history, course_name="CSY1019")
+
+        self.assertEqual(messages[0]["role"], "system")
+        self.assertIn("CSY1019", messages[0]["content"])
+        self.assertEqual(messages[1:3], history)
+        self.assertEqual(messages[-1], {"role": "user", "content": "Give an example"})
+
+    def test_oldest_turns_dropped_first(self):
+        """Test that history is trimmed from the oldest turn to fit the budget"""
+        history = [{"role": "user", "content": f"turn {i} " + "x" * 80} for i in range(10)]
+        messages = self.builder.build("Question?", history=history)
+        kept = [message["content"] for message in messages[1:-1]]
+
+        self.assertTrue(kept)
+        self.assertLess(len(kept), len(history))
+        self.assertTrue(kept[-1].startswith("turn 9"))
+        total = sum(estimate_tokens(message["content"]) + 4 for message in messages)
+        self.assertLessEqual(total, self.builder.token_budget)
+
+    def test_rag_context_truncated_to_budget(self):
+        """Test that long RAG context is cut so the query still fits"""
+        messages = self.builder.build("Question?", rag_context="word " * 500)
+        total = sum(estimate_tokens(message["content"]) + 4 for message in messages)
+        self.assertLessEqual(total, self.builder.token_budget + 1)
+        self.assertEqual(messages[-1]["content"], "Question?")
+
+    def test_reply_tokens_are_reserved(self):
+        """Test that the prompt leaves room for the reply within the context window"""
+        messages = self.builder.build("Question?", rag_context="word " * 500, reserve_tokens=40)
+        total = sum(estimate_tokens(message["content"]) + 4 for message in messages)
+        self.assertLessEqual(total + 40, self.builder.token_budget + 1)
+
+    def test_request_sends_context_window(self):
+        """Test that num_ctx is sent and the generate prompt fits alongside num_predict"""
+        service = OllamaService()
+        service.prompt_builder = ChatPromptBuilder(token_budget=200)
+        with mock.patch.object(service, "_get_relevant_university_content", return_value="word " * 500):
+            path, payload = service._build_request("Question?", 100, False)
+
+        self.assertEqual(path, "/api/generate")
+        self.assertEqual(payload["options"]["num_ctx"], 200)
+        self.assertLessEqual(estimate_tokens(payload["prompt"]) + 100, 200)
+        self.assertIn("User query: Question?", payload["prompt"])
+
+
+class ConversationSummarizerTest(SimpleTestCase):
+    def setUp(self):
+        self.service = mock.Mock()
+        self.service.get_fallback_message.return_value = "fallback"
+        self.service.generate_response.return_value = "The student asked about recursion."
+        self.summarizer = ConversationSummarizer(self.service)
+        self.summarizer.threshold = 4
+        self.summarizer.keep_recent = 2
+        self.session = mock.Mock(id=1, summary="", summarized_message_id=None)
+
+    def _messages(self, count):
+        return [
+            mock.Mock(id=i, is_user_message=i % 2 == 0, message=f"message {i}")
+            for i in range(1, count + 1)
+        ]
+
+    def test_short_sessions_are_not_summarised(self):
+        """Test that nothing happens until the threshold is passed"""
+        with mock.patch.object(self.summarizer, "recent_messages", return_value=self._messages(4)):
+            self.assertFalse(self.summarizer.summarize(self.session))
+        self.service.generate_response.assert_not_called()
+
+    def test_older_turns_are_folded_into_summary(self):
+        """Test that all but the newest messages are summarised at background priority"""
+        with mock.patch.object(self.summarizer, "recent_messages", return_value=self._messages(6)):
+            self.assertTrue(self.summarizer.summarize(self.session))
+
+        prompt = self.service.generate_response.call_args.args[0]
+        self.assertIn("message 4", prompt)
+        self.assertNotIn("message 5", prompt)
+        self.assertEqual(self.service.generate_response.call_args.kwargs["priority"], PRIORITY_BACKGROUND)
+        self.assertEqual(self.session.summary, "The student asked about recursion.")
+        self.assertEqual(self.session.summarized_message_id, 4)
+        self.session.save.assert_called_once()
+
+    def test_failed_generation_keeps_previous_summary(self):
+        """Test that an error reply does not overwrite the stored summary"""
+        self.service.generate_response.return_value = "Error: The AI service timed out."
+        with mock.patch.object(self.summarizer, "recent_messages", return_value=self._messages(6)):
+            self.assertFalse(self.summarizer.summarize(self.session))
+        self.session.save.assert_not_called()
+
+
+class SemanticResponseCacheTest(SimpleTestCase):
+    VECTORS = {
+        "when is graduation": [1.0, 0.0, 0.0],
+        "when is graduation?": [0.99, 0.141, 0.0],
+        "library opening hours": [0.0, 1.0, 0.0],
+    }
+
+    def setUp(self):
+        self.version = 1
+        self.cache = SemanticResponseCache(
+            embedder=lambda text: np.array(self.VECTORS[text], dtype=np.float32),
+            version_source=lambda: self.version,
+        )
+        self.cache.enabled = True
+        self.cache.threshold = 0.95
+
+    def test_similar_query_hits(self):
+        """Test that a near-identical question is served from the cache"""
+        self.cache.put("When is graduation", "In July.", university_id=1)
+        self.assertEqual(self.cache.get("when is graduation?", university_id=1), "In July.")
+        self.assertIsNone(self.cache.get("library opening hours", university_id=1))
+
+    def test_scoped_by_university_and_course(self):
+        """Test that answers are not shared across universities or courses"""
+        self.cache.put("when is graduation", "In July.", university_id=1, course_id=5)
+        self.assertIsNone(self.cache.get("when is graduation", university_id=2, course_id=5))
+        self.assertIsNone(self.cache.get("when is graduation", university_id=1, course_id=6))
+
+    def test_scoped_by_max_length(self):
+        """Test that an answer is only reused for the length it was generated with"""
+        self.cache.put("when is graduation", "July.", university_id=1, max_length=64)
+        self.assertIsNone(self.cache.get("when is graduation", university_id=1))
+        self.assertEqual(self.cache.get("when is graduation", university_id=1, max_length=64), "July.")
+
+    def test_content_change_invalidates(self):
+        """Test that entries are dropped when scraped content changes"""
+        self.cache.put("when is graduation", "In July.")
+        self.version = 2
+        self.assertIsNone(self.cache.get("when is graduation"))
+
+    def test_ttl_expiry(self):
+        """Test that expired entries are not served"""
+        self.cache.put("when is graduation", "In July.")
+        with mock.patch("ai.response_cache.time.time", return_value=time.time() + self.cache.ttl + 1):
+            self.assertIsNone(self.cache.get("when is graduation"))
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+        self.cache.max_entries = 2
+        self.cache.put("when is graduation", "In July.")
+        self.cache.put("library opening hours", "9 to 5.", university_id=1)
+        self.cache.get("when is graduation")
+        self.cache.put("library opening hours", "8 to 8.", university_id=2)
+
+        self.assertEqual(self.cache.get("when is graduation"), "In July.")
+        self.assertIsNone(self.cache.get("library opening hours", university_id=1))
+
+
+class PromptResponseCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache = PromptResponseCache(client=FakeRedis())
+        self.cache.enabled = True
+        self.service = OllamaService()
+        self.service.use_rag = False
+        self.service.router = OllamaRouter([OllamaBackend("http://ollama:11434")])
+        self.service.prompt_cache = self.cache
+
+    def payload(self, prompt, temperature=0.7):
+        return {"model": "llama3", "prompt": prompt, "stream": False, "options": {"temperature": temperature}}
+
+    def test_key_ignores_whitespace_and_stream_flag(self):
+        """Test that padded prompts and streamed requests share a key"""
+        streamed = dict(self.payload("  What is  RAG? "), stream=True)
+        self.assertEqual(self.cache.make_key(self.payload("What is RAG?")), self.cache.make_key(streamed))
+
+    def test_key_includes_sampling_options(self):
+        """Test that different sampling parameters are cached separately"""
+        self.cache.set(self.payload("What is RAG?"), "Retrieval.")
+        self.assertIsNone(self.cache.get(self.payload("What is RAG?", temperature=0.1)))
+        self.assertEqual(self.cache.get(self.payload("What is RAG?")), "Retrieval.")
+        self.assertEqual(self.cache.stats(), {"enabled": True, "entries": 1, "hits": 1, "misses": 1})
+
+    def test_bounded_size_evicts_least_recently_used(self):
+        """Test that the oldest entries are evicted beyond max_entries"""
+        self.cache.max_entries = 2
+        clock = itertools.count()
+        with mock.patch("ai.prompt_cache.time.time", side_effect=lambda: next(clock)):
+            self.cache.set(self.payload("one"), "1")
+            self.cache.set(self.payload("two"), "2")
+            self.cache.get(self.payload("one"))
+            self.cache.set(self.payload("three"), "3")
+
+        self.assertIsNone(self.cache.get(self.payload("two")))
+        self.assertEqual(self.cache.get(self.payload("one")), "1")
+
+    def test_redis_errors_bypass_cache(self):
+        """Test that a Redis failure is a miss and pauses the cache"""
+        self.cache.client.get = mock.Mock(side_effect=ConnectionError("down"))
+        self.assertIsNone(self.cache.get(self.payload("What is RAG?")))
+        self.assertIsNone(self.cache.get(self.payload("What is RAG?")))
+        self.assertEqual(self.cache.client.get.call_count, 1)
+
+    def test_generate_response_served_from_cache(self):
+        """Test that a repeated request does not reach Ollama"""
+        response = mock.Mock(status_code=200)
+        response.__enter__ = mock.Mock(return_value=response)
+        response.__exit__ = mock.Mock(return_value=False)
+        response.json.return_value = {"response": "Retrieval augmented generation."}
+        with mock.patch.object(self.service.http, "post", return_value=response) as post:
+            first = self.service.generate_response("What is RAG?")
+            second = self.service.generate_response("What is RAG?")
+
+        self.assertEqual(first, second)
+        self.assertEqual(post.call_count, 1)
+
+    def test_errors_are_not_cached(self):
+        """Test that error responses are not stored"""
+        with mock.patch.object(self.service.http, "post", side_effect=requests.exceptions.Timeout()):
+            self.assertTrue(self.service.generate_response("What is RAG?").startswith("Error"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+class QueryRouterTest(SimpleTestCase):
+    WORDS = ["recursion", "campus", "casino", "hiya", "wifi"]
+
+    def setUp(self):
+        self.embedded = []
+        examples = {
+            ROUTE_COURSE_HELP: ["explain recursion"],
+            ROUTE_UNIVERSITY_CONTENT: ["campus map"],
+            ROUTE_OFF_TOPIC: ["casino tips", "break into the wifi"],
+            ROUTE_SMALLTALK: ["hiya friend"],
+        }
+        self.router = QueryRouter(embedder=self.fake_embed, examples=examples)
+
+    def fake_embed(self, text):
+        self.embedded.append(text)
+        vector = np.array([float(word in text) for word in self.WORDS] + [0.1], dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def test_patterns_decide_without_embedding(self):
+        """Test that university terms and whole-message small talk are routed by pattern"""
+        self.assertEqual(self.router.route("Is there a hackathon on campus?").route, ROUTE_UNIVERSITY_CONTENT)
+        self.assertEqual(self.router.route("When is the next open day?").route, ROUTE_UNIVERSITY_CONTENT)
+        thanks = self.router.route("Thanks!")
+        self.assertEqual(thanks.route, ROUTE_SMALLTALK)
+        self.assertIn("welcome", thanks.canned_reply)
+        # Small talk followed by a real question is not small talk
+        self.assertEqual(self.router.route("hi, when are the term dates?").route, ROUTE_UNIVERSITY_CONTENT)
+        self.assertEqual(self.embedded, [])
+
+    def test_off_topic_terms_confirmed_by_classifier(self):
+        """Test that an off-topic term only refuses a query whose nearest centroid is off-topic"""
+        decision = self.router.route("How do I hack the wifi?")
+        self.assertEqual((decision.route, decision.source), (ROUTE_OFF_TOPIC, "pattern"))
+        self.assertIsNotNone(decision.canned_reply)
+        # Nearest to course help, so answered
+        self.assertEqual(self.router.route("Can recursion steal the stack?").route, ROUTE_COURSE_HELP)
+        for query in ("How do drugs bind to receptors?", "I forgot my student portal password",
+                      "What weapons were used in WW1?"):
+            self.assertNotEqual(self.router.route(query).route, ROUTE_OFF_TOPIC, query)
+
+    def test_off_topic_terms_refuse_without_model(self):
+        """Test that off-topic terms still refuse when the classifier is unavailable, without memoising"""
+        router = QueryRouter(embedder=mock.Mock(side_effect=RuntimeError("no model")))
+        self.assertEqual(router.route("How do I hack the wifi?").route, ROUTE_OFF_TOPIC)
+        self.assertEqual(router.stats()["memoised"], 0)
+
+    def test_nearest_centroid_for_undecided_queries(self):
+        """Test that queries without pattern matches are routed by embedding similarity"""
+        decision = self.router.route("Walk me through recursion")
+        self.assertEqual((decision.route, decision.source), (ROUTE_COURSE_HELP, "centroid"))
+        self.assertFalse(decision.use_retrieval)
+        self.assertIsNone(decision.canned_reply)
+        # Close to no centroid: treated as course help
+        self.assertEqual(self.router.route("Integrate x squared").source, "default")
+
+    def test_decisions_are_memoised(self):
+        """Test that a repeated query is classified only once"""
+        self.router.route("Walk me through recursion")
+        embedded = len(self.embedded)
+        self.router.route("walk me  through Recursion")
+        self.assertEqual(len(self.embedded), embedded)
+        self.assertEqual(self.router.stats()["routes"][ROUTE_COURSE_HELP], 2)
+
+    def test_course_help_skips_retrieval(self):
+        """Test that the AI service only retrieves university content for university queries"""
+        service = OllamaService()
+        service.query_router = self.router
+        with mock.patch("ai.ai_service.content_embedding_service.retrieve_relevant_content",
+                        return_value=[]) as retrieve:
+            service._get_relevant_university_content("Walk me through recursion")
+            retrieve.assert_not_called()
+            service._get_relevant_university_content("What events are on campus?")
+            retrieve.assert_called_once()
+        self.assertEqual(service.canned_response("hello there"), self.router.route("hi").canned_reply)
+
+    def test_templated_prompt_routed_once_on_question(self):
+        """Test that a routed question is not classified again, and retrieval searches the question itself"""
+        service = OllamaService()
+        service.query_router = self.router
+        question = "What events are on campus?"
+        route = service.route_query(question)
+        prompt = f"The user is asking about general topic.\nTheir message is: {question}\nProvide a helpful response."
+        with mock.patch("ai.ai_service.content_embedding_service.retrieve_relevant_content",
+                        return_value=[]) as retrieve:
+            service._build_request(prompt, 64, False, route=route, retrieval_query=question)
+        self.assertEqual(retrieve.call_args.args[0], question)
+        self.assertEqual(sum(self.router.stats()["routes"].values()), 1)
+
+
+class ContextAssemblerTest(SimpleTestCase):
+    def result(self, item_id, score, vector, summary="Details.", content_type="news"):
+        vector = np.asarray(vector, dtype=np.float32)
+        return {
+            "id": item_id, "title": f"Item {item_id}", "summary": summary, "passage": summary,
+            "content_type": content_type, "published_date": None, "url": None, "source_name": None,
+            "university_name": None, "score": score, "embedding": vector / np.linalg.norm(vector),
+        }
+
+    def test_low_scores_are_dropped(self):
+        """Test that results under the minimum score are not included"""
+        assembler = ContextAssembler(min_score=0.5)
+        context = assembler.assemble([self.result(1, 0.8, [1, 0]), self.result(2, 0.2, [0, 1])])
+        self.assertEqual([item["id"] for item in context.items], [1])
+        self.assertEqual(context.below_threshold, 1)
+        self.assertEqual(assembler.assemble([self.result(3, 0.1, [1, 0])]).text, "")
+
+    def test_lexical_hit_survives_assembly(self):
+        """Test that a BM25-only hit with a low cosine score is kept and ranked by its fused rank"""
+        assembler = ContextAssembler(min_score=0.5, max_items=2)
+        vector_hit = self.result(1, 0.8, [1, 0, 0])
+        vector_hit.update(rrf_score=1 / 61, lexical_match=False)
+        code_hit = self.result(2, 0.1, [0, 1, 0], summary="CSY1019 exam moved.")
+        code_hit.update(rrf_score=1 / 61 + 1 / 62, lexical_match=True)
+        weak_hit = self.result(3, 0.2, [0, 0, 1])
+        weak_hit.update(rrf_score=1 / 62, lexical_match=False)
+        context = assembler.assemble([code_hit, vector_hit, weak_hit])
+        self.assertEqual([item["id"] for item in context.items], [2, 1])
+        self.assertEqual(context.below_threshold, 1)
+        self.assertIn("CSY1019", context.text)
+
+    def test_near_duplicates_are_skipped(self):
+        """Test that MMR drops a near-copy of a picked result and prefers a diverse one"""
+        assembler = ContextAssembler(min_score=0, mmr_lambda=0.5, max_items=2)
+        context = assembler.assemble([
+            self.result(1, 0.9, [1, 0, 0]),
+            self.result(2, 0.89, [1, 0.01, 0]),
+            self.result(3, 0.7, [0.6, 0.8, 0]),
+        ])
+        self.assertEqual([item["id"] for item in context.items], [1, 3])
+        self.assertEqual(context.redundant, 1)
+        self.assertIn("NEWS: Item 1. Details.", context.text)
+        self.assertTrue(context.text.startswith("Here is some relevant information about the university:"))
+
+    def test_token_budget(self):
+        """Test that results which do not fit the budget are left out and the size is reported"""
+        assembler = ContextAssembler(min_score=0, max_tokens=60)
+        context = assembler.assemble([
+            self.result(1, 0.9, [1, 0], summary="x" * 400),
+            self.result(2, 0.8, [0, 1], summary="Short."),
+        ])
+        self.assertEqual([item["id"] for item in context.items], [2])
+        self.assertEqual(context.over_budget, 1)
+        self.assertLessEqual(context.tokens, 60)
+        self.assertEqual(assembler.stats()["contexts"], 1)
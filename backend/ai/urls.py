@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import AIQueryView
+from .views import AIQueryView, AIMetricsView
 
 urlpatterns = [
     path('query/', AIQueryView.as_view(), name='ai-query'),
+    path('metrics/', AIMetricsView.as_view(), name='ai-metrics'),
 ] 
\ No newline at end of file
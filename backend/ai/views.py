@@ -1,30 +1,34 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from .serializers import AIQuerySerializer
-from .ai_service import OllamaService
+from .ai_service import ollama_service, ollama_health_monitor
+from .admission import ollama_admission, AdmissionRejected
+from .query_router import ROUTE_OFF_TOPIC
 
 class AIQueryView(APIView):
     permission_classes = [IsAuthenticated]
-    ai_service = OllamaService()
+    ai_service = ollama_service
 
     def post(self, request):
-        # Check if Ollama service is available
-        if not self.ai_service.is_model_available():
-            try:
-                # Try to pull the model if not available
-                pulled = self.ai_service.pull_model()
-                if not pulled:
-                    return Response({
-                        'error': 'The AI model is not available.',
-                        'fallback_message': self.ai_service.get_fallback_message()
-                    }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-            except Exception as e:
-                return Response({
-                    'error': f'Error accessing Ollama service: {str(e)}',
-                    'fallback_message': self.ai_service.get_fallback_message()
-                }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        # Fail fast while the Ollama circuit breaker is open
+        if self.ai_service.circuit_breaker.is_open():
+            return Response({
+                'error': 'The AI service is temporarily unavailable.',
+                'fallback_message': self.ai_service.get_fallback_message()
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        # Check the cached Ollama status rather than probing Ollama on every request
+        health = ollama_health_monitor.get_status()
+        if not health['model_available']:
+            if health['service_available']:
+                # Pull the model on a Celery worker instead of blocking this request
+                ollama_health_monitor.request_model_pull()
+            return Response({
+                'error': 'The AI model is not available.',
+                'fallback_message': self.ai_service.get_fallback_message()
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         # Process the query
         serializer = AIQuerySerializer(data=request.data)
@@ -35,16 +39,47 @@ class AIQueryView(APIView):
         context = serializer.validated_data.get('context', '')
         max_length = serializer.validated_data.get('max_length', 512)
 
+        # Classify the query once, for the refusal, small talk and retrieval
+        route = self.ai_service.route_query(query)
+
         # Check for off-topic queries
-        if self.ai_service.is_off_topic(query):
+        if route.route == ROUTE_OFF_TOPIC:
             return Response({
                 'error': 'This query appears to be off-topic or inappropriate.',
                 'fallback_message': self.ai_service.get_fallback_message()
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        # Small talk gets a fixed reply without calling the LLM
+        canned_response = route.canned_reply
+        if canned_response is not None:
+            return Response({
+                'response': canned_response,
+                'query': query
+            }, status=status.HTTP_200_OK)
+
+        # Reuse the answer to a near-identical question if one is cached
+        university_id = request.user.get_university_id()
+        if not context:
+            cached = self.ai_service.semantic_cache.get(query, university_id, max_length=max_length)
+            if cached is not None:
+                return Response({
+                    'response': cached,
+                    'query': query
+                }, status=status.HTTP_200_OK)
+
         # Generate response
         prompt = f"Context: {context}\nQuery: {query}" if context else query
-        response = self.ai_service.generate_response(prompt, max_length)
+        try:
+            response = self.ai_service.generate_response(
+                prompt, max_length, university_id=university_id, route=route, retrieval_query=query
+            )
+            if not context and self.ai_service.is_usable_response(response):
+                self.ai_service.semantic_cache.put(query, response, university_id, max_length=max_length)
+        except AdmissionRejected as e:
+            return Response({
+                'error': str(e),
+                'fallback_message': self.ai_service.get_fallback_message()
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)})
 
         if isinstance(response, str) and response.startswith("Error"):
             return Response({
@@ -55,4 +90,19 @@ class AIQueryView(APIView):
         return Response({
             'response': response,
             'query': query
-        }, status=status.HTTP_200_OK) 
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+
+class AIMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Report LLM admission metrics for this worker process
+        return Response({
+            'admission': ollama_admission.metrics(),
+            'circuit_state': ollama_service.circuit_breaker.state,
+            'semantic_cache': ollama_service.semantic_cache.stats(),
+            'prompt_cache': ollama_service.prompt_cache.stats(),
+            'query_router': ollama_service.query_router.stats(),
+            'rag_context': ollama_service.context_assembler.stats(),
+        }, status=status.HTTP_200_OK)
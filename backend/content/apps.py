@@ -1,6 +1,39 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
+def should_warm_up_embeddings(argv=None) -> bool:
+    """
+    Whether this process should load the embedding model in the background at startup.
+
+    Only when CONTENT_EMBEDDING_WARMUP is enabled, and only in processes that
+    serve requests: management commands other than runserver start without the
+    model, and Celery workers warm up per child process from worker_process_init.
+    """
+    if os.getenv("CONTENT_EMBEDDING_WARMUP", "False").lower() != "true":
+        return False
+    argv = sys.argv if argv is None else argv
+    program = os.path.basename(argv[0]) if argv else ""
+    if program.startswith("celery"):
+        return False
+    if program == "manage.py":
+        if argv[1:2] != ["runserver"]:
+            return False
+        # The autoreloader's parent process only watches files
+        return os.environ.get("RUN_MAIN") == "true" or "--noreload" in argv
+    return True
+
+
 class ContentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'content'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
+
+        if should_warm_up_embeddings():
+            from .embeddings import content_embedding_service
+            content_embedding_service.warm_up_in_background()
@@ -0,0 +1,49 @@
+import os
+import re
+from typing import List
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+# Passage size in characters and number of sentences repeated between neighbouring passages
+CHUNK_CHARS = int(os.getenv("CONTENT_CHUNK_CHARS", "600"))
+CHUNK_OVERLAP_SENTENCES = int(os.getenv("CONTENT_CHUNK_OVERLAP_SENTENCES", "1"))
+
+
+def _sentences(text: str, max_chars: int) -> List[str]:
+    """Split text into sentences, breaking any sentence longer than max_chars at word boundaries"""
+    sentences = []
+    for sentence in SENTENCE_BOUNDARY.split(" ".join(text.split())):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            sentences.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP_SENTENCES) -> List[str]:
+    """
+    Split text into passages of whole sentences of up to max_chars each.
+
+    Each passage starts with the last `overlap` sentences of the previous one, so
+    a fact spanning a passage boundary is still retrievable from one passage.
+    """
+    sentences = _sentences(text, max_chars)
+    chunks = []
+    current = []
+    length = 0
+    for sentence in sentences:
+        if current and length + len(sentence) + 1 > max_chars:
+            chunks.append(" ".join(current))
+            # Carry the overlap over unless it would leave no room for new text
+            current = current[-overlap:] if overlap else []
+            length = sum(len(s) + 1 for s in current)
+            if length + len(sentence) + 1 > max_chars:
+                current, length = [], 0
+        current.append(sentence)
+        length += len(sentence) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
@@ -0,0 +1,123 @@
+import base64
+import http.client
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingServerError(Exception):
+    """The embedding server could not be reached or rejected a request"""
+
+
+def encode_array(array: np.ndarray) -> Dict[str, Any]:
+    """Pack a float32 array for JSON as base64 bytes, far smaller and faster than lists of floats"""
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_array(payload: Dict[str, Any]) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP over a Unix domain socket"""
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class EmbeddingServerClient:
+    """
+    Client for the embedding server (`manage.py run_embedding_server`).
+
+    `url` is either unix:///path/to/socket or http://127.0.0.1:port. Each thread
+    keeps its own keep-alive connection. When the server cannot be reached the
+    client reports itself unavailable for `retry_after` seconds, so callers fall
+    back to the local model without waiting on a dead socket for every request.
+    """
+
+    def __init__(self, url: str, timeout: float = None, retry_after: float = 30.0):
+        self.url = url
+        parsed = urlparse(url)
+        if parsed.scheme == "unix":
+            self.socket_path = parsed.path
+        elif parsed.scheme == "http":
+            self.socket_path = None
+            self.host, self.port = parsed.hostname, parsed.port or 80
+        else:
+            raise ValueError(f"Unsupported embedding server URL: {url}")
+        self.timeout = timeout or float(os.getenv("CONTENT_EMBEDDING_SERVER_TIMEOUT", "10"))
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self._local = threading.local()
+
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.socket_path:
+                connection = UnixHTTPConnection(self.socket_path, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, payload: Dict[str, Any] = None) -> Dict[str, Any]:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        # A kept-alive connection may have been closed by the server; retry once on a fresh one
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                self._local.connection = None
+                if attempt == 1:
+                    self._down_until = time.monotonic() + self.retry_after
+                    raise EmbeddingServerError(f"Embedding server at {self.url} unavailable: {e}") from e
+
+        try:
+            result = json.loads(data)
+        except ValueError:
+            raise EmbeddingServerError(f"Invalid response from embedding server: {data[:200]!r}")
+        if response.status != 200:
+            raise EmbeddingServerError(result.get("error", f"HTTP {response.status}"))
+        return result
+
+    def health(self) -> Dict[str, Any]:
+        return self._request("GET", "/health")
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """L2-normalised float32 embeddings for the texts"""
+        return decode_array(self._request("POST", "/encode", {"texts": list(texts)})["embeddings"])
+
+    def search(self, query: str, k: int = 3, **filters) -> List[Dict[str, Any]]:
+        """Run retrieve_relevant_content on the server; dates in filters are sent as ISO strings"""
+        filters = {name: str(value) if name.startswith("date_") and value is not None else value
+                   for name, value in filters.items()}
+        results = self._request("POST", "/search", {"query": query, "k": k, **filters})["results"]
+        for item in results:
+            if "embedding" in item:
+                item["embedding"] = decode_array(item["embedding"])
+        return results
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import socketserver
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from .embedding_client import encode_array
+from .query_encoder import QueryEncoder
+
+logger = logging.getLogger(__name__)
+
+SEARCH_OPTIONS = ("content_type", "university_id", "date_from", "date_to", "include_embeddings")
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the embedding server:
+
+    - GET /health: model, snapshot and batching stats
+    - POST /encode {"texts": [...]}: L2-normalised embeddings as base64 float32
+    - POST /search {"query", "k", filters...}: retrieve_relevant_content results
+    """
+
+    # Keep-alive, so each client thread reuses one connection
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("Embedding server: " + format % args)
+
+    def _send(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        self._send(200, self.server.embedding_server.health())
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": f"Invalid JSON: {e}"})
+            return
+
+        server = self.server.embedding_server
+        try:
+            if self.path == "/encode":
+                texts = request.get("texts")
+                if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                    self._send(400, {"error": "'texts' must be a list of strings"})
+                    return
+                self._send(200, {"embeddings": encode_array(server.encode(texts))})
+            elif self.path == "/search":
+                if not isinstance(request.get("query"), str):
+                    self._send(400, {"error": "'query' must be a string"})
+                    return
+                options = {name: request[name] for name in SEARCH_OPTIONS if name in request}
+                results = server.service.retrieve_relevant_content(request["query"], k=int(request.get("k", 3)), **options)
+                for item in results:
+                    if "embedding" in item:
+                        item["embedding"] = encode_array(item["embedding"])
+                self._send(200, {"results": results})
+            else:
+                self._send(404, {"error": f"Unknown endpoint {self.path}"})
+        except Exception as e:
+            logger.error(f"Error handling embedding server request {self.path}: {str(e)}")
+            self._send(500, {"error": str(e)})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("unix", 0)
+
+
+class EmbeddingServer:
+    """
+    Serves one embedding model to every worker on the host.
+
+    Encode requests from all connections go through a shared QueryEncoder, so
+    texts arriving within the batching window are encoded in one model call.
+    Searches run against this process's copy of the content index, which
+    follows published snapshots like any other worker.
+    """
+
+    def __init__(self, service, url: str):
+        self.service = service
+        self.url = url
+        # Texts are encoded as given; passages are case-sensitive
+        self.encoder = QueryEncoder(service._encode_queries, normalize=lambda text: text)
+        self.started_at = time.time()
+        self.httpd = None
+
+    def encode(self, texts):
+        return self.encoder.encode_many(texts)
+
+    def health(self):
+        snapshot = self.service.snapshot
+        return {
+            "status": "ok",
+            "model": self.service.model_name,
+            "snapshot": snapshot.version if snapshot else None,
+            "indexed": len(snapshot.metadata) if snapshot else 0,
+            "uptime": round(time.time() - self.started_at, 1),
+            "batching": self.encoder.stats(),
+        }
+
+    def bind(self):
+        parsed = urlparse(self.url)
+        if parsed.scheme == "unix":
+            # A socket file left behind by a previous run would make bind fail
+            if os.path.exists(parsed.path):
+                os.unlink(parsed.path)
+            self.httpd = UnixHTTPServer(parsed.path, EmbeddingRequestHandler)
+        elif parsed.scheme == "http":
+            self.httpd = ThreadingHTTPServer((parsed.hostname, parsed.port or 80), EmbeddingRequestHandler)
+            self.httpd.daemon_threads = True
+        else:
+            raise ValueError(f"Unsupported embedding server URL: {self.url}")
+        self.httpd.embedding_server = self
+        return self.httpd
+
+    def serve_forever(self):
+        if self.httpd is None:
+            self.bind()
+        logger.info(f"Embedding server listening on {self.url}")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            parsed = urlparse(self.url)
+            if parsed.scheme == "unix" and os.path.exists(parsed.path):
+                os.unlink(parsed.path)
+
+    def shutdown(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
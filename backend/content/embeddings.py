@@ -1,59 +1,226 @@
+import hashlib
+import importlib.util
 import logging
 import os
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
-from sentence_transformers import SentenceTransformer
+from django.conf import settings
 
+from .chunking import CHUNK_CHARS, CHUNK_OVERLAP_SENTENCES, chunk_text
+from .embedding_client import EmbeddingServerClient, EmbeddingServerError
+from .index_store import IndexSnapshot, IndexStore
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from .metadata_store import ColumnarMetadata
+from .parallel_encode import encode_in_processes
+from .query_encoder import QueryEncoder
 from .models import ScrapedContent, ContentType
+from .vector_index import build_index, normalize_rows
 
 logger = logging.getLogger(__name__)
 
+# sentence-transformers pulls in torch, which takes seconds to import, so it is only
+# imported when the model is first loaded
+EMBEDDING_MODEL_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+
+# What an index update encoded: content items and the passages they were split into
+EmbeddingUpdate = namedtuple("EmbeddingUpdate", ["items", "passages"])
+
+# Bump when the text fed to the model changes so stored vectors are rebuilt
+EMBEDDING_TEXT_VERSION = 2
+
 class ContentEmbeddingService:
     """Service for generating and retrieving embeddings for scraped university content"""
     
-    def __init__(self):
+    def __init__(self, server_url: str = None):
         self.model_name = "paraphrase-MiniLM-L6-v2"  # Lightweight, fast model good for RAG
         self.embedding_dim = 384  # Dimension of the embeddings from this model
-        self.embeddings_path = "content_embeddings.npz"
-        self.metadata_path = "content_metadata.npz"
+        # Versioned snapshots of L2-normalised float32 embeddings, published via a manifest
+        self.store = IndexStore(os.getenv("CONTENT_INDEX_DIR", os.path.join(settings.BASE_DIR, "content_index")))
+        # Files written by older versions, imported as the first snapshot
+        self.legacy_embeddings_paths = [
+            os.path.join(settings.BASE_DIR, "content_embeddings.npy"),
+            os.path.join(settings.BASE_DIR, "content_embeddings.npz"),
+        ]
+        self.legacy_metadata_path = os.path.join(settings.BASE_DIR, "content_metadata.npz")
+        self.reload_interval = float(os.getenv("CONTENT_INDEX_CHECK_INTERVAL", "10"))
+        # Hybrid retrieval: BM25 and vector rankings fused with reciprocal-rank fusion
+        self.hybrid_search = os.getenv("CONTENT_HYBRID_SEARCH", "True").lower() == "true"
+        self.hybrid_candidates = int(os.getenv("CONTENT_HYBRID_CANDIDATES", "20"))
+        self.lexical_budget_ms = float(os.getenv("CONTENT_LEXICAL_BUDGET_MS", "20"))
+        # Candidate passages fetched per requested result, before de-duplicating by item
+        self.passages_per_result = int(os.getenv("CONTENT_PASSAGES_PER_RESULT", "4"))
+        # Bulk encoding during index updates
+        self.encode_batch_size = int(os.getenv("CONTENT_EMBEDDING_BATCH_SIZE", "50"))
+        self.encode_workers = int(os.getenv("CONTENT_EMBEDDING_WORKERS", "1"))
         self.model = None
-        self.embeddings = None
-        self.metadata = []
+        self._model_lock = threading.Lock()
+        # Optional shared embedding server (manage.py run_embedding_server); the local model is the fallback
+        if server_url is None:
+            server_url = os.getenv("CONTENT_EMBEDDING_SERVER", "")
+        self.server = EmbeddingServerClient(server_url) if server_url else None
+        # Cached, micro-batched query encoding shared by all request threads
+        self.query_encoder = QueryEncoder(self._encode_queries)
+        self.snapshot = None
+        self._manifest_mtime = None
+        self._next_reload_check = 0.0
+        self._reload_lock = threading.Lock()
+    
+    # The current snapshot's parts; callers that need a consistent view should hold self.snapshot
+    @property
+    def embeddings(self):
+        return self.snapshot.embeddings if self.snapshot else None
+    
+    @property
+    def metadata(self):
+        return self.snapshot.metadata if self.snapshot else ColumnarMetadata.from_records([])
+    
+    @property
+    def index(self):
+        return self.snapshot.index if self.snapshot else None
+    
+    @property
+    def stored_version(self):
+        return self.snapshot.index_version if self.snapshot else None
     
     def _load_model(self):
         """Load the embedding model if not already loaded"""
-        if self.model is None:
+        if self.model is not None:
+            return
+        # A request and the background warm-up may race to load it
+        with self._model_lock:
+            if self.model is not None:
+                return
             try:
                 logger.info(f"Loading embedding model: {self.model_name}")
+                from sentence_transformers import SentenceTransformer
                 self.model = SentenceTransformer(self.model_name)
                 logger.info(f"Embedding model loaded successfully")
             except Exception as e:
                 logger.error(f"Error loading embedding model: {str(e)}")
                 raise
     
-    def _ensure_embeddings_exist(self):
-        """Load the embeddings from file if they exist"""
-        if self.embeddings is None:
+    def warm_up(self) -> float:
+        """
+        Load the model and the current snapshot and run one encode, so the first
+        request does not pay for them. Returns the time taken in seconds.
+        """
+        start = time.perf_counter()
+        if self.server is None:
+            self._load_model()
+        # The first forward pass allocates buffers and initialises kernels
+        self.generate_embeddings(["warm up"])
+        self._ensure_embeddings_exist()
+        elapsed = time.perf_counter() - start
+        logger.info(f"Embedding model warmed up in {elapsed:.2f}s")
+        return elapsed
+    
+    def warm_up_in_background(self) -> threading.Thread:
+        """Run warm_up() in a daemon thread so process startup is not blocked"""
+        def run():
             try:
-                # Check if embeddings file exists
-                if os.path.exists(self.embeddings_path) and os.path.exists(self.metadata_path):
-                    logger.info("Loading existing embeddings and metadata")
-                    self.embeddings = np.load(self.embeddings_path)['embeddings']
-                    data = np.load(self.metadata_path, allow_pickle=True)
-                    self.metadata = data['metadata'].tolist()
-                else:
-                    logger.info("No existing embeddings found, initializing empty arrays")
-                    self.embeddings = np.zeros((0, self.embedding_dim), dtype=np.float32)
-                    self.metadata = []
+                self.warm_up()
             except Exception as e:
-                logger.error(f"Error loading embeddings: {str(e)}")
-                self.embeddings = np.zeros((0, self.embedding_dim), dtype=np.float32)
-                self.metadata = []
+                logger.error(f"Error warming up embedding model: {str(e)}")
+        
+        thread = threading.Thread(target=run, name="embedding-warm-up", daemon=True)
+        thread.start()
+        return thread
+    
+    def _ensure_embeddings_exist(self):
+        """Load the published embeddings, picking up newer snapshots from other processes"""
+        if self.snapshot is None:
+            with self._reload_lock:
+                if self.snapshot is None:
+                    self._load_snapshot()
+            return
+        
+        # Cheap periodic check: stat the manifest and reload only when it changed
+        now = time.monotonic()
+        if now < self._next_reload_check:
+            return
+        self._next_reload_check = now + self.reload_interval
+        if self.store.manifest_mtime() == self._manifest_mtime:
+            return
+        # One thread reloads; the others keep serving the current snapshot meanwhile
+        if self._reload_lock.acquire(blocking=False):
+            try:
+                self._load_snapshot()
+            finally:
+                self._reload_lock.release()
+    
+    def _load_snapshot(self):
+        """Open the current snapshot and swap it in once its index is built"""
+        try:
+            # Read before the manifest, so a publish in between is noticed on the next check
+            mtime = self.store.manifest_mtime()
+            manifest = self.store.read_manifest()
+            if manifest is None and self._import_legacy_files():
+                mtime = self.store.manifest_mtime()
+                manifest = self.store.read_manifest()
+            
+            if manifest is None:
+                logger.info("No existing embeddings found, initializing empty arrays")
+                snapshot = self._empty_snapshot()
+            elif self.snapshot is not None and manifest["version"] == self.snapshot.version:
+                self._manifest_mtime = mtime
+                return
+            else:
+                logger.info(f"Loading content index snapshot {manifest['version']}")
+                snapshot = self.store.load(manifest)
+        except Exception as e:
+            # The manifest time is left unchanged, so the next check retries the load
+            logger.error(f"Error loading embeddings: {str(e)}")
+            if self.snapshot is not None:
+                return
+            self.snapshot = self._empty_snapshot()
+            self.snapshot.index = build_index(self.snapshot.embeddings)
+            return
+        
+        snapshot.index = build_index(snapshot.embeddings, quantized=snapshot.quantized)
+        logger.info(f"Built {snapshot.index.kind} index over {len(snapshot.index)} content embeddings")
+        # A single reference assignment, so in-flight queries keep their own snapshot
+        self.snapshot = snapshot
+        self._manifest_mtime = mtime
+    
+    def _empty_snapshot(self) -> IndexSnapshot:
+        return IndexSnapshot(
+            None, np.zeros((0, self.embedding_dim), dtype=np.float32), ColumnarMetadata.from_records([])
+        )
+    
+    def _import_legacy_files(self) -> bool:
+        """One-off import of embeddings saved next to manage.py by older versions"""
+        embeddings_path = next((path for path in self.legacy_embeddings_paths if os.path.exists(path)), None)
+        if embeddings_path is None or not os.path.exists(self.legacy_metadata_path):
+            return False
+        logger.info(f"Importing {embeddings_path} as the first content index snapshot")
+        embeddings = np.load(embeddings_path)
+        if isinstance(embeddings, np.lib.npyio.NpzFile):
+            embeddings = embeddings['embeddings']
+        data = np.load(self.legacy_metadata_path, allow_pickle=True)
+        index_version = str(data['version']) if 'version' in data else None
+        metadata = ColumnarMetadata.from_records(data['metadata'].tolist())
+        self.store.publish(normalize_rows(embeddings), metadata, index_version)
+        return True
+    
+    def _publish(self, embeddings: np.ndarray, metadata: List[Dict[str, Any]], lexical: LexicalIndex):
+        """Publish a new snapshot and switch this process to it"""
+        self.store.publish(embeddings, ColumnarMetadata.from_records(metadata), self.index_version, lexical)
+        with self._reload_lock:
+            self._load_snapshot()
     
     def generate_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Generate embeddings for a list of texts"""
+        """Generate embeddings for a list of texts, on the embedding server when one is configured"""
+        if self._use_server():
+            try:
+                return self.server.encode(texts)
+            except EmbeddingServerError as e:
+                logger.warning(f"{str(e)}; encoding locally")
         self._load_model()
         try:
             embeddings = self.model.encode(texts, convert_to_numpy=True)
@@ -62,107 +229,281 @@ class ContentEmbeddingService:
             logger.error(f"Error generating embeddings: {str(e)}")
             raise
     
-    def update_content_embeddings(self):
-        """Update embeddings for all scraped content"""
-        self._load_model()
-        self._ensure_embeddings_exist()
+    def _use_server(self) -> bool:
+        return self.server is not None and self.server.available()
+    
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        return normalize_rows(self.generate_embeddings(queries))
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Generate the L2-normalised embedding for a search query (cached; read-only)"""
+        return self.query_encoder.encode(query)
+    
+    @staticmethod
+    def _item_passages(item) -> List[str]:
+        """Split an item's summary and content into sentence-aware, overlapping passages"""
+        text = " ".join(part for part in (item.summary, item.content) if part)
+        return chunk_text(text) or [item.title]
+    
+    @staticmethod
+    def _item_source_text(item) -> str:
+        """The full text of an item, used for change detection and the lexical index"""
+        return f"{item.title}\n{item.summary}\n{item.content}"
+    
+    @staticmethod
+    def _item_metadata(item, content_hash: str) -> Dict[str, Any]:
+        """Build the metadata stored alongside an item's embedding for retrieval"""
+        return {
+            'id': item.id,
+            'title': item.title,
+            'summary': item.summary,
+            'url': item.url,
+            'content_type': item.content_type,
+            'published_date': item.published_date.isoformat() if item.published_date else None,
+            'source_name': item.source.name if item.source else None,
+            'university_name': item.source.university.name if item.source and item.source.university else None,
+            'university_id': item.source.university_id if item.source else None,
+            'content_hash': content_hash
+        }
+    
+    @property
+    def index_version(self) -> str:
+        """Identifies how vectors were produced; a change forces a full re-embed"""
+        return f"{self.model_name}:{EMBEDDING_TEXT_VERSION}:{CHUNK_CHARS}:{CHUNK_OVERLAP_SENTENCES}"
+    
+    def _encode_passages(self, to_encode: List[tuple], embeddings: np.ndarray, batch_size: int, workers: int):
+        """
+        Encode (row, text) pairs in batches straight into their rows of the preallocated array.
+        
+        With more than one worker, batches are encoded concurrently: in a pool of
+        processes with a model each, or by as many threads sending requests to
+        the embedding server, which batches them together.
+        """
+        batches = [to_encode[i:i + batch_size] for i in range(0, len(to_encode), batch_size)]
+        texts = [[text for _, text in batch] for batch in batches]
+        if workers > 1 and len(batches) > 1:
+            if self._use_server():
+                results = self._encode_in_threads(texts, workers)
+            else:
+                logger.info(f"Encoding {len(to_encode)} passages with {workers} worker processes")
+                results = encode_in_processes(self.model_name, texts, workers)
+        else:
+            results = map(self.generate_embeddings, texts)
+        
+        start = time.perf_counter()
+        for number, (batch, vectors) in enumerate(zip(batches, results), 1):
+            embeddings[[row for row, _ in batch]] = normalize_rows(vectors)
+            logger.info(f"Processed batch {number}/{len(batches)}, embedded {len(batch)} passages")
+        elapsed = time.perf_counter() - start
+        if to_encode:
+            logger.info(f"Encoded {len(to_encode)} passages in {elapsed:.1f}s "
+                        f"({len(to_encode) / max(elapsed, 1e-9):.1f} passages/s)")
+    
+    def _encode_in_threads(self, batches: List[List[str]], workers: int):
+        with ThreadPoolExecutor(workers) as pool:
+            yield from pool.map(self.generate_embeddings, batches)
+    
+    def update_content_embeddings(self, full: bool = False, workers: int = None,
+                                  batch_size: int = None) -> EmbeddingUpdate:
+        """
+        Update embeddings for scraped content.
+        
+        Each item is split into overlapping passages that are embedded and
+        indexed separately. By default only passages of new or changed items (by
+        hash of their full text) are encoded and tokenised for the lexical index;
+        vectors and word counts of unchanged items are reused and deleted items
+        dropped. full=True rebuilds everything. Returns the number of items and
+        passages encoded.
+        
+        Rows are streamed from the database and encoded in batches of
+        `batch_size` by `workers` processes (CONTENT_EMBEDDING_BATCH_SIZE and
+        CONTENT_EMBEDDING_WORKERS by default).
+        """
+        workers = workers or self.encode_workers
+        batch_size = batch_size or self.encode_batch_size
+        # Start from the latest published snapshot, even if another process just wrote it
+        with self._reload_lock:
+            self._load_snapshot()
         
         try:
-            # Get all content from database
-            content_items = ScrapedContent.objects.all()
-            logger.info(f"Found {len(content_items)} content items to embed")
+            # Reuse existing vectors only if they were produced the same way
+            reusable = {}
+            if not full and self.stored_version == self.index_version:
+                hashes = self.metadata.content_hash
+                for row, item_id in enumerate(self.metadata.ids.tolist()):
+                    if hashes[row]:
+                        # Passage rows of one item are contiguous and in chunk order
+                        reusable.setdefault(item_id, ([], hashes[row].decode('ascii')))[0].append(row)
+            
+            previous_lexical = self.snapshot.lexical if reusable else None
+            # Stream rows instead of caching the whole queryset
+            content_items = ScrapedContent.objects.select_related('source__university').iterator(chunk_size=500)
+            metadata = []
+            kept_rows = []
+            to_encode = []
+            lexical_docs = []
+            changed_items = 0
+            for item in content_items:
+                source_text = self._item_source_text(item)
+                content_hash = hashlib.sha1(source_text.encode('utf-8')).hexdigest()
+                passages = self._item_passages(item)
+                # Metadata is always refreshed so source or date edits show up without re-encoding
+                item_metadata = self._item_metadata(item, content_hash)
+                existing = reusable.get(item.id)
+                unchanged = existing is not None and existing[1] == content_hash and len(existing[0]) == len(passages)
+                changed_items += not unchanged
+                for chunk_index, passage in enumerate(passages):
+                    row = len(metadata)
+                    if unchanged:
+                        kept_rows.append((row, existing[0][chunk_index]))
+                    else:
+                        to_encode.append((row, f"{item.title}. {passage}"))
+                    # Unchanged passages point at their word counts in the previous lexical index
+                    if unchanged and previous_lexical is not None:
+                        lexical_docs.append(existing[0][chunk_index])
+                    else:
+                        lexical_docs.append(Counter(tokenize(f"{item.title} {passage}")))
+                    metadata.append(dict(item_metadata, passage=passage, chunk_index=chunk_index))
+            
+            current_ids = {meta['id'] for meta in metadata}
+            removed = len(set(self.metadata.ids.tolist()) - current_ids)
+            logger.info(f"Found {len(current_ids)} content items ({len(metadata)} passages): {changed_items} new or "
+                        f"changed with {len(to_encode)} passages to embed, {removed} removed")
+            
+            # Nothing to re-encode or drop and rows in the same order: only metadata may have changed
+            if not to_encode and len(kept_rows) == len(self.metadata) and previous_lexical is not None \
+                    and all(new_row == old_row for new_row, old_row in kept_rows):
+                if metadata != self.metadata.to_records():
+                    self._publish(self.embeddings, metadata, previous_lexical)
+                logger.info("Content embeddings are up to date")
+                return EmbeddingUpdate(0, 0)
             
-            # Clear existing embeddings if we're reindexing everything
-            if len(content_items) > 0:
-                self.embeddings = np.zeros((0, self.embedding_dim), dtype=np.float32)
-                self.metadata = []
+            embeddings = np.zeros((len(metadata), self.embedding_dim), dtype=np.float32)
+            if kept_rows:
+                new_rows, old_rows = zip(*kept_rows)
+                embeddings[list(new_rows)] = self.embeddings[list(old_rows)]
             
-            # Process in batches to avoid memory issues
-            batch_size = 50
-            for i in range(0, len(content_items), batch_size):
-                batch = content_items[i:i+batch_size]
-                
-                # Prepare text and metadata for each item
-                texts = []
-                batch_metadata = []
-                
-                for item in batch:
-                    # Combine title, summary and content for embedding
-                    text = f"{item.title}. {item.summary} {item.content[:1000]}"
-                    texts.append(text)
-                    
-                    # Store metadata for retrieval
-                    meta = {
-                        'id': item.id,
-                        'title': item.title,
-                        'summary': item.summary,
-                        'url': item.url,
-                        'content_type': item.content_type,
-                        'published_date': item.published_date.isoformat() if item.published_date else None,
-                        'source_name': item.source.name if item.source else None,
-                        'university_name': item.source.university.name if item.source and item.source.university else None
-                    }
-                    batch_metadata.append(meta)
-                
-                # Generate embeddings
-                batch_embeddings = self.generate_embeddings(texts)
-                
-                # Add to embeddings array
-                self.embeddings = np.vstack([self.embeddings, batch_embeddings]) if self.embeddings.shape[0] > 0 else batch_embeddings
-                self.metadata.extend(batch_metadata)
-                
-                logger.info(f"Processed batch {i//batch_size + 1}, added {len(batch)} items")
+            self._encode_passages(to_encode, embeddings, batch_size, workers)
             
-            # Save embeddings and metadata
-            np.savez(self.embeddings_path, embeddings=self.embeddings)
-            np.savez(self.metadata_path, metadata=np.array(self.metadata, dtype=object))
+            lexical = LexicalIndex.build(lexical_docs, previous_lexical)
             
-            logger.info(f"Updated embeddings for {len(content_items)} content items")
-            return len(content_items)
+            # Publish a new snapshot; other workers pick it up on their next reload check
+            self._publish(embeddings, metadata, lexical)
+            
+            logger.info(f"Updated embeddings: {len(to_encode)} passages encoded, {len(metadata)} passages indexed")
+            return EmbeddingUpdate(changed_items, len(to_encode))
         except Exception as e:
             logger.error(f"Error updating content embeddings: {str(e)}")
             raise
     
-    def retrieve_relevant_content(self, query: str, k: int = 3, content_type: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Retrieve relevant content for a query"""
+    def _search_passages(self, snapshot: IndexSnapshot, query: str, normalized_query: np.ndarray, depth: int,
+                         mask: Optional[np.ndarray]):
+        """
+        Return the top `depth` passage rows, their cosine scores and, in hybrid
+        mode, their RRF scores and the set of rows BM25 found
+        """
+        if not (self.hybrid_search and snapshot.lexical is not None):
+            top_indices, scores = snapshot.index.search(normalized_query, depth, mask=mask)
+            return top_indices, scores, {}, set()
+        vector_rows, _ = snapshot.index.search(normalized_query, depth, mask=mask)
+        # Lexical scoring stops adding (common) query terms once its budget is spent
+        deadline = time.perf_counter() + self.lexical_budget_ms / 1000
+        lexical_rows, _ = snapshot.lexical.search(query, depth, mask=mask, deadline=deadline)
+        rrf_scores = dict(reciprocal_rank_fusion([vector_rows, lexical_rows], depth))
+        top_indices = np.array(list(rrf_scores), dtype=np.int64)
+        lexical = set(lexical_rows.tolist())
+        return top_indices, snapshot.embeddings[top_indices] @ normalized_query, rrf_scores, lexical
+    
+    def retrieve_relevant_content(
+        self,
+        query: str,
+        k: int = 3,
+        content_type: Optional[str] = None,
+        university_id: Optional[int] = None,
+        date_from=None,
+        date_to=None,
+        include_embeddings: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieve relevant content for a query.
+        
+        Optional filters restrict the search to one content type, one university
+        and/or a published-date range; only matching rows are scanned, so k results
+        are returned whenever k items match.
+        
+        With hybrid search on, the top vector and BM25 candidates are fused with
+        reciprocal-rank fusion so exact tokens (module codes, building names,
+        dates) are found even when the embedding misses them. 'score' is always
+        the cosine similarity to the query; hybrid results also carry the fused
+        'rrf_score' and 'lexical_match', whether BM25 found the passage.
+        
+        Items are indexed as passages; each result is the best-matching passage
+        of a distinct item, with the passage text in 'passage'.
+        
+        With include_embeddings, each result also carries the passage's
+        normalised vector in 'embedding', for re-ranking by the caller.
+        
+        With an embedding server configured the search runs there, against the
+        server's copy of the index.
+        """
+        if self._use_server():
+            try:
+                return self.server.search(
+                    query, k, content_type=content_type, university_id=university_id,
+                    date_from=date_from, date_to=date_to, include_embeddings=include_embeddings
+                )
+            except EmbeddingServerError as e:
+                logger.warning(f"{str(e)}; searching locally")
+        
         self._load_model()
         self._ensure_embeddings_exist()
+        # Hold one snapshot for the whole query so a concurrent reload cannot mix versions
+        snapshot = self.snapshot
         
-        if self.embeddings.shape[0] == 0:
+        if snapshot.embeddings.shape[0] == 0:
             logger.warning("No content embeddings available")
             return []
         
         try:
-            # Generate query embedding
-            query_embedding = self.generate_embeddings([query])[0]
-            
-            # Calculate cosine similarity
-            normalized_query = query_embedding / np.linalg.norm(query_embedding)
-            normalized_embeddings = self.embeddings / np.linalg.norm(self.embeddings, axis=1, keepdims=True)
-            similarities = np.dot(normalized_embeddings, normalized_query)
+            mask = snapshot.metadata.filter_mask(
+                content_type=content_type, university_id=university_id, date_from=date_from, date_to=date_to
+            )
+            if mask is not None and not mask.any():
+                logger.info("No content matches the retrieval filters")
+                return []
             
-            # Get top k indices
-            top_indices = np.argsort(similarities)[::-1][:k*2]  # Get more for filtering
+            # Generate query embedding
+            normalized_query = self.embed_query(query)
+            # Several passages of one item can rank highly, so look deeper than k, and
+            # deeper still until k distinct items are found or no matching rows are left
+            depth = max(k * self.passages_per_result, self.hybrid_candidates)
+            available = int(np.count_nonzero(mask)) if mask is not None else len(snapshot.metadata)
+            while True:
+                top_indices, scores, rrf_scores, lexical = self._search_passages(
+                    snapshot, query, normalized_query, depth, mask
+                )
+                # Keep the best passage of each item
+                best_rows = {}
+                for position, idx in enumerate(top_indices.tolist()):
+                    best_rows.setdefault(int(snapshot.metadata.ids[idx]), position)
+                    if len(best_rows) >= k:
+                        break
+                if len(best_rows) >= k or depth >= available:
+                    break
+                depth = min(available, depth * 2)
             
-            # Filter and prepare results
+            # Decode metadata only for the rows returned
             results = []
-            for idx in top_indices:
-                if idx >= len(self.metadata):
-                    continue
-                    
-                item = self.metadata[idx]
-                
-                # Filter by content type if specified
-                if content_type and item['content_type'] != content_type:
-                    continue
-                
-                # Add similarity score
-                item_copy = item.copy()
-                item_copy['score'] = float(similarities[idx])
-                results.append(item_copy)
-                
-                if len(results) >= k:
-                    break
+            for position in best_rows.values():
+                idx = int(top_indices[position])
+                item = snapshot.metadata.row(idx)
+                item['score'] = float(scores[position])
+                if rrf_scores:
+                    item['rrf_score'] = rrf_scores[idx]
+                    item['lexical_match'] = idx in lexical
+                if include_embeddings:
+                    item['embedding'] = np.array(snapshot.embeddings[idx])
+                results.append(item)
             
             return results
         
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .lexical_index import LexicalIndex
+from .metadata_store import ColumnarMetadata
+from .vector_index import QuantizedVectors
+
+logger = logging.getLogger(__name__)
+
+
+class IndexSnapshot:
+    """One published, immutable version of the content embeddings and their metadata"""
+
+    __slots__ = ("version", "embeddings", "metadata", "index_version", "index", "lexical", "quantized")
+
+    def __init__(self, version, embeddings, metadata, index_version=None, index=None, lexical=None,
+                 quantized=None):
+        self.version = version
+        self.embeddings = embeddings
+        self.metadata = metadata
+        self.index_version = index_version
+        self.index = index
+        self.lexical = lexical
+        self.quantized = quantized
+
+
+class IndexStore:
+    """
+    Versioned on-disk store for content embedding snapshots.
+
+    Each snapshot is written to its own directory under snapshots/ and only
+    becomes visible once manifest.json is atomically replaced to point at it, so
+    readers never see a half-written or mismatched embeddings/metadata pair.
+    Older snapshots are pruned; workers that still have one memory-mapped keep
+    reading it until they reload, because unlinked files stay valid while open.
+    """
+
+    MANIFEST = "manifest.json"
+    EMBEDDINGS_FILE = "embeddings.npy"
+    METADATA_DIR = "metadata"
+    LEXICAL_DIR = "lexical"
+    QUANTIZED_DIR = "int8"
+    # Pickled metadata written by older versions
+    LEGACY_METADATA_FILE = "metadata.npz"
+
+    def __init__(self, root: str, keep: int = None):
+        self.root = root
+        self.keep = keep or int(os.getenv("CONTENT_INDEX_KEEP", "3"))
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, self.MANIFEST)
+
+    @property
+    def snapshots_dir(self) -> str:
+        return os.path.join(self.root, "snapshots")
+
+    def manifest_mtime(self) -> Optional[int]:
+        """Cheap change check: the manifest's modification time, or None if unpublished"""
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def publish(self, embeddings: np.ndarray, metadata: ColumnarMetadata, index_version: str,
+                lexical: LexicalIndex = None) -> str:
+        """Write a new snapshot and switch the manifest to it; returns the snapshot version"""
+        version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+        # Write into a hidden temp directory, then rename it into place
+        tmp_dir = os.path.join(self.snapshots_dir, f".{version}.tmp")
+        os.makedirs(tmp_dir)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with open(os.path.join(tmp_dir, self.EMBEDDINGS_FILE), 'wb') as f:
+            np.save(f, embeddings)
+        # Quantized once here, so workers memory-map the codes instead of each encoding a private copy
+        QuantizedVectors.encode(embeddings).save(os.path.join(tmp_dir, self.QUANTIZED_DIR))
+        metadata.save(os.path.join(tmp_dir, self.METADATA_DIR))
+        if lexical is not None:
+            lexical.save(os.path.join(tmp_dir, self.LEXICAL_DIR))
+        os.rename(tmp_dir, os.path.join(self.snapshots_dir, version))
+
+        manifest = {
+            "version": version,
+            "index_version": index_version,
+            "count": int(embeddings.shape[0]),
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        tmp_manifest = f"{self.manifest_path}.{version}.tmp"
+        with open(tmp_manifest, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, self.manifest_path)
+        logger.info(f"Published content index snapshot {version} with {manifest['count']} items")
+
+        self.prune(version)
+        return version
+
+    def load(self, manifest: Dict[str, Any] = None) -> Optional[IndexSnapshot]:
+        """Open the snapshot the manifest points at, with the embeddings memory-mapped"""
+        manifest = manifest or self.read_manifest()
+        if manifest is None:
+            return None
+        snapshot_dir = os.path.join(self.snapshots_dir, manifest["version"])
+        # Memory-map read-only so every worker on the host shares one page-cache copy
+        embeddings = np.load(os.path.join(snapshot_dir, self.EMBEDDINGS_FILE), mmap_mode='r')
+        metadata_dir = os.path.join(snapshot_dir, self.METADATA_DIR)
+        if os.path.isdir(metadata_dir):
+            metadata = ColumnarMetadata.load(metadata_dir)
+        else:
+            records = np.load(os.path.join(snapshot_dir, self.LEGACY_METADATA_FILE), allow_pickle=True)['metadata']
+            metadata = ColumnarMetadata.from_records(records.tolist())
+        # Snapshots published before hybrid search have no lexical index
+        lexical_dir = os.path.join(snapshot_dir, self.LEXICAL_DIR)
+        lexical = LexicalIndex.load(lexical_dir) if os.path.isdir(lexical_dir) else None
+        # Older snapshots have no int8 codes; the index encodes them itself if quantization is on
+        quantized_dir = os.path.join(snapshot_dir, self.QUANTIZED_DIR)
+        quantized = QuantizedVectors.load(quantized_dir) if os.path.isdir(quantized_dir) else None
+        return IndexSnapshot(manifest["version"], embeddings, metadata, manifest.get("index_version"), lexical=lexical,
+                             quantized=quantized)
+
+    def prune(self, current: str):
+        """Delete all but the newest `keep` snapshots"""
+        versions = sorted(
+            name for name in os.listdir(self.snapshots_dir)
+            if not name.startswith(".") and name != current
+        )
+        for name in versions[:max(0, len(versions) - self.keep + 1)]:
+            shutil.rmtree(os.path.join(self.snapshots_dir, name), ignore_errors=True)
@@ -0,0 +1,157 @@
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .vector_index import top_k
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+MAX_TOKEN_LENGTH = 32
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were what when where
+which who will with you your i me my we our do does did can how about
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; module codes like CSY1019 and years stay whole"""
+    return [
+        token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the same rows as the vector index.
+
+    Alongside the postings (term -> rows) each row's bag of words is kept, so an
+    incremental update re-tokenises only new or changed documents and copies the
+    rest from the previous snapshot. All arrays are saved as .npy files and
+    memory-mapped on load.
+    """
+
+    ARRAYS = ("vocab", "doc_offsets", "doc_terms", "doc_counts", "term_offsets", "post_docs", "post_tf", "doc_len")
+
+    def __init__(self, arrays: Dict[str, np.ndarray], k1: float = 1.2, b: float = 0.75):
+        self.arrays = arrays
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        count = self.doc_len.shape[0]
+        df = np.diff(self.term_offsets)
+        self.idf = np.log1p((count - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_len = float(self.doc_len.mean()) if count else 1.0
+        self.k1 = k1
+        # Per-document length normalisation from the BM25 formula, precomputed once
+        self.norm = (k1 * (1 - b + b * self.doc_len / max(avg_len, 1.0))).astype(np.float32)
+
+    def __len__(self):
+        return self.doc_len.shape[0]
+
+    @classmethod
+    def build(cls, docs: List[Union[Counter, int]], previous: Optional["LexicalIndex"] = None) -> "LexicalIndex":
+        """
+        Build an index from one entry per row: a Counter of tokens for documents
+        that were (re-)tokenised, or the row number of an unchanged document in
+        `previous`.
+        """
+        new_terms = set()
+        for doc in docs:
+            if isinstance(doc, Counter):
+                new_terms.update(doc)
+        vocab = np.array(sorted(new_terms), dtype=f"U{MAX_TOKEN_LENGTH}")
+        if previous is not None:
+            vocab = np.union1d(previous.vocab, vocab)
+            # Term ids of the previous vocabulary within the merged one
+            remap = np.searchsorted(vocab, previous.vocab).astype(np.int32)
+
+        term_chunks, count_chunks = [], []
+        for doc in docs:
+            if isinstance(doc, Counter):
+                terms = np.array(list(doc), dtype=f"U{MAX_TOKEN_LENGTH}")
+                term_chunks.append(np.searchsorted(vocab, terms).astype(np.int32))
+                count_chunks.append(np.fromiter(doc.values(), dtype=np.int32, count=len(doc)))
+            else:
+                start, end = previous.doc_offsets[doc], previous.doc_offsets[doc + 1]
+                term_chunks.append(remap[previous.doc_terms[start:end]])
+                count_chunks.append(np.asarray(previous.doc_counts[start:end]))
+
+        lengths = np.array([len(chunk) for chunk in term_chunks], dtype=np.int64)
+        doc_offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=doc_offsets[1:])
+        doc_terms = np.concatenate(term_chunks) if term_chunks else np.zeros(0, dtype=np.int32)
+        doc_counts = np.concatenate(count_chunks) if count_chunks else np.zeros(0, dtype=np.int32)
+
+        # Invert the bags into postings grouped by term
+        doc_rows = np.repeat(np.arange(len(docs), dtype=np.int32), lengths)
+        order = np.argsort(doc_terms, kind="stable")
+        term_offsets = np.searchsorted(doc_terms[order], np.arange(len(vocab) + 1)).astype(np.int64)
+        doc_len = np.bincount(doc_rows, weights=doc_counts, minlength=len(docs)).astype(np.float32)
+
+        return cls({
+            "vocab": vocab,
+            "doc_offsets": doc_offsets,
+            "doc_terms": doc_terms,
+            "doc_counts": doc_counts,
+            "term_offsets": term_offsets,
+            "post_docs": doc_rows[order],
+            "post_tf": doc_counts[order].astype(np.float32),
+            "doc_len": doc_len,
+        })
+
+    def search(self, query: str, k: int, mask: np.ndarray = None,
+               deadline: float = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the k rows with the highest BM25 score for the query.
+
+        Query terms are scored rarest first; if `deadline` (a time.perf_counter()
+        value) passes, the remaining, most common terms are skipped.
+        """
+        terms = np.array(sorted(set(tokenize(query))), dtype=f"U{MAX_TOKEN_LENGTH}")
+        if len(terms) == 0 or len(self.vocab) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids = np.searchsorted(self.vocab, terms)
+        found = ids < len(self.vocab)
+        found[found] = self.vocab[ids[found]] == terms[found]
+        ids = ids[found]
+        ids = ids[np.argsort(-self.idf[ids], kind="stable")]
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in ids:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            start, end = self.term_offsets[term], self.term_offsets[term + 1]
+            docs = self.post_docs[start:end]
+            tf = self.post_tf[start:end]
+            scores[docs] += self.idf[term] * tf * (self.k1 + 1) / (tf + self.norm[docs])
+
+        if mask is not None:
+            scores[~mask] = 0
+        hits = np.flatnonzero(scores)
+        best = top_k(scores[hits], k)
+        return hits[best], scores[hits][best]
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), self.arrays[name])
+
+    @classmethod
+    def load(cls, directory: str) -> "LexicalIndex":
+        return cls({
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in cls.ARRAYS
+        })
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int, constant: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked row lists: each row scores sum(1 / (constant + rank)) over the lists it appears in"""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking.tolist()):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (constant + rank + 1)
+    return sorted(fused.items(), key=lambda pair: -pair[1])[:k]
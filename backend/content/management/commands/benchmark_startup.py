@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Imports the modules a web process loads and reports whether the model stack came with them
+IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import core.views, ai.ai_service
+print(time.perf_counter() - start, 'torch' in sys.modules, 'sentence_transformers' in sys.modules)
+"""
+
+class Command(BaseCommand):
+    help = 'Measure process startup time and embedding model load and warm-up time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Subprocess runs per measurement (best is reported)')
+        parser.add_argument('--skip-model', action='store_true', help='Do not load the embedding model')
+
+    def _run(self, args):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'virtuaid.settings'))
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable] + args, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        return time.perf_counter() - start, output
+
+    def handle(self, *args, **options):
+        runs = max(1, options['runs'])
+
+        check_times = [self._run(['manage.py', 'check'])[0] for _ in range(runs)]
+        self.stdout.write(f'manage.py check: {min(check_times):.2f}s')
+
+        probes = [self._run(['-c', IMPORT_PROBE])[1].split() for _ in range(runs)]
+        import_time = min(float(probe[0]) for probe in probes)
+        torch_loaded, model_loaded = probes[0][1] == 'True', probes[0][2] == 'True'
+        self.stdout.write(f'django.setup + core.views + ai.ai_service: {import_time:.2f}s '
+                          f'(torch imported: {torch_loaded}, sentence_transformers imported: {model_loaded})')
+        if torch_loaded or model_loaded:
+            self.stdout.write(self.style.WARNING('The embedding stack is imported at startup'))
+
+        if options['skip_model']:
+            return
+
+        from content.embeddings import content_embedding_service
+        start = time.perf_counter()
+        import sentence_transformers  # noqa: F401
+        self.stdout.write(f'import sentence_transformers: {time.perf_counter() - start:.2f}s')
+        start = time.perf_counter()
+        try:
+            content_embedding_service._load_model()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Could not load the embedding model: {e}'))
+            return
+        self.stdout.write(f'model load: {time.perf_counter() - start:.2f}s')
+        for label in ('first encode', 'warm encode'):
+            start = time.perf_counter()
+            content_embedding_service.generate_embeddings(['When is the next open day?'])
+            self.stdout.write(f'{label}: {(time.perf_counter() - start) * 1000:.1f}ms')
@@ -0,0 +1,71 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from content.embeddings import content_embedding_service
+from content.vector_index import ExactIndex, IVFIndex, QuantizedVectors, normalize_rows, recall_at_k
+
+class Command(BaseCommand):
+    help = 'Measure recall, latency and memory of the approximate and quantized content indexes against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Benchmark on this many random clustered vectors instead of the stored embeddings')
+        parser.add_argument('--queries', type=int, default=200, help='Number of queries to run')
+        parser.add_argument('--k', type=int, default=10, help='Number of neighbours per query')
+        parser.add_argument('--nlist', type=int, default=0, help='Number of IVF clusters (default sqrt(N))')
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32],
+                            help='IVF nprobe values to compare')
+        parser.add_argument('--quantization', nargs='*', choices=QuantizedVectors.KINDS,
+                            default=list(QuantizedVectors.KINDS), help='Quantized storage types to compare')
+        parser.add_argument('--rerank-factor', type=int, default=0,
+                            help='Quantized candidates re-scored in float32 per result (default CONTENT_RERANK_FACTOR)')
+
+    def _synthetic_vectors(self, count, dim, rng):
+        # Clustered data is closer to real embeddings than uniform noise
+        centers = rng.standard_normal((max(1, count // 100), dim))
+        vectors = centers[rng.integers(0, centers.shape[0], count)] + 0.5 * rng.standard_normal((count, dim))
+        return normalize_rows(vectors)
+
+    def _latency_ms(self, index, queries, k, **search_kwargs):
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, k, **search_kwargs)
+        return (time.perf_counter() - start) * 1000 / len(queries)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        if options['synthetic']:
+            vectors = self._synthetic_vectors(options['synthetic'], content_embedding_service.embedding_dim, rng)
+        else:
+            content_embedding_service._ensure_embeddings_exist()
+            vectors = content_embedding_service.embeddings
+        if vectors.shape[0] == 0:
+            self.stdout.write(self.style.ERROR('No embeddings to benchmark; run update_embeddings or pass --synthetic'))
+            return
+
+        # Perturbed corpus vectors stand in for real queries
+        rows = rng.choice(vectors.shape[0], min(options['queries'], vectors.shape[0]), replace=False)
+        queries = normalize_rows(vectors[rows] + 0.1 * rng.standard_normal((len(rows), vectors.shape[1])))
+        k = options['k']
+
+        exact = ExactIndex(vectors)
+        self.stdout.write(f'{vectors.shape[0]} vectors, {len(queries)} queries, k={k}')
+        self.stdout.write(f'exact: recall=1.000 latency={self._latency_ms(exact, queries, k):.3f}ms '
+                          f'memory={exact.scan_bytes / 2**20:.1f}MB')
+
+        for quantization in options['quantization']:
+            index = ExactIndex(vectors, quantization, options['rerank_factor'] or None)
+            recall = recall_at_k(index, queries, k)
+            latency = self._latency_ms(index, queries, k)
+            self.stdout.write(f'exact {quantization} rerank={index.rerank_factor}x: recall={recall:.3f} '
+                              f'latency={latency:.3f}ms memory={index.scan_bytes / 2**20:.1f}MB '
+                              f'({exact.scan_bytes / index.scan_bytes:.1f}x smaller)')
+
+        start = time.perf_counter()
+        ivf = IVFIndex(vectors, nlist=options['nlist'] or None)
+        self.stdout.write(f'ivf: nlist={ivf.nlist} built in {time.perf_counter() - start:.2f}s')
+        for nprobe in options['nprobe']:
+            ivf.nprobe = min(nprobe, ivf.nlist)
+            recall = recall_at_k(ivf, queries, k)
+            latency = self._latency_ms(ivf, queries, k)
+            self.stdout.write(f'ivf nprobe={ivf.nprobe}: recall={recall:.3f} latency={latency:.3f}ms')
@@ -0,0 +1,28 @@
+import os
+from django.core.management.base import BaseCommand
+from content.embeddings import ContentEmbeddingService
+from content.embedding_server import EmbeddingServer
+
+class Command(BaseCommand):
+    help = 'Serve batched content embedding and search requests for all workers on this host'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=os.getenv('CONTENT_EMBEDDING_SERVER') or 'http://127.0.0.1:8765',
+                            help='unix:///path/to/socket or http://127.0.0.1:port (default CONTENT_EMBEDDING_SERVER)')
+        parser.add_argument('--no-warm-up', action='store_true', help='Load the model on the first request instead')
+
+    def handle(self, *args, **options):
+        # This process owns the model, so it must not forward requests to itself
+        service = ContentEmbeddingService(server_url='')
+        if not options['no_warm_up']:
+            self.stdout.write(f'Loading {service.model_name}...')
+            elapsed = service.warm_up()
+            self.stdout.write(f'Model ready in {elapsed:.2f}s')
+
+        server = EmbeddingServer(service, options['url'])
+        server.bind()
+        self.stdout.write(self.style.SUCCESS(f'Embedding server listening on {options["url"]}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write('Embedding server stopped')
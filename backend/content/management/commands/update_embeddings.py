@@ -1,17 +1,40 @@
 import logging
+import time
 from django.core.management.base import BaseCommand
 from content.embeddings import content_embedding_service
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Update embeddings for all scraped university content'
+    help = 'Update embeddings for scraped university content'
+
+    def add_arguments(self, parser):
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--incremental', dest='full', action='store_false',
+                          help='Embed only new or changed content and drop deleted content (default)')
+        mode.add_argument('--full', dest='full', action='store_true',
+                          help='Re-embed all content from scratch')
+        parser.set_defaults(full=False)
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Encoding worker processes (default CONTENT_EMBEDDING_WORKERS or 1)')
+        parser.add_argument('--batch-size', type=int, default=0,
+                            help='Passages per encoding batch (default CONTENT_EMBEDDING_BATCH_SIZE or 50)')
 
     def handle(self, *args, **options):
         try:
-            self.stdout.write(self.style.SUCCESS('Starting content embeddings update...'))
-            count = content_embedding_service.update_content_embeddings()
-            self.stdout.write(self.style.SUCCESS(f'Successfully updated embeddings for {count} content items'))
+            mode = 'full' if options['full'] else 'incremental'
+            self.stdout.write(self.style.SUCCESS(f'Starting {mode} content embeddings update...'))
+            start = time.perf_counter()
+            update = content_embedding_service.update_content_embeddings(
+                full=options['full'], workers=options['workers'] or None, batch_size=options['batch_size'] or None
+            )
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(f'Successfully embedded {update.passages} passages from '
+                                                 f'{update.items} items ({len(content_embedding_service.metadata)} '
+                                                 f'passages indexed) in {elapsed:.1f}s'))
+            if update.passages:
+                self.stdout.write(f'Throughput: {update.passages / elapsed:.1f} passages/s, '
+                                  f'{update.items / elapsed:.1f} docs/s')
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error updating embeddings: {str(e)}'))
-            logger.error(f'Error in update_embeddings command: {str(e)}') 
\ No newline at end of file
+            logger.error(f'Error in update_embeddings command: {str(e)}')
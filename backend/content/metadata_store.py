@@ -0,0 +1,131 @@
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class ColumnarMetadata:
+    """
+    Compact column store for the metadata of indexed content, one row per passage.
+
+    Fixed-size fields are plain NumPy arrays (id, content_type, published_date,
+    content_hash) that filters can scan without touching Python objects. Text
+    fields are kept as one UTF-8 blob per field plus an offsets array, and are
+    only decoded for the rows a query actually returns. Every column is saved as
+    its own .npy file so it can be memory-mapped without unpickling.
+    """
+
+    TEXT_FIELDS = ("title", "summary", "url", "source_name", "university_name", "passage")
+    # Text fields where an empty string is stored for None
+    NULLABLE_FIELDS = ("url", "source_name", "university_name")
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        count = columns["id"].shape[0]
+        # Snapshots written before university filtering and passage chunking lack these columns
+        columns.setdefault("university_id", np.full(count, -1, dtype=np.int64))
+        columns.setdefault("chunk_index", np.zeros(count, dtype=np.int32))
+        columns.setdefault("passage_offsets", np.zeros(count + 1, dtype=np.int64))
+        columns.setdefault("passage_blob", np.zeros(0, dtype=np.uint8))
+        self.columns = columns
+        self.ids = columns["id"]
+        self.university_id = columns["university_id"]
+        self.chunk_index = columns["chunk_index"]
+        self.content_type = columns["content_type"]
+        self.published_date = columns["published_date"]
+        self.content_hash = columns["content_hash"]
+        # Partition bitmaps for equality filters, built on first use
+        self._partitions = {}
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "ColumnarMetadata":
+        """Build the columns from metadata dicts"""
+        records = list(records)
+        columns = {
+            "id": np.array([record["id"] for record in records], dtype=np.int64),
+            "university_id": np.array(
+                [-1 if record.get("university_id") is None else record["university_id"] for record in records],
+                dtype=np.int64
+            ),
+            "chunk_index": np.array([record.get("chunk_index") or 0 for record in records], dtype=np.int32),
+            "content_type": np.array([record.get("content_type") or "" for record in records], dtype="U20"),
+            "published_date": np.array(
+                [record.get("published_date") or "NaT" for record in records], dtype="datetime64[D]"
+            ),
+            "content_hash": np.array([record.get("content_hash") or "" for record in records], dtype="S40"),
+        }
+        for field in cls.TEXT_FIELDS:
+            encoded = [(record.get(field) or "").encode("utf-8") for record in records]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            columns[f"{field}_offsets"] = offsets
+            columns[f"{field}_blob"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(columns)
+
+    def _text(self, field: str, row: int):
+        offsets = self.columns[f"{field}_offsets"]
+        value = self.columns[f"{field}_blob"][offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+        if not value and field in self.NULLABLE_FIELDS:
+            return None
+        return value
+
+    def row(self, row: int) -> Dict[str, Any]:
+        """Decode one row into a metadata dict"""
+        published_date = self.published_date[row]
+        record = {
+            "id": int(self.ids[row]),
+            "university_id": None if self.university_id[row] < 0 else int(self.university_id[row]),
+            "chunk_index": int(self.chunk_index[row]),
+            "content_type": str(self.content_type[row]),
+            "published_date": None if np.isnat(published_date) else str(published_date),
+            "content_hash": self.content_hash[row].decode("ascii"),
+        }
+        for field in self.TEXT_FIELDS:
+            record[field] = self._text(field, row)
+        return record
+
+    def _partition(self, field: str, value) -> np.ndarray:
+        key = (field, value)
+        if key not in self._partitions:
+            self._partitions[key] = getattr(self, field) == value
+        return self._partitions[key]
+
+    def filter_mask(self, content_type: str = None, university_id: int = None,
+                    date_from=None, date_to=None) -> Optional[np.ndarray]:
+        """
+        Return a boolean row mask for the given filters, or None when unfiltered.
+
+        Rows without a published date never match a date range.
+        """
+        mask = None
+        if content_type:
+            mask = self._partition("content_type", content_type)
+        if university_id is not None:
+            partition = self._partition("university_id", university_id)
+            mask = partition if mask is None else mask & partition
+        if date_from is not None:
+            in_range = self.published_date >= np.datetime64(str(date_from), "D")
+            mask = in_range if mask is None else mask & in_range
+        if date_to is not None:
+            in_range = self.published_date <= np.datetime64(str(date_to), "D")
+            mask = in_range if mask is None else mask & in_range
+        return mask
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [self.row(row) for row in range(len(self))]
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), column)
+
+    @classmethod
+    def load(cls, directory: str) -> "ColumnarMetadata":
+        """Open saved columns memory-mapped, so only the pages a query touches are read"""
+        columns = {}
+        for filename in os.listdir(directory):
+            if filename.endswith(".npy"):
+                columns[filename[:-4]] = np.load(os.path.join(directory, filename), mmap_mode="r")
+        return cls(columns)
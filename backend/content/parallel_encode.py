@@ -0,0 +1,39 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
+
+import numpy as np
+
+from .vector_index import normalize_rows
+
+# The model of each pool process, loaded once by the initializer
+_model = None
+
+
+def _init_worker(model_name: str, threads: int):
+    global _model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    # Split the cores between processes instead of every process using all of them
+    torch.set_num_threads(threads)
+    _model = SentenceTransformer(model_name)
+
+
+def _encode_batch(texts: List[str]) -> np.ndarray:
+    return normalize_rows(_model.encode(texts, convert_to_numpy=True))
+
+
+def encode_in_processes(model_name: str, batches: List[List[str]], workers: int) -> Iterator[np.ndarray]:
+    """
+    Encode batches of texts in a pool of `workers` processes, each with its own
+    copy of the model, yielding the L2-normalised embeddings in batch order.
+
+    Processes are spawned rather than forked, since torch state does not
+    survive a fork.
+    """
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(model_name, threads)) as pool:
+        yield from pool.map(_encode_batch, batches)
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+
+class _PendingQuery:
+    __slots__ = ("text", "done", "embedding", "error")
+
+    def __init__(self, text):
+        self.text = text
+        self.done = threading.Event()
+        self.embedding = None
+        self.error = None
+
+
+class QueryEncoder:
+    """
+    Query embedding front end with an LRU cache and micro-batching.
+
+    Embeddings are cached by normalised query text. On a miss the query joins a
+    pending batch; the first thread to arrive waits up to `batch_window_ms` for
+    others (or until `max_batch` queries are waiting), then encodes the whole
+    batch in one model call and hands each caller its vector. Under concurrent
+    load this replaces many batch-of-one forward passes with a few larger ones.
+
+    `normalize` maps a query to its cache key, which is also the text encoded;
+    by default it lowercases and collapses whitespace.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], cache_size: int = None,
+                 batch_window_ms: float = None, max_batch: int = None, normalize: Callable[[str], str] = None):
+        self.encode_batch = encode
+        if normalize is not None:
+            self.normalize = normalize
+        self.cache_size = cache_size if cache_size is not None else int(os.getenv("CONTENT_QUERY_CACHE_SIZE", "1024"))
+        window = batch_window_ms if batch_window_ms is not None else float(os.getenv("CONTENT_QUERY_BATCH_WINDOW_MS", "5"))
+        self.batch_window = window / 1000
+        self.max_batch = max_batch or int(os.getenv("CONTENT_QUERY_MAX_BATCH", "32"))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._batch_full = threading.Condition(self._lock)
+        self._pending = []
+        self._leader_active = False
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def encode(self, query: str) -> np.ndarray:
+        """Return the normalised embedding for one query"""
+        key = self.normalize(query)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            pending, leader = self._enqueue([key])
+        return self._wait(pending, leader)[0]
+
+    def encode_many(self, queries: List[str]) -> np.ndarray:
+        """Return the normalised embeddings for several queries, batched with any concurrent callers"""
+        keys = [self.normalize(query) for query in queries]
+        found = {}
+        with self._lock:
+            misses = []
+            for key in dict.fromkeys(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    found[key] = self._cache[key]
+                else:
+                    self.misses += 1
+                    misses.append(key)
+            pending, leader = self._enqueue(misses) if misses else ([], False)
+        found.update(zip(misses, self._wait(pending, leader)))
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def _enqueue(self, keys: List[str]) -> Tuple[List[_PendingQuery], bool]:
+        """Add queries to the pending batch (lock held); returns them and whether this thread leads the batch"""
+        pending = [_PendingQuery(key) for key in keys]
+        self._pending.extend(pending)
+        leader = not self._leader_active
+        if leader:
+            self._leader_active = True
+        elif len(self._pending) >= self.max_batch:
+            self._batch_full.notify()
+        return pending, leader
+
+    def _wait(self, pending: List[_PendingQuery], leader: bool) -> List[np.ndarray]:
+        if leader:
+            self._run_batch()
+        for query in pending:
+            query.done.wait()
+            if query.error is not None:
+                raise query.error
+        return [query.embedding for query in pending]
+
+    def _run_batch(self):
+        with self._lock:
+            # Give concurrent callers a moment to join the batch
+            deadline = time.monotonic() + self.batch_window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._batch_full.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            self._pending = self._pending[self.max_batch:]
+            # Queries beyond max_batch are picked up by a new leader from among them
+            self._leader_active = False
+            if self._pending:
+                self._leader_active = True
+                threading.Thread(target=self._run_batch, daemon=True).start()
+
+        texts = list(dict.fromkeys(pending.text for pending in batch))
+        try:
+            embeddings = self.encode_batch(texts)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+                pending.done.set()
+            return
+
+        by_text = {}
+        with self._lock:
+            self.batches += 1
+            for text, embedding in zip(texts, embeddings):
+                embedding = np.array(embedding, dtype=np.float32)
+                embedding.flags.writeable = False
+                by_text[text] = embedding
+                if self.cache_size > 0:
+                    self._cache[text] = embedding
+                    self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for pending in batch:
+            pending.embedding = by_text[pending.text]
+            pending.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "batches": self.batches,
+            }
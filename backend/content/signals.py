@@ -0,0 +1,36 @@
+import time
+import logging
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import ScrapedContent
+
+logger = logging.getLogger(__name__)
+
+CONTENT_VERSION_KEY = "content:version"
+
+def get_content_version():
+    """Return a stamp that changes whenever scraped content changes"""
+    try:
+        version = cache.get(CONTENT_VERSION_KEY)
+        if version is None:
+            version = time.time()
+            cache.add(CONTENT_VERSION_KEY, version, timeout=None)
+            version = cache.get(CONTENT_VERSION_KEY, version)
+        return version
+    except Exception as e:
+        logger.error(f"Error reading content version: {str(e)}")
+        return None
+
+def bump_content_version():
+    """Mark all content-derived caches as stale"""
+    try:
+        cache.set(CONTENT_VERSION_KEY, time.time(), timeout=None)
+    except Exception as e:
+        logger.error(f"Error updating content version: {str(e)}")
+
+@receiver(post_save, sender=ScrapedContent)
+@receiver(post_delete, sender=ScrapedContent)
+def scraped_content_changed(sender, instance, **kwargs):
+    """Invalidate content-derived caches when scraped content changes"""
+    bump_content_version()
@@ -156,13 +156,14 @@ def refresh_all_content():
     return ", ".join(results)
 
 @shared_task
-def update_content_embeddings():
-    """Task to update content embeddings for RAG"""
+def update_content_embeddings(full=False):
+    """Task to update content embeddings for RAG, re-encoding only changed items unless full"""
     try:
-        logger.info("Starting content embeddings update")
-        count = content_embedding_service.update_content_embeddings()
-        logger.info(f"Content embeddings updated successfully for {count} items")
-        return f"Updated embeddings for {count} content items"
+        mode = "full" if full else "incremental"
+        logger.info(f"Starting {mode} content embeddings update")
+        update = content_embedding_service.update_content_embeddings(full=full)
+        logger.info(f"Content embeddings updated successfully, {update.passages} passages embedded")
+        return f"Updated embeddings ({mode}), embedded {update.passages} passages from {update.items} items"
     except Exception as e:
         logger.error(f"Error updating content embeddings: {str(e)}")
-        return f"Error updating content embeddings: {str(e)}" 
\ No newline at end of file
+        return f"Error updating content embeddings: {str(e)}"
@@ -1,3 +1,614 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from .apps import should_warm_up_embeddings
+from .chunking import chunk_text
+from .embedding_client import EmbeddingServerClient, EmbeddingServerError
+from .embedding_server import EmbeddingServer
+from .embeddings import ContentEmbeddingService
+from .index_store import IndexStore
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from .metadata_store import ColumnarMetadata
+from .query_encoder import QueryEncoder
+from .vector_index import ExactIndex, IVFIndex, QuantizedVectors, build_index, normalize_rows, recall_at_k, top_k
+
+
+def clustered_vectors(count, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, count // 50), dim))
+    return normalize_rows(centers[rng.integers(0, centers.shape[0], count)] + 0.3 * rng.standard_normal((count, dim)))
+
+
+class VectorIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.vectors = clustered_vectors(2000)
+        self.queries = self.vectors[:50]
+
+    def test_top_k_orders_best_first(self):
+        """Test that top_k returns the highest scores in descending order"""
+        scores = np.array([0.1, 0.9, 0.5, 0.7])
+        self.assertEqual(top_k(scores, 2).tolist(), [1, 3])
+        self.assertEqual(top_k(scores, 10).tolist(), [1, 3, 2, 0])
+
+    def test_exact_index_matches_full_sort(self):
+        """Test that exact search agrees with a full argsort"""
+        index = ExactIndex(self.vectors)
+        indices, scores = index.search(self.queries[0], 5)
+        expected = np.argsort(self.vectors @ self.queries[0])[::-1][:5]
+        self.assertEqual(indices.tolist(), expected.tolist())
+        self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+
+    def test_ivf_recall(self):
+        """Test that IVF finds most exact neighbours and all of them when probing every list"""
+        index = IVFIndex(self.vectors, nlist=20, nprobe=4)
+        self.assertGreater(recall_at_k(index, self.queries, k=10), 0.9)
+        index.nprobe = index.nlist
+        self.assertEqual(recall_at_k(index, self.queries, k=10), 1.0)
+
+    def test_filtered_search_returns_k_matches(self):
+        """Test that a rare filter value still yields k results from the matching rows only"""
+        mask = np.zeros(len(self.vectors), dtype=bool)
+        mask[[5, 400, 1200, 1999]] = True
+        for index in (ExactIndex(self.vectors), IVFIndex(self.vectors, nlist=20, nprobe=1)):
+            index.filter_exact_fraction = 0
+            indices, _ = index.search(self.queries[0], 3, mask=mask)
+            self.assertEqual(len(indices), 3)
+            self.assertTrue(mask[indices].all())
+
+    def test_quantized_search_reranks_with_float32(self):
+        """Test that int8 scans keep recall and return exact float32 scores"""
+        index = ExactIndex(self.vectors, "int8")
+        self.assertGreater(recall_at_k(index, self.queries, k=10), 0.95)
+        # int8 codes plus one float32 scale per vector
+        self.assertAlmostEqual(self.vectors.nbytes / index.scan_bytes, 4 * 32 / 36, delta=0.1)
+        indices, scores = index.search(self.queries[0], 5)
+        np.testing.assert_allclose(scores, self.vectors[indices] @ self.queries[0], rtol=1e-6)
+        with self.assertRaises(ValueError):
+            ExactIndex(self.vectors, "float16")
+
+    def test_quantized_scores_in_blocks(self):
+        """Test that blocked int8 scoring matches the dequantized vectors, for all rows and a subset"""
+        quantized = QuantizedVectors.encode(self.vectors)
+        quantized.block_size = 64
+        approx = quantized.codes.astype(np.float32) * quantized.scales[:, None]
+        np.testing.assert_allclose(quantized.scores(self.queries[0]), approx @ self.queries[0], atol=1e-5)
+        rows = np.arange(3, len(self.vectors), 7)
+        np.testing.assert_allclose(quantized.scores(self.queries[0], rows), approx[rows] @ self.queries[0], atol=1e-5)
+
+    def test_quantized_ivf_with_filter(self):
+        """Test that a quantized IVF index honours filters"""
+        index = IVFIndex(self.vectors, nlist=20, nprobe=4, quantization="int8")
+        mask = np.zeros(len(self.vectors), dtype=bool)
+        mask[::3] = True
+        indices, _ = index.search(self.queries[1], 5, mask=mask)
+        self.assertEqual(len(indices), 5)
+        self.assertTrue(mask[indices].all())
+
+    def test_build_index_auto(self):
+        """Test that auto mode uses exact search for small corpora"""
+        self.assertIsInstance(build_index(self.vectors, "auto"), ExactIndex)
+        self.assertIsInstance(build_index(self.vectors, "ivf"), IVFIndex)
+        self.assertIsInstance(build_index(np.zeros((0, 32), dtype=np.float32), "ivf"), ExactIndex)
+
+
+class ColumnarMetadataTest(SimpleTestCase):
+    def setUp(self):
+        self.records = [
+            {"id": 7, "title": "Open day", "summary": "Campus tours", "url": "https://example.ac.uk/open",
+             "content_type": "event", "published_date": "2025-04-28", "source_name": "Events",
+             "university_name": "Northampton", "university_id": None, "content_hash": "a" * 40,
+             "passage": "Campus tours", "chunk_index": 0},
+            {"id": 9, "title": "Café opens", "summary": "", "url": None, "content_type": "news",
+             "published_date": None, "source_name": None, "university_name": None, "university_id": None,
+             "content_hash": "", "passage": "", "chunk_index": 0},
+        ]
+
+    def test_round_trip_through_disk(self):
+        """Test that rows decode back to the original metadata after save and memory-mapped load"""
+        with tempfile.TemporaryDirectory() as directory:
+            ColumnarMetadata.from_records(self.records).save(directory)
+            metadata = ColumnarMetadata.load(directory)
+            self.assertIsInstance(metadata.ids, np.memmap)
+            self.assertEqual(metadata.to_records(), self.records)
+
+    def test_filter_mask_combines_filters(self):
+        """Test content type, university and date filters"""
+        self.records[0]["university_id"] = 3
+        metadata = ColumnarMetadata.from_records(self.records)
+        self.assertIsNone(metadata.filter_mask())
+        self.assertEqual(metadata.filter_mask(university_id=3).tolist(), [True, False])
+        self.assertEqual(metadata.filter_mask(content_type="news").tolist(), [False, True])
+        self.assertEqual(metadata.filter_mask(date_from="2025-05-01").tolist(), [False, False])
+        self.assertEqual(metadata.filter_mask(content_type="event", date_to="2025-04-30").tolist(), [True, False])
+
+    def test_filter_columns_are_arrays(self):
+        """Test that filterable fields can be compared without decoding rows"""
+        metadata = ColumnarMetadata.from_records(self.records)
+        self.assertEqual((metadata.content_type == "event").tolist(), [True, False])
+        self.assertTrue(np.isnat(metadata.published_date[1]))
+
+
+def service_in(directory):
+    """Return an embedding service whose index and legacy files live in a temp directory"""
+    service = ContentEmbeddingService()
+    service.store = IndexStore(os.path.join(directory, "content_index"))
+    service.legacy_embeddings_paths = [os.path.join(directory, "content_embeddings.npz")]
+    service.legacy_metadata_path = os.path.join(directory, "content_metadata.npz")
+    return service
+
+
+class EmbeddingStoreTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.service = service_in(self.tmpdir.name)
+
+    def test_legacy_embeddings_imported_and_memory_mapped(self):
+        """Test that old .npz embeddings are normalised into a memory-mapped snapshot"""
+        np.savez(self.service.legacy_metadata_path, metadata=np.array([{"id": 1}, {"id": 2}], dtype=object))
+        np.savez(self.service.legacy_embeddings_paths[0], embeddings=np.array([[3.0, 4.0], [0.0, 2.0]], dtype=np.float32))
+        self.service._ensure_embeddings_exist()
+
+        self.assertIsInstance(self.service.embeddings, np.memmap)
+        np.testing.assert_allclose(self.service.embeddings, [[0.6, 0.8], [0.0, 1.0]], rtol=1e-6)
+        indices, _ = self.service.index.search(np.array([0.0, 1.0], dtype=np.float32), 1)
+        self.assertEqual(indices.tolist(), [1])
+        self.assertIsNotNone(self.service.store.read_manifest())
+
+    def test_workers_reload_new_snapshots(self):
+        """Test that another process picks up a newly published snapshot"""
+        reader = service_in(self.tmpdir.name)
+        reader.reload_interval = 0
+        reader._ensure_embeddings_exist()
+        self.assertEqual(len(reader.metadata), 0)
+
+        old_snapshot = reader.snapshot
+        self.service.store.publish(np.eye(2, dtype=np.float32), ColumnarMetadata.from_records([{"id": 1}, {"id": 2}]), "test")
+        reader._ensure_embeddings_exist()
+
+        self.assertEqual(reader.metadata.ids.tolist(), [1, 2])
+        self.assertEqual(len(old_snapshot.metadata), 0)
+
+    def test_failed_reload_is_retried(self):
+        """Test that a snapshot that fails to load is retried on the next check"""
+        reader = service_in(self.tmpdir.name)
+        reader.reload_interval = 0
+        reader._ensure_embeddings_exist()
+        self.service.store.publish(np.eye(2, dtype=np.float32), ColumnarMetadata.from_records([{"id": 1}, {"id": 2}]), "test")
+
+        with mock.patch.object(reader.store, "load", side_effect=OSError("snapshot pruned")):
+            reader._ensure_embeddings_exist()
+        self.assertEqual(len(reader.metadata), 0)
+
+        reader._ensure_embeddings_exist()
+        self.assertEqual(reader.metadata.ids.tolist(), [1, 2])
+
+    def test_quantized_codes_are_memory_mapped(self):
+        """Test that the index scans the int8 codes published with the snapshot"""
+        self.service.store.publish(np.eye(2, dtype=np.float32), ColumnarMetadata.from_records([{"id": 1}, {"id": 2}]), "test")
+        with mock.patch.dict(os.environ, {"CONTENT_VECTOR_QUANTIZATION": "int8"}):
+            self.service._ensure_embeddings_exist()
+        quantized = self.service.snapshot.index.quantized
+        self.assertIs(quantized, self.service.snapshot.quantized)
+        self.assertIsInstance(quantized.codes, np.memmap)
+        self.assertEqual(self.service.snapshot.index.search(np.array([0, 1], dtype=np.float32), 1)[0].tolist(), [1])
+
+    def test_publish_prunes_old_snapshots(self):
+        """Test that only the newest snapshots are kept on disk"""
+        self.service.store.keep = 2
+        metadata = ColumnarMetadata.from_records([{"id": 1}, {"id": 2}])
+        versions = [self.service.store.publish(np.eye(2, dtype=np.float32), metadata, "test") for _ in range(4)]
+        self.assertEqual(sorted(os.listdir(self.service.store.snapshots_dir)), sorted(versions[-2:]))
+        self.assertEqual(self.service.store.read_manifest()["version"], versions[-1])
+
+
+def fake_item(item_id, title, content="Body"):
+    return SimpleNamespace(id=item_id, title=title, summary="", content=content, url=None,
+                           content_type="news", published_date=None, source=None)
+
+
+class IncrementalEmbeddingUpdateTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.service = service_in(self.tmpdir.name)
+        self.service.embedding_dim = 4
+        self.encoded = []
+        self.service.generate_embeddings = self.fake_encode
+
+    def fake_encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), 1.0, 0.0, 0.0] for text in texts], dtype=np.float32)
+
+    def update(self, items, full=False, **options):
+        self.encoded = []
+        queryset = mock.Mock()
+        queryset.iterator.return_value = iter(items)
+        with mock.patch("content.embeddings.ScrapedContent.objects.select_related", return_value=queryset):
+            return self.service.update_content_embeddings(full=full, **options).passages
+
+    def test_only_changed_items_are_encoded(self):
+        """Test that unchanged items reuse vectors and deleted items are dropped"""
+        self.assertEqual(self.update([fake_item(1, "A"), fake_item(2, "B"), fake_item(3, "C")]), 3)
+        kept_vector = np.array(self.service.embeddings[0])
+
+        count = self.update([fake_item(1, "A"), fake_item(3, "C changed"), fake_item(4, "D")])
+
+        self.assertEqual(count, 2)
+        self.assertEqual(self.encoded, ["C changed. Body", "D. Body"])
+        self.assertEqual(self.service.metadata.ids.tolist(), [1, 3, 4])
+        np.testing.assert_array_equal(self.service.embeddings[0], kept_vector)
+        self.assertEqual(len(self.service.index), 3)
+
+    def test_unchanged_corpus_skips_rewrite(self):
+        """Test that a second run with no changes encodes nothing"""
+        self.update([fake_item(1, "A")])
+        self.assertEqual(self.update([fake_item(1, "A")]), 0)
+        self.assertEqual(self.encoded, [])
+
+    def test_long_items_are_indexed_as_passages(self):
+        """Test that each passage gets its own row and unchanged passages are reused"""
+        long_body = " ".join(f"Sentence number {i} about the open day." for i in range(40))
+        self.update([fake_item(1, "A", content=long_body)])
+        passages = len(self.service.metadata)
+        self.assertGreater(passages, 1)
+        self.assertEqual(set(self.service.metadata.ids.tolist()), {1})
+        self.assertEqual(self.service.metadata.chunk_index.tolist(), list(range(passages)))
+
+        self.assertEqual(self.update([fake_item(1, "A", content=long_body), fake_item(2, "B")]), 1)
+
+    def test_update_counts_encoded_items(self):
+        """Test that an incremental update reports only the items it re-encoded"""
+        long_body = " ".join(f"Sentence number {i} about the open day." for i in range(40))
+        queryset = mock.Mock()
+        queryset.iterator.side_effect = lambda **kwargs: iter([fake_item(1, "A", content=long_body), fake_item(2, "B")])
+        with mock.patch("content.embeddings.ScrapedContent.objects.select_related", return_value=queryset):
+            first = self.service.update_content_embeddings()
+            queryset.iterator.side_effect = lambda **kwargs: iter(
+                [fake_item(1, "A", content=long_body), fake_item(2, "B changed")]
+            )
+            second = self.service.update_content_embeddings()
+        self.assertEqual(first.items, 2)
+        self.assertGreater(first.passages, 2)
+        self.assertEqual(tuple(second), (1, 1))
+
+    def test_worker_pool_fills_rows_in_order(self):
+        """Test that batches encoded by the process pool land in the right rows"""
+        def fake_pool(model_name, batches, workers):
+            self.assertEqual(workers, 3)
+            self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+            for batch in batches:
+                yield self.fake_encode(batch)
+
+        items = [fake_item(i, "T" * i) for i in range(1, 6)]
+        with mock.patch("content.embeddings.encode_in_processes", side_effect=fake_pool):
+            self.assertEqual(self.update(items, full=True, workers=3, batch_size=2), 5)
+        expected = normalize_rows(self.fake_encode([f"{'T' * i}. Body" for i in range(1, 6)]))
+        np.testing.assert_allclose(self.service.embeddings, expected, rtol=1e-6)
+
+    def test_full_mode_reencodes_everything(self):
+        """Test that full mode ignores stored hashes"""
+        self.update([fake_item(1, "A"), fake_item(2, "B")])
+        self.assertEqual(self.update([fake_item(1, "A"), fake_item(2, "B")], full=True), 2)
+
+
+class FilteredRetrievalTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.service = service_in(self.tmpdir.name)
+        self.service.model = object()
+        records = [
+            {"id": i, "title": f"Item {i}", "content_type": "event" if i == 9 else "news",
+             "university_id": 1 if i % 2 else 2}
+            for i in range(10)
+        ]
+        self.service.store.publish(np.eye(10, dtype=np.float32), ColumnarMetadata.from_records(records), "test")
+        self.service.embed_query = lambda query: np.full(10, 1 / np.sqrt(10), dtype=np.float32)
+
+    def test_scoped_to_university(self):
+        """Test that results only come from the requested university"""
+        results = self.service.retrieve_relevant_content("news", k=3, university_id=2)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(item["university_id"] == 2 for item in results))
+
+    def test_rare_content_type(self):
+        """Test that a rare content type is found even though other rows score as well"""
+        results = self.service.retrieve_relevant_content("events", k=3, content_type="event")
+        self.assertEqual([item["id"] for item in results], [9])
+        self.assertEqual(self.service.retrieve_relevant_content("events", content_type="event", university_id=2), [])
+
+
+class LexicalIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.texts = [
+            "Open day on campus this Saturday",
+            "CSY1019 software engineering lecture moved to the Learning Hub",
+            "Graduation ceremony dates for 2025 announced",
+        ]
+        self.index = LexicalIndex.build([Counter(tokenize(text)) for text in self.texts])
+
+    def test_tokenize_keeps_codes_and_years(self):
+        """Test that module codes and years survive tokenisation"""
+        self.assertEqual(tokenize("Where is CSY1019 in 2025?"), ["csy1019", "2025"])
+
+    def test_exact_token_match(self):
+        """Test that a module code finds its document"""
+        rows, scores = self.index.search("csy1019 room", k=2)
+        self.assertEqual(rows.tolist(), [1])
+        self.assertGreater(scores[0], 0)
+
+    def test_mask_and_unknown_terms(self):
+        """Test that masked rows and unknown terms produce no hits"""
+        mask = np.array([True, False, True])
+        self.assertEqual(len(self.index.search("csy1019", k=2, mask=mask)[0]), 0)
+        self.assertEqual(len(self.index.search("zzzz", k=2)[0]), 0)
+
+    def test_incremental_build_reuses_previous_rows(self):
+        """Test that reused rows keep their postings when the vocabulary grows"""
+        updated = LexicalIndex.build([1, Counter(tokenize("Library opening hours")), 2], previous=self.index)
+        self.assertEqual(updated.search("csy1019", k=1)[0].tolist(), [0])
+        self.assertEqual(updated.search("library", k=1)[0].tolist(), [1])
+        self.assertEqual(updated.search("graduation 2025", k=1)[0].tolist(), [2])
+
+    def test_reciprocal_rank_fusion(self):
+        """Test that rows ranked by both lists come first"""
+        fused = reciprocal_rank_fusion([np.array([1, 2, 3]), np.array([3, 4])], k=2)
+        self.assertEqual([row for row, _ in fused], [3, 1])
+
+
+class HybridRetrievalTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.service = service_in(self.tmpdir.name)
+        self.service.model = object()
+        texts = ["Open day on campus", "CSY1019 exam moved", "Library opening hours"]
+        records = [{"id": i, "title": text, "content_type": "news"} for i, text in enumerate(texts)]
+        lexical = LexicalIndex.build([Counter(tokenize(text)) for text in texts])
+        embeddings = np.eye(3, dtype=np.float32)
+        self.service.store.publish(embeddings, ColumnarMetadata.from_records(records), "test", lexical)
+        # The query embedding points at the open day, so only BM25 knows about the module code
+        self.service.embed_query = lambda query: np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+    def test_lexical_match_is_fused_in(self):
+        """Test that an exact-token hit is returned alongside the vector hit"""
+        results = self.service.retrieve_relevant_content("When is the CSY1019 exam?", k=2)
+        self.assertEqual({item["id"] for item in results}, {0, 1})
+        self.assertIn("rrf_score", results[0])
+        self.assertEqual({item["id"] for item in results if item["lexical_match"]}, {1})
+
+    def test_vector_only_when_disabled(self):
+        """Test that hybrid search can be switched off"""
+        self.service.hybrid_search = False
+        results = self.service.retrieve_relevant_content("When is the CSY1019 exam?", k=1)
+        self.assertEqual([item["id"] for item in results], [0])
+
+
+class ChunkingTest(SimpleTestCase):
+    def test_short_text_is_one_passage(self):
+        """Test that short text is not split"""
+        self.assertEqual(chunk_text("One sentence. Two sentences."), ["One sentence. Two sentences."])
+        self.assertEqual(chunk_text(""), [])
+
+    def test_passages_respect_size_and_overlap(self):
+        """Test that passages end at sentence boundaries and share one sentence"""
+        text = " ".join(f"This is sentence {i}." for i in range(20))
+        chunks = chunk_text(text, max_chars=80, overlap=1)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 80 for chunk in chunks))
+        self.assertTrue(all(chunk.endswith(".") for chunk in chunks))
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertTrue(current.startswith(previous.split(". ")[-1]))
+
+    def test_long_sentence_is_split_at_words(self):
+        """Test that a sentence longer than a passage is broken at word boundaries"""
+        chunks = chunk_text("word " * 100, max_chars=50, overlap=0)
+        self.assertTrue(all(len(chunk) <= 50 for chunk in chunks))
+        self.assertEqual(" ".join(chunks).split(), ["word"] * 100)
+
+
+class PassageRetrievalTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.service = service_in(self.tmpdir.name)
+        self.service.model = object()
+        self.service.hybrid_search = False
+        records = [
+            {"id": 1, "title": "Open day", "passage": "Tours start at 10.", "chunk_index": 0},
+            {"id": 1, "title": "Open day", "passage": "Parking is free.", "chunk_index": 1},
+            {"id": 2, "title": "Parking", "passage": "Permits are required.", "chunk_index": 0},
+        ]
+        embeddings = normalize_rows(np.array([[1.0, 0.0], [0.9, 0.1], [0.5, 0.5]]))
+        self.service.store.publish(embeddings, ColumnarMetadata.from_records(records), "test")
+        self.service.embed_query = lambda query: np.array([1.0, 0.0], dtype=np.float32)
+
+    def test_best_passage_per_item(self):
+        """Test that results are de-duplicated by item and carry the best passage"""
+        results = self.service.retrieve_relevant_content("open day", k=2)
+        self.assertEqual([item["id"] for item in results], [1, 2])
+        self.assertEqual(results[0]["passage"], "Tours start at 10.")
+
+    def test_k_items_despite_many_passages_of_one_item(self):
+        """Test that an item with more passages than the search depth does not hide other matches"""
+        records = [{"id": 1, "title": "Open day", "passage": f"Part {i}.", "chunk_index": i} for i in range(40)]
+        records += [{"id": 2, "title": "Parking", "passage": "Permits.", "chunk_index": 0},
+                    {"id": 3, "title": "Library", "passage": "Hours.", "chunk_index": 0}]
+        embeddings = normalize_rows(np.array([[1.0, 0.01 * i] for i in range(40)] + [[0.5, 0.5], [0.2, 0.8]]))
+        lexical = LexicalIndex.build([Counter(tokenize(f"{r['title']} {r['passage']}")) for r in records])
+        self.service.store.publish(embeddings, ColumnarMetadata.from_records(records), "test", lexical)
+        self.service.snapshot = None
+        for hybrid in (False, True):
+            self.service.hybrid_search = hybrid
+            results = self.service.retrieve_relevant_content("open day", k=3)
+            self.assertEqual([item["id"] for item in results], [1, 2, 3])
+
+    def test_include_embeddings(self):
+        """Test that results can carry their passage vectors for re-ranking"""
+        results = self.service.retrieve_relevant_content("open day", k=2, include_embeddings=True)
+        np.testing.assert_allclose(results[0]["embedding"], [1.0, 0.0])
+        self.assertNotIn("embedding", self.service.retrieve_relevant_content("open day", k=1)[0])
+
+
+class QueryEncoderTest(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+
+    def fake_encode(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+    def test_cache_hits_on_normalised_text(self):
+        """Test that case and spacing variants share one cached embedding"""
+        encoder = QueryEncoder(self.fake_encode, cache_size=10, batch_window_ms=0)
+        first = encoder.encode("Open  Day")
+        second = encoder.encode("open day ")
+        self.assertIs(first, second)
+        self.assertEqual(self.calls, [["open day"]])
+        self.assertFalse(first.flags.writeable)
+        self.assertEqual(encoder.stats()["hits"], 1)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used query is evicted"""
+        encoder = QueryEncoder(self.fake_encode, cache_size=2, batch_window_ms=0)
+        for query in ("a", "b", "a", "c", "a", "b"):
+            encoder.encode(query)
+        self.assertEqual(self.calls, [["a"], ["b"], ["c"], ["b"]])
+
+    def test_concurrent_queries_are_batched(self):
+        """Test that queries arriving together are encoded in one call"""
+        encoder = QueryEncoder(self.fake_encode, cache_size=0, batch_window_ms=200, max_batch=8)
+        results = {}
+        threads = [
+            threading.Thread(target=lambda i=i: results.__setitem__(i, encoder.encode("q" * (i + 1))))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLess(len(self.calls), 8)
+        self.assertEqual(sum(len(call) for call in self.calls), 8)
+        self.assertEqual({i: results[i][0] for i in range(8)}, {i: i + 1 for i in range(8)})
+
+    def test_encode_many_mixes_cached_and_new(self):
+        """Test that encode_many encodes only uncached, distinct queries, in one batch"""
+        encoder = QueryEncoder(self.fake_encode, cache_size=10, batch_window_ms=0)
+        encoder.encode("open day")
+        embeddings = encoder.encode_many(["Open day", "library", "library"])
+        self.assertEqual(embeddings[:, 0].tolist(), [8, 7, 7])
+        self.assertEqual(self.calls, [["open day"], ["library"]])
+
+    def test_errors_reach_every_caller(self):
+        """Test that an encoding failure is raised to the waiting caller"""
+        def failing_encode(texts):
+            raise RuntimeError("model unavailable")
+        encoder = QueryEncoder(failing_encode, batch_window_ms=0)
+        with self.assertRaises(RuntimeError):
+            encoder.encode("open day")
+
+
+class EmbeddingStartupTest(SimpleTestCase):
+    def test_web_modules_do_not_import_the_model_stack(self):
+        """Test that importing the AI views and service leaves sentence-transformers and torch unloaded"""
+        probe = (
+            "import sys, django; django.setup(); import core.views, ai.ai_service; "
+            "print('torch' in sys.modules or 'sentence_transformers' in sys.modules)"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="virtuaid.settings")
+        output = subprocess.run(
+            [sys.executable, "-c", probe], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        self.assertEqual(output.strip().splitlines()[-1], "False")
+
+    def test_warm_up_only_in_serving_processes(self):
+        """Test that warm-up is opt-in and skipped for management commands and the Celery parent"""
+        self.assertFalse(should_warm_up_embeddings(["gunicorn"]))
+        with mock.patch.dict(os.environ, {"CONTENT_EMBEDDING_WARMUP": "True", "RUN_MAIN": ""}):
+            self.assertTrue(should_warm_up_embeddings(["gunicorn", "virtuaid.wsgi"]))
+            self.assertTrue(should_warm_up_embeddings(["manage.py", "runserver", "--noreload"]))
+            self.assertFalse(should_warm_up_embeddings(["manage.py", "runserver"]))
+            self.assertFalse(should_warm_up_embeddings(["manage.py", "migrate"]))
+            self.assertFalse(should_warm_up_embeddings(["celery", "-A", "virtuaid", "worker"]))
+
+    def test_warm_up_loads_model_and_snapshot(self):
+        """Test that warm-up runs one encode and opens the published snapshot"""
+        service = ContentEmbeddingService()
+        with mock.patch.object(service, "_load_model") as load_model, \
+                mock.patch.object(service, "generate_embeddings") as generate, \
+                mock.patch.object(service, "_ensure_embeddings_exist") as ensure:
+            service.warm_up_in_background().join(timeout=5)
+        load_model.assert_called_once()
+        generate.assert_called_once()
+        ensure.assert_called_once()
+
+
+class EmbeddingServerTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.url = f"unix://{self.directory.name}/embeddings.sock"
+        self.calls = []
+        service = SimpleNamespace(
+            model_name="test-model",
+            snapshot=None,
+            _encode_queries=self.fake_encode,
+            retrieve_relevant_content=lambda query, k, **filters: [{"id": 1, "title": query, "k": k, **filters}],
+        )
+        self.server = EmbeddingServer(service, self.url)
+        self.server.bind()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.server.shutdown)
+
+    def fake_encode(self, texts):
+        self.calls.append(list(texts))
+        return normalize_rows(np.array([[len(text), 1.0, 0.0] for text in texts]))
+
+    def test_encode_and_search_over_unix_socket(self):
+        """Test that the client gets embeddings and search results from the server"""
+        client = EmbeddingServerClient(self.url)
+        embeddings = client.encode(["Open Day", "library"])
+        np.testing.assert_allclose(embeddings, self.fake_encode(["Open Day", "library"]), rtol=1e-6)
+        # Texts are encoded exactly as sent
+        self.assertEqual(self.calls[0], ["Open Day", "library"])
+
+        results = client.search("open day", k=2, university_id=3, date_from=None)
+        self.assertEqual(results, [{"id": 1, "title": "open day", "k": 2, "university_id": 3, "date_from": None}])
+        self.assertEqual(client.health()["model"], "test-model")
+
+    def test_concurrent_clients_share_batches(self):
+        """Test that requests from several client threads are encoded together"""
+        client = EmbeddingServerClient(self.url)
+        self.server.encoder.batch_window = 0.2
+        threads = [threading.Thread(target=client.encode, args=([f"query {i}"],)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(len(self.calls), 6)
+        self.assertEqual(sum(len(call) for call in self.calls), 6)
+
+    def test_service_falls_back_to_local_model(self):
+        """Test that an unreachable server marks the client unavailable and the local model is used"""
+        service = ContentEmbeddingService(server_url=f"unix://{self.directory.name}/missing.sock")
+        service.model = mock.Mock()
+        service.model.encode.return_value = np.ones((1, 3), dtype=np.float32)
+        embeddings = service.generate_embeddings(["open day"])
+        self.assertEqual(embeddings.shape, (1, 3))
+        self.assertFalse(service.server.available())
+        with self.assertRaises(EmbeddingServerError):
+            service.server.encode(["open day"])
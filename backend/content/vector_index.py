@@ -0,0 +1,279 @@
+import os
+from typing import Tuple
+
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return float32 copies of the vectors scaled to unit length"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the positions of the k highest scores, best first, without a full sort"""
+    if k <= 0 or scores.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class QuantizedVectors:
+    """
+    int8 scalar-quantized copy of normalised vectors for a compact coarse scan.
+
+    Each vector is stored as int8 codes with its own float32 scale, a quarter of
+    the float32 size. A scan widens one block of codes at a time into a small
+    reused float32 buffer that stays in cache, so it reads a quarter of the
+    bytes from memory. Scores are approximate, so indexes re-rank a shortlist
+    with the float32 vectors.
+
+    The codes are published with each snapshot and memory-mapped like the
+    float32 vectors, so all workers on a host share one copy.
+    """
+
+    KINDS = ("int8",)
+    ARRAYS = ("codes", "scales")
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray, block_size: int = 256):
+        self.codes = codes
+        self.scales = scales
+        self.block_size = block_size
+
+    @classmethod
+    def encode(cls, vectors: np.ndarray) -> "QuantizedVectors":
+        scales = np.abs(vectors).max(axis=1).astype(np.float32) / 127
+        scales[scales == 0] = 1.0
+        return cls(np.round(vectors / scales[:, None]).astype(np.int8), scales)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: str) -> "QuantizedVectors":
+        return cls(*(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in cls.ARRAYS))
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def scores(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """Approximate dot products with the query, for all rows or the given ones"""
+        query = np.asarray(query, dtype=np.float32)
+        count = len(self) if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        buffer = np.empty((min(self.block_size, count), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, count, self.block_size):
+            stop = min(start + self.block_size, count)
+            block = self.codes[start:stop] if rows is None else self.codes[rows[start:stop]]
+            widened = buffer[:stop - start]
+            np.copyto(widened, block, casting="unsafe")
+            np.dot(widened, query, out=scores[start:stop])
+        scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+
+class VectorIndex:
+    """
+    Base class for cosine-similarity search over L2-normalised vectors.
+
+    search() returns (row indices, scores) ordered best first. Vectors passed to
+    an index must already be normalised so that a dot product is a cosine.
+
+    With `quantization` set, candidates are scored against an int8 copy of the
+    vectors (`quantized`, or encoded here when not given), and the best
+    `k * rerank_factor` are re-scored with the float32 vectors, so the returned
+    scores are always exact.
+    """
+
+    kind = None
+
+    def __init__(self, vectors: np.ndarray, quantization: str = None, rerank_factor: int = None,
+                 quantized: QuantizedVectors = None):
+        self.vectors = vectors
+        self.quantized = None
+        if quantization:
+            if quantization not in QuantizedVectors.KINDS:
+                raise ValueError(f"Unknown vector quantization: {quantization}")
+            self.quantized = quantized if quantized is not None else QuantizedVectors.encode(vectors)
+        self.rerank_factor = max(1, rerank_factor or int(os.getenv("CONTENT_RERANK_FACTOR", "4")))
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def scan_bytes(self) -> int:
+        """Size of the vectors every query scans"""
+        return self.quantized.nbytes if self.quantized is not None else self.vectors.nbytes
+
+    def search(self, query: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the k best rows; with a boolean mask, only rows where it is True.
+
+        Filtered searches return k results whenever k rows match the filter.
+        """
+        raise NotImplementedError
+
+    def _search_rows(self, query: np.ndarray, k: int, rows: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact search restricted to the given rows (all rows when None)"""
+        if self.quantized is None:
+            scores = (self.vectors if rows is None else self.vectors[rows]) @ query
+            best = top_k(scores, k)
+            return (best if rows is None else rows[best]), scores[best]
+
+        # Coarse scan over the compact codes, then float32 scores for a shortlist only
+        shortlist = top_k(self.quantized.scores(query, rows), k * self.rerank_factor)
+        if rows is not None:
+            shortlist = rows[shortlist]
+        scores = self.vectors[shortlist] @ query
+        best = top_k(scores, k)
+        return shortlist[best], scores[best]
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force search: one matrix-vector product over every vector"""
+
+    kind = "exact"
+
+    def search(self, query: np.ndarray, k: int, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self._search_rows(query, k, np.flatnonzero(mask) if mask is not None else None)
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file index for approximate search.
+
+    Vectors are clustered around `nlist` centroids with spherical k-means and
+    stored grouped by cluster. A query scores the centroids, then only the
+    vectors in the `nprobe` closest clusters. Raising nprobe trades latency for
+    recall; nprobe == nlist is an exact search.
+
+    Filtered searches scan the matching rows directly when the filter is
+    selective (at most `filter_exact_fraction` of the corpus). Otherwise probing
+    widens to more clusters until at least k matching candidates are found.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, vectors: np.ndarray, nlist: int = None, nprobe: int = None,
+                 n_iter: int = 10, seed: int = 0, quantization: str = None, rerank_factor: int = None,
+                 quantized: QuantizedVectors = None):
+        super().__init__(vectors, quantization, rerank_factor, quantized)
+        count = vectors.shape[0]
+        self.nlist = max(1, min(nlist or int(np.sqrt(count)), count))
+        self.nprobe = max(1, min(nprobe or int(os.getenv("CONTENT_IVF_NPROBE", "8")), self.nlist))
+        self.filter_exact_fraction = float(os.getenv("CONTENT_FILTER_EXACT_FRACTION", "0.05"))
+        self.centroids = self._train(vectors, n_iter, np.random.default_rng(seed))
+
+        # Store row ids grouped by cluster so each list is a contiguous slice
+        assignments = self._assign(vectors)
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.searchsorted(assignments[self.order], np.arange(self.nlist + 1))
+
+    def _assign(self, vectors: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+        assignments = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], batch_size):
+            batch = vectors[start:start + batch_size]
+            assignments[start:start + batch_size] = np.argmax(batch @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train(self, vectors: np.ndarray, n_iter: int, rng) -> np.ndarray:
+        # Train on a sample; ~64 points per centroid is plenty for good clusters
+        sample_size = min(vectors.shape[0], self.nlist * 64)
+        sample = vectors[np.sort(rng.choice(vectors.shape[0], sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, self.nlist, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = ~sums.any(axis=1)
+            # Keep the previous centroid for clusters that lost all their points
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def search(self, query: np.ndarray, k: int, mask: np.ndarray = None,
+               nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        target = k
+        if mask is not None:
+            allowed = int(np.count_nonzero(mask))
+            if allowed <= self.filter_exact_fraction * len(self):
+                return self._search_rows(query, k, np.flatnonzero(mask))
+            target = min(k, allowed)
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        ranked = np.argsort(-(self.centroids @ query))
+        chunks = []
+        found = probed = 0
+        # Widen the probe until enough candidates survive the filter
+        while True:
+            for i in ranked[probed:nprobe]:
+                rows = self.order[self.offsets[i]:self.offsets[i + 1]]
+                if mask is not None:
+                    rows = rows[mask[rows]]
+                chunks.append(rows)
+                found += len(rows)
+            probed = nprobe
+            if found >= target or probed >= self.nlist:
+                break
+            nprobe = min(self.nlist, nprobe * 2)
+
+        return self._search_rows(query, k, np.concatenate(chunks))
+
+
+INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def build_index(vectors: np.ndarray, kind: str = None, quantization: str = None,
+                quantized: QuantizedVectors = None) -> VectorIndex:
+    """
+    Build the configured index over normalised vectors.
+
+    CONTENT_INDEX_TYPE selects "exact", "ivf" or "auto" (the default), which uses
+    exact search below CONTENT_IVF_MIN_SIZE vectors where a full scan is already
+    cheap and clustering would only cost recall.
+
+    CONTENT_VECTOR_QUANTIZATION ("none" or "int8") selects the compact copy
+    scanned before float32 re-ranking; `quantized` is the snapshot's published
+    copy, if it has one.
+    """
+    kind = kind or os.getenv("CONTENT_INDEX_TYPE", "auto")
+    if quantization is None:
+        quantization = os.getenv("CONTENT_VECTOR_QUANTIZATION", "none")
+    quantization = None if quantization == "none" else quantization
+    if vectors.shape[0] == 0:
+        kind = ExactIndex.kind
+    elif kind == "auto":
+        min_size = int(os.getenv("CONTENT_IVF_MIN_SIZE", "20000"))
+        kind = IVFIndex.kind if vectors.shape[0] >= min_size else ExactIndex.kind
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {kind}")
+    if kind == IVFIndex.kind:
+        nlist = int(os.getenv("CONTENT_IVF_NLIST", "0")) or None
+        return IVFIndex(vectors, nlist=nlist, quantization=quantization, quantized=quantized)
+    return ExactIndex(vectors, quantization, quantized=quantized)
+
+
+def recall_at_k(index: VectorIndex, queries: np.ndarray, k: int = 10) -> float:
+    """Fraction of the exact top-k neighbours that the index also returns"""
+    exact = ExactIndex(index.vectors)
+    found = 0
+    for query in queries:
+        expected, _ = exact.search(query, k)
+        actual, _ = index.search(query, k)
+        found += len(np.intersect1d(expected, actual))
+    return found / float(len(queries) * min(k, len(index)))
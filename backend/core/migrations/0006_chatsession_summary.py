@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_chatsession_chatmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='_encrypted_summary',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summarized_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
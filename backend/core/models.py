@@ -152,6 +152,13 @@ class User(AbstractUser):
     # Additional fields
     university = models.ForeignKey('University', on_delete=models.SET_NULL, null=True, blank=True, related_name='students')
     
+    def get_university_id(self):
+        """Return the university chosen during onboarding, falling back to the account field"""
+        profile = getattr(self, 'profile', None)
+        if profile is not None and profile.university_id:
+            return profile.university_id
+        return self.university_id
+    
     def __str__(self):
         return self.username
 
@@ -261,6 +268,10 @@ class ChatSession(models.Model):
     last_updated = models.DateTimeField(auto_now=True)
     is_archived = models.BooleanField(default=False)
     
+    # Running summary of older turns, maintained by ai.tasks.update_session_summary
+    _encrypted_summary = models.TextField(blank=True, null=True)
+    summarized_message_id = models.BigIntegerField(null=True, blank=True)  # Last message folded into the summary
+    
     class Meta:
         ordering = ['-last_updated']
         verbose_name = "Chat Session"
@@ -268,6 +279,16 @@ class ChatSession(models.Model):
     
     def __str__(self):
         return f"{self.title} - {self.user.username} ({self.created_at.strftime('%Y-%m-%d')})"
+    
+    @property
+    def summary(self):
+        if self._encrypted_summary:
+            return decrypt_data(self._encrypted_summary)
+        return ""
+    
+    @summary.setter
+    def summary(self, value):
+        self._encrypted_summary = encrypt_data(value) if value else None
 
 class ChatMessage(models.Model):
     """Model to store messages within a chat session"""
@@ -0,0 +1,153 @@
+import json
+import os
+from unittest import mock
+
+from cryptography.fernet import Fernet
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from ai.admission import AdmissionRejected
+from ai.ai_service import ollama_health_monitor, ollama_service, ollama_summarizer
+from ai.query_router import ROUTE_COURSE_HELP, RouteDecision
+from ai.views import AIQueryView
+from ..models import ChatMessage, ChatSession
+from ..views import ChatSessionViewSet
+
+User = get_user_model()
+
+
+def parse_events(response):
+    """Split a server-sent event stream into (event, data) pairs"""
+    body = b"".join(response.streaming_content).decode()
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def use_encryption_key(test):
+    """Give the encrypted model fields a key for the duration of the test"""
+    patcher = mock.patch.dict(os.environ, {"ENCRYPTION_KEY": Fernet.generate_key().decode()})
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def rejected_stream(*args, **kwargs):
+    raise AdmissionRejected("queue is full", retry_after=7)
+    yield
+
+
+class ChatSessionMessageTest(TestCase):
+    def setUp(self):
+        use_encryption_key(self)
+        self.user = User.objects.create_user(username="student", password="testpass123", email="student@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Answer every message with the LLM rather than a canned or cached reply
+        for patcher in (
+            mock.patch.object(ollama_service, "route_query", return_value=RouteDecision(ROUTE_COURSE_HELP, "default")),
+            mock.patch.object(ollama_service.semantic_cache, "get", return_value=None),
+            mock.patch.object(ollama_service.semantic_cache, "put"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, path):
+        return self.client.post(path, {"session_id": self.session.id, "message": "What is recursion?"},
+                                format="json")
+
+    def test_stream_sends_tokens_then_done(self):
+        """Test that tokens are streamed as events and the reply is saved once, in the final done event"""
+        tokens = iter(["A function", " calling itself."])
+        with mock.patch.object(ollama_service, "generate_response_stream", return_value=tokens):
+            response = self.post("/api/chat-sessions/message/stream/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            events = parse_events(response)
+
+        self.assertEqual(events[:2], [("message", {"token": "A function"}), ("message", {"token": " calling itself."})])
+        self.assertEqual(len(events), 3)
+        event, data = events[2]
+        self.assertEqual(event, "done")
+        self.assertEqual(data["message"], "A function calling itself.")
+        self.assertFalse(data["is_user_message"])
+
+        replies = ChatMessage.objects.filter(session=self.session, is_user_message=False)
+        self.assertEqual(replies.count(), 1)
+        self.assertEqual(replies.get().message, "A function calling itself.")
+        self.assertEqual(ChatMessage.objects.filter(session=self.session, is_user_message=True).count(), 1)
+
+    def test_stream_rejected_when_saturated(self):
+        """Test that a rejected stream is a plain 503 with Retry-After and saves nothing"""
+        with mock.patch.object(ollama_service, "generate_response_stream", side_effect=rejected_stream):
+            response = self.post("/api/chat-sessions/message/stream/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertIn("fallback_message", response.json())
+        self.assertFalse(ChatMessage.objects.filter(session=self.session).exists())
+
+    def test_message_rejected_when_saturated(self):
+        """Test that the message endpoint answers 503 with Retry-After and rolls back the user message"""
+        with mock.patch.object(ollama_service, "generate_response",
+                               side_effect=AdmissionRejected("queue is full", retry_after=7)):
+            response = self.post("/api/chat-sessions/message/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertFalse(ChatMessage.objects.filter(session=self.session).exists())
+
+
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        use_encryption_key(self)
+        self.user = User.objects.create_user(username="student", password="testpass123", email="student@example.com")
+        self.session = ChatSession.objects.create(user=self.user)
+
+    def test_every_turn_is_in_summary_or_history(self):
+        """Test that no message falls between the summary and the prompt history as a session grows"""
+        messages = []
+        with mock.patch.object(ollama_service, "generate_response", return_value="Summary so far."):
+            for count in range(1, 15):
+                messages.append(ChatMessage.objects.create(
+                    session=self.session, user=self.user, message=f"turn {count}", is_user_message=count % 2 == 1
+                ))
+                ollama_summarizer.summarize(self.session)
+                self.session.refresh_from_db()
+                if count < 11:
+                    continue
+
+                history = [turn["content"] for turn in ChatSessionViewSet()._get_history(self.session)]
+                folded = self.session.summarized_message_id or 0
+                expected = [message.message for message in messages if message.id > folded]
+                self.assertEqual(history, expected, f"after {count} messages")
+        # The threshold was passed on the way, so the oldest turns are in the summary
+        self.assertEqual(self.session.summary, "Summary so far.")
+        self.assertLess(len(history), 14)
+
+
+class AIQueryViewTest(TestCase):
+    def setUp(self):
+        use_encryption_key(self)
+        self.user = User.objects.create_user(username="student", password="testpass123", email="student@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rejected_when_saturated(self):
+        """Test that the query endpoint answers 503 with Retry-After when no generation slot frees up"""
+        service = AIQueryView.ai_service
+        with mock.patch.object(service.circuit_breaker, "is_open", return_value=False), \
+                mock.patch.object(ollama_health_monitor, "get_status",
+                                  return_value={"service_available": True, "model_available": True}), \
+                mock.patch.object(service, "route_query", return_value=RouteDecision(ROUTE_COURSE_HELP, "default")), \
+                mock.patch.object(service.semantic_cache, "get", return_value=None), \
+                mock.patch.object(service, "generate_response",
+                                  side_effect=AdmissionRejected("queue is full", retry_after=7)):
+            response = self.client.post("/api/ai/query/", {"query": "What is recursion?"}, format="json")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertIn("fallback_message", response.json())
@@ -1,3 +1,5 @@
+import json
+import itertools
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -5,6 +7,8 @@ from rest_framework.views import APIView
 from django.contrib.auth import login, authenticate, logout
 from django.utils import timezone
 from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
 from .models import (
     ChatHistory, User, University, Course, UniversityContent, UserProfile,
     ChatSession, ChatMessage
@@ -29,8 +33,10 @@ from django.utils.decorators import method_decorator
 from django.middleware.csrf import get_token
 from .decorators import jwt_view_csrf_exempt
 
-# Import the OllamaService from the ai app
-from ai.ai_service import OllamaService
+# Import the shared OllamaService instance and health monitor from the ai app
+from ai.ai_service import ollama_service, ollama_health_monitor, ollama_summarizer
+from ai.admission import AdmissionRejected, PRIORITY_INTERACTIVE
+from ai.tasks import update_session_summary
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
@@ -496,9 +502,6 @@ class ChatHistoryAPIView(APIView):
         """
         Process a new chat message and generate a response using Ollama
         """
-        # Initialize the Ollama service
-        ollama_service = OllamaService()
-        
         # Extract data from the request
         user_message = request.data.get('message', '')
         course_id = request.data.get('course')
@@ -533,14 +536,17 @@ class ChatHistoryAPIView(APIView):
             
             # Only generate a response for user messages
             if is_user_message:
-                # Check for availability of LLM service
-                if not ollama_service.is_model_available():
-                    # Try to pull the model
-                    ollama_service.pull_model()
+                # Check the cached availability of the LLM service
+                health = ollama_health_monitor.get_status()
+                if health['service_available'] and not health['model_available']:
+                    # Pull the model on a Celery worker instead of blocking this request
+                    ollama_health_monitor.request_model_pull()
                     
-                # Check if message might be inappropriate
-                if ollama_service.is_off_topic(user_message):
-                    ai_response = "I'm sorry, but I can't assist with that type of request. Please ask something related to your academic studies."
+                # Off-topic messages and small talk get a fixed reply without calling the LLM
+                route = ollama_service.route_query(user_message)
+                canned_response = route.canned_reply
+                if canned_response is not None:
+                    ai_response = canned_response
                 else:
                     # Generate AI response using Ollama
                     try:
@@ -553,12 +559,30 @@ class ChatHistoryAPIView(APIView):
                         Provide a helpful, educational response.
                         """
                         
-                        # Get response from Ollama
-                        ai_response = ollama_service.generate_response(user_prompt)
+                        # Reuse the answer to a near-identical question if one is cached
+                        university_id = request.user.get_university_id()
+                        course_scope = course.id if course else None
+                        ai_response = ollama_service.semantic_cache.get(user_message, university_id, course_scope)
+                        
+                        if ai_response is None:
+                            # Get response from Ollama
+                            # Route and retrieve on the student's message rather than the template
+                            ai_response = ollama_service.generate_response(
+                                user_prompt, university_id=university_id, route=route, retrieval_query=user_message
+                            )
+                            if ollama_service.is_usable_response(ai_response):
+                                ollama_service.semantic_cache.put(user_message, ai_response, university_id, course_scope)
                         
                         # If generation fails, use fallback
                         if ai_response.startswith("Error"):
                             ai_response = ollama_service.get_fallback_message()
+                    except AdmissionRejected as e:
+                        # The AI service is saturated; ask the client to retry shortly
+                        return Response(
+                            {"error": str(e), "fallback_message": ollama_service.get_fallback_message()},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": str(e.retry_after)}
+                        )
                     except Exception as e:
                         # Use fallback response if generation fails
                         print(f"Error generating response: {str(e)}")
@@ -602,18 +626,17 @@ class ChatStatusAPIView(APIView):
         """
         Check if the Ollama service is available and functioning properly
         """
-        # Initialize the Ollama service
-        ollama_service = OllamaService()
-        
-        # Check service status
-        is_available, message = ollama_service.get_service_status()
+        # Read the cached service status, probing only if nothing is cached yet
+        health = ollama_health_monitor.get_status(wait=True)
+        is_available = health["model_available"]
         
         # Return status information
         return Response({
             "service_available": is_available,
-            "message": message,
+            "message": health["message"],
             "model": ollama_service.model_name,
-            "server_url": ollama_service.base_url
+            "server_url": ollama_service.base_url,
+            "backends": health.get("backends", [])
         }, status=status.HTTP_200_OK if is_available else status.HTTP_503_SERVICE_UNAVAILABLE)
 
 # REST framework views for ChatSession
@@ -647,6 +670,30 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
     
+    def _get_history(self, session, exclude_id=None):
+        """
+        Return recent messages in a session as chat history, oldest first
+        
+        Every message not yet folded into the session summary is included, so no
+        turn is in neither; the prompt builder trims them to the token budget,
+        dropping the oldest first.
+        """
+        context_messages = ollama_summarizer.recent_messages(session)
+        if exclude_id is not None:
+            context_messages = context_messages.exclude(id=exclude_id)
+        
+        return ollama_summarizer.history_for_prompt(context_messages)
+    
+    def _schedule_summary(self, session):
+        """Queue a background update of the session's running summary once the turn is committed"""
+        def schedule():
+            try:
+                update_session_summary.delay(session.id)
+            except Exception as e:
+                print(f"Error scheduling chat summary: {str(e)}")
+        
+        transaction.on_commit(schedule)
+    
     @action(detail=False, methods=['post'])
     def message(self, request):
         """Create a new message in a chat session and generate AI response"""
@@ -670,9 +717,6 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
                 except Course.DoesNotExist:
                     pass  # Continue without course
             
-            # Initialize the Ollama service
-            ollama_service = OllamaService()
-            
             with transaction.atomic():
                 # Create user message
                 user_message = ChatMessage.objects.create(
@@ -685,21 +729,32 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
                 )
                 
                 # Get context from previous messages for better continuity
-                context_messages = ChatMessage.objects.filter(
-                    session=session
-                ).order_by('-timestamp')[:10]  # Get last 10 messages
+                context = self._get_history(session, exclude_id=user_message.id)
+                summary = session.summary
                 
-                context = []
-                for msg in reversed(list(context_messages)):
-                    role = "user" if msg.is_user_message else "assistant"
-                    context.append({"role": role, "content": msg.message})
+                # Opening questions do not depend on history, so they can share cached answers
+                cacheable = not context and not summary
+                university_id = request.user.get_university_id()
+                course_scope = course.id if course else None
+                # Off-topic messages and small talk get a fixed reply without calling the LLM
+                route = ollama_service.route_query(message_text)
+                ai_response = route.canned_reply
+                if ai_response is None and cacheable:
+                    ai_response = ollama_service.semantic_cache.get(message_text, university_id, course_scope)
                 
-                # Generate AI response
-                ai_response = ollama_service.generate_response(
-                    message_text,
-                    context=context,
-                    course=course
-                )
+                if ai_response is None:
+                    # Generate AI response
+                    ai_response = ollama_service.generate_response(
+                        message_text,
+                        context=context,
+                        course=course,
+                        summary=summary,
+                        priority=PRIORITY_INTERACTIVE,
+                        university_id=university_id,
+                        route=route
+                    )
+                    if cacheable and ollama_service.is_usable_response(ai_response):
+                        ollama_service.semantic_cache.put(message_text, ai_response, university_id, course_scope)
                 
                 # Create AI message
                 ai_message = ChatMessage.objects.create(
@@ -711,6 +766,9 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
                     context_data={}
                 )
                 
+                # Compress older turns once the session grows long
+                self._schedule_summary(session)
+                
                 # Return AI message details
                 serializer = ChatMessageDetailSerializer(ai_message)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -720,11 +778,135 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
                 {"error": "Chat session not found"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        except AdmissionRejected as e:
+            # The AI service is saturated; ask the client to retry shortly
+            return Response(
+                {"error": str(e), "fallback_message": ollama_service.get_fallback_message()},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(e.retry_after)}
+            )
         except Exception as e:
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+    
+    @action(detail=False, methods=['post'], url_path='message/stream')
+    def message_stream(self, request):
+        """
+        Create a new message in a chat session and stream the AI response
+        
+        Tokens are forwarded as server-sent events while Ollama generates them.
+        The complete AI message is persisted once generation finishes and sent
+        as a final "done" event with the same payload as the message endpoint.
+        """
+        session_id = request.data.get('session_id')
+        message_text = request.data.get('message')
+        course_id = request.data.get('course')
+        
+        if not session_id or not message_text:
+            return Response(
+                {"error": "session_id and message are required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            session = ChatSession.objects.get(id=session_id, user=request.user)
+        except ChatSession.DoesNotExist:
+            return Response(
+                {"error": "Chat session not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        course = None
+        if course_id:
+            try:
+                course = Course.objects.get(id=course_id)
+            except Course.DoesNotExist:
+                pass  # Continue without course
+        
+        # Get context from previous messages for better continuity
+        context = self._get_history(session)
+        summary = session.summary
+        
+        # Opening questions do not depend on history, so they can share cached answers
+        cacheable = not context and not summary
+        university_id = request.user.get_university_id()
+        course_scope = course.id if course else None
+        # Off-topic messages and small talk get a fixed reply without calling the LLM
+        route = ollama_service.route_query(message_text)
+        cached_response = route.canned_reply
+        if cached_response is None and cacheable:
+            cached_response = ollama_service.semantic_cache.get(message_text, university_id, course_scope)
+        
+        if cached_response is not None:
+            tokens = iter([cached_response])
+        else:
+            # Start generating before sending headers so a saturated service gets a plain 503
+            tokens = ollama_service.generate_response_stream(
+                message_text,
+                context=context,
+                course=course,
+                summary=summary,
+                priority=PRIORITY_INTERACTIVE,
+                university_id=university_id,
+                route=route
+            )
+        try:
+            first_token = next(tokens, "")
+        except AdmissionRejected as e:
+            return Response(
+                {"error": str(e), "fallback_message": ollama_service.get_fallback_message()},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        
+        # Save the user message before streaming so it is never lost
+        ChatMessage.objects.create(
+            session=session,
+            user=request.user,
+            message=message_text,
+            is_user_message=True,
+            course=course,
+            context_data={}
+        )
+        user = request.user
+        
+        def event_stream():
+            response_parts = []
+            try:
+                for token in itertools.chain([first_token], tokens):
+                    if not token:
+                        continue
+                    response_parts.append(token)
+                    yield f"data: {json.dumps({'token': token})}\n\n"
+                
+                ai_response = "".join(response_parts) or ollama_service.get_fallback_message()
+                if cacheable and cached_response is None and ollama_service.is_usable_response(ai_response):
+                    ollama_service.semantic_cache.put(message_text, ai_response, university_id, course_scope)
+                
+                # Persist the AI message once, after the stream has completed
+                ai_message = ChatMessage.objects.create(
+                    session=session,
+                    user=user,
+                    message=ai_response,
+                    is_user_message=False,
+                    course=course,
+                    context_data={}
+                )
+                
+                self._schedule_summary(session)
+                
+                data = ChatMessageDetailSerializer(ai_message).data
+                yield f"event: done\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop reverse proxies (nginx) from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
 @jwt_view_csrf_exempt
 class UserAccountDeleteView(APIView):
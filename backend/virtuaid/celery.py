@@ -2,6 +2,7 @@ import os
 
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'virtuaid.settings')
@@ -38,8 +39,21 @@ app.conf.beat_schedule = {
         'task': 'content.tasks.update_content_embeddings',
         'schedule': crontab(hour=5, minute=0),  # Run at 5:00 AM daily (after scraping is done)
     },
+    
+    # Keep the cached Ollama health status fresh for request handlers
+    'refresh-ollama-health': {
+        'task': 'ai.tasks.refresh_ollama_health',
+        'schedule': float(os.getenv('OLLAMA_HEALTH_TTL', '30')),
+    },
 }
 
+@worker_process_init.connect
+def warm_up_embedding_model(**kwargs):
+    # Load the model in each child after the fork, so no torch state is shared across processes
+    if os.getenv('CONTENT_EMBEDDING_WARMUP', 'False').lower() == 'true':
+        from content.embeddings import content_embedding_service
+        content_embedding_service.warm_up_in_background()
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}') 
\ No newline at end of file
@@ -223,6 +223,20 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Cache Configuration
+# Redis so state such as the Ollama health status, the circuit breaker and the
+# content version is shared by web and Celery worker processes. It defaults to
+# its own database, apart from the Celery broker. Tests swap in per-process
+# memory (virtuaid/test_settings.py).
+CACHE_URL = os.getenv('CACHE_URL', 'redis://localhost:6379/1')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    }
+}
+TEST_RUNNER = 'virtuaid.test_settings.LocalCacheTestRunner'
+
 # Scraping Settings
 SCRAPING_SETTINGS = {
     'USER_AGENT': 'VirtuAId Bot (+https://virtuaid.com)',
@@ -0,0 +1,32 @@
+"""
+Django settings for running the VirtuAId test suite.
+
+Use this module directly (``DJANGO_SETTINGS_MODULE=virtuaid.test_settings``,
+as pytest does through pytest.ini) or through ``manage.py test``, whose runner
+applies the same cache settings to the default settings module.
+"""
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+from .settings import *  # noqa: F401,F403
+
+# Per-process memory so tests never touch, or depend on, a running Redis.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class LocalCacheTestRunner(DiscoverRunner):
+    """Test runner that swaps the shared Redis cache for per-process memory."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_override = override_settings(CACHES=CACHES)
+        self._cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_override.disable()
+        super().teardown_test_environment(**kwargs)